@@ -1,64 +1,51 @@
 # app.py
 
-from flask import Flask, request, jsonify, url_for
-from models import db, User
+from flask import request, jsonify, url_for
+from functools import wraps
+from models import db, User, Order, EmailList
 import os
-from urllib.parse import quote_plus
 from dotenv import load_dotenv
 from datetime import datetime
 from argon2 import PasswordHasher
-from pybloom_live import BloomFilter
+from password_policy import is_weak_password
 import secrets
-from urllib.parse import quote_plus
 
 # Bearer token import
 from flask_jwt_extended import JWTManager
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from auth_tokens import jwt_cached_required
+from serialization import stream_rows
 
 # Importing the SMTP lib
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-# Create a Flask web application instance
-app = Flask(__name__)
-
 # Load environment variables from .env file
 load_dotenv()
 
-# Database configuration - Retrieve values from environment variables
-db_name = os.getenv('DB_NAME')
-username = os.getenv('DB_USERNAME')
-password = quote_plus(os.getenv('DB_PASSWORD'))  # Encode the password with special characters
-host = os.getenv('DB_HOST')
-port = os.getenv('DB_PORT')
-
-# Construct the database URL using the retrieved configuration values
-db_url = f"postgresql://{username}:{password}@{host}:{port}/{db_name}"
-
-# Configure the Flask app with the database URL and disable modification tracking
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-db.init_app(app)
-
 # Password hasher instance
 ph = PasswordHasher()
 
 # Importing backend URL
 backend_url = os.getenv('BACKEND_URL')
 
-# Checking if the password is in 100K Most Common Passwords list
-
-password_file = "required_files/100k-most-used-passwords.txt"
-with open(password_file, "r", encoding="latin-1") as file:
-    rockyou_passwords = set(file.read().split("\n"))
-    bloom_filter = BloomFilter(capacity=len(rockyou_passwords), error_rate=0.1)
-    for password in rockyou_passwords:
-        bloom_filter.add(password)
-
-def is_weak_password(password):
-    return password in bloom_filter
    
-# Creating an admin
+# Only users with the admin role may call the view
+def admin_required():
+    def wrapper(fn):
+        @wraps(fn)
+        @jwt_cached_required()
+        def decorator(*args, **kwargs):
+            role = db.session.execute(db.select(User.role).where(User.email == get_jwt_identity())).scalar()
+            if role != 'admin':
+                return jsonify({"error": "Admin access required"}), 403
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
+
+# Creating an admin; only an existing admin can (the first one is made with flask make-admin)
+@admin_required()
 def register_admin():
     data = request.get_json()
 
@@ -85,10 +72,10 @@ def register_admin():
         last_name=data['last_name'],
         email=data['email'],
         password=ph.hash(data['password']),  # Hashing the password using Argon2
-        role=data.get('role', 'admin'),
+        role='admin',
         email_list=data.get('email_list', False),  # Default to False if not provided
-        verified_email=data.get('verified_email', True),  # Default to False if not provided
-        logged_in=data.get('logged_in', True),
+        verified_email=True,  # Created by an admin, so the address is trusted
+        logged_in=True,
         verification_code_created_at = datetime.utcnow(),
         created_at=datetime.utcnow(),
         updated_at=datetime.utcnow()
@@ -106,4 +93,62 @@ def register_admin():
         "email": new_user.email,
         "verified_email": new_user.verified_email,
         "access_token": access_token
-    }), 200
\ No newline at end of file
+    }), 200
+
+# ?after_id=&limit= pages by id; without limit the whole table is streamed
+def paginate_by_id(statement, id_column):
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if after_id is not None:
+        statement = statement.where(id_column > after_id)
+    statement = statement.order_by(id_column)
+    if limit:
+        statement = statement.limit(limit)
+    return statement
+
+# GET /admin/users - every user without password or verification data
+@admin_required()
+def admin_list_users():
+    statement = db.select(
+        User.id, User.first_name, User.last_name, User.email, User.role, User.email_list,
+        User.verified_email, User.created_at, User.updated_at
+    )
+    return stream_rows(paginate_by_id(statement, User.id))
+
+# GET /admin/orders - orders with the customer's email
+@admin_required()
+def admin_list_orders():
+    statement = db.select(
+        Order.id, Order.user_id, User.email, Order.order_date, Order.total_amount, Order.status, Order.paid_at
+    ).outerjoin(User, User.id == Order.user_id)
+    return stream_rows(paginate_by_id(statement, Order.id))
+
+# POST /admin/orders/<id>/paid - confirm the payment of an order (called once the payment provider has settled
+# it); only a pending order changes, so confirming twice keeps the first paid_at
+@admin_required()
+def admin_mark_order_paid(order_id):
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return jsonify({"error": "Order not found"}), 404
+
+    db.session.execute(
+        db.update(Order).where(Order.id == order_id, Order.status == 'pending').values(status='paid', paid_at=datetime.utcnow())
+    )
+    db.session.commit()
+    db.session.refresh(order)
+
+    if not order.is_paid:
+        return jsonify({"error": f"Order is {order.status}"}), 409
+    return jsonify(order.serialize()), 200
+
+# GET /admin/email_list - newsletter subscribers
+@admin_required()
+def admin_list_email_list():
+    statement = db.select(EmailList.id, EmailList.user_id, EmailList.first_name, EmailList.email)
+    return stream_rows(paginate_by_id(statement, EmailList.id))
+
+# GET /admin/email_list/export - the whole email list as a CSV download (?format=ndjson or json also work)
+@admin_required()
+def admin_export_email_list():
+    statement = db.select(EmailList.id, EmailList.user_id, EmailList.first_name, EmailList.email)
+    return stream_rows(statement.order_by(EmailList.id), default_format='csv', filename='email_list')
@@ -1,86 +1,201 @@
-from flask import Flask
+import click
+from flask import Flask, jsonify
 from flask_cors import CORS
-from image_processing import *
-from user import *
-from admin import *
-from models import db, migrate
+from flask_jwt_extended import JWTManager
+from werkzeug.utils import cached_property, import_string
+from user import register, logout, login, check_mail_connection, verify_code, send_new_verification_code
+from admin import (register_admin, admin_list_users, admin_list_orders, admin_mark_order_paid, admin_list_email_list,
+                   admin_export_email_list)
+from cart import get_cart, add_cart_item, update_cart_item, remove_cart_item, checkout
+from campaigns import create_campaign, get_campaign, send_campaign, run_campaign, unsubscribe
+from catalog import list_products, get_product, search_products, product_facets
+from downloads import download_order_item, download_order_bundle, order_download_links, backfill_print_crcs
+from models import db, migrate, create_search_index, User
+from artifact_storage import collect_garbage
+from database import database_uri, engine_options, pool_stats
+from auth_tokens import init_token_revocation
+from metrics import init_metrics, metrics_token_required, Gauge
 import os
 from dotenv import load_dotenv
-from urllib.parse import quote_plus
-from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
-from flask_security import Security, SQLAlchemyUserDatastore, RoleMixin, UserMixin
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
 load_dotenv()
 
-# Configure the Flask app with the JWT secret key
-app.config["JWT_SECRET_KEY"] = os.getenv('JWT_SECRET_KEY')
-
-# Initialize the Flask JWT extension
-jwt = JWTManager(app)
-
-# Database configuration - Retrieve values from environment variables
-db_name = os.getenv('DB_NAME')
-username = os.getenv('DB_USERNAME')
-password = quote_plus(os.getenv('DB_PASSWORD'))  # Encode the password with special characters
-host = os.getenv('DB_HOST')
-port = os.getenv('DB_PORT')
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{username}:{password}@{host}:{port}/{db_name}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize the database with the app
-db.init_app(app)
-migrate.init_app(app, db)
-
-# API ENDPOINTS
-
-# Test if API is working
-@app.route('/test')
-def index():
-    return "The backend is reachable"
-
-# Image processing
-
-app.route('/upload', methods=['POST'])(upload_file)  # Endpoint to upload images
-
-# User processing
-
-app.route('/register', methods=['POST'])(register)  # Endpoint to register a user
-app.route('/logout', methods=['POST'])(logout)  # Endpoint to logout a user
-app.route('/login', methods=['POST'])(login)  # Endpoint to logout a user
-app.route('/check_mail_connection', methods=['GET'])(check_mail_connection)  # Endpoint to check email connection
-app.route('/verify_code', methods=['POST'])(verify_code)  # Endpoint to verify verification code
-app.route('/send_new_verification_code', methods=['POST'])(send_new_verification_code)  # Endpoint to send a new verification code
+db_pool_gauge = Gauge('db_pool', 'Database connection pool statistics', ['stat'])
+
+# Refresh the pool gauges when /metrics is scraped
+def collect_pool_stats():
+    for stat, value in pool_stats(db.engine).items():
+        if isinstance(value, (int, float)):
+            db_pool_gauge.set(value, stat)
+
+# View imported on its first request: the image pipeline (cv2, NumPy, PIL, OpenAI) stays out of
+# worker startup, so /test, the auth routes and the catalog answer without ever loading it
+class LazyView:
+    def __init__(self, import_name):
+        self.__module__, self.__name__ = import_name.rsplit('.', 1)
+        self.import_name = import_name
+
+    @cached_property
+    def view(self):
+        return import_string(self.import_name)
+
+    def __call__(self, *args, **kwargs):
+        return self.view(*args, **kwargs)
+
+# Application factory - builds the single app and the single database engine used by every module
+def create_app(config_overrides=None):
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS for all routes
+
+    # Configure the Flask app with the JWT secret key
+    app.config["JWT_SECRET_KEY"] = os.getenv('JWT_SECRET_KEY')
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES_MINUTES', 60)))
+
+    # Initialize the Flask JWT extension and reject revoked tokens
+    jwt = JWTManager(app)
+    init_token_revocation(jwt)
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config_overrides or {})
+
+    # Initialize the database with the app
+    db.init_app(app)
+    migrate.init_app(app, db)
+
+    # flask create-search-index: add the full-text search column and its GIN index to an existing database
+    @app.cli.command('create-search-index')
+    def create_search_index_command():
+        print("Search index is ready" if create_search_index() else "Full-text search needs PostgreSQL")
+
+    # flask gc-artifacts [--dry-run]: delete stored artifacts no row or checkpoint references any more
+    @app.cli.command('gc-artifacts')
+    @click.option('--dry-run', is_flag=True)
+    def gc_artifacts_command(dry_run):
+        print(collect_garbage(dry_run=dry_run))
+
+    # flask send-campaign <id>: send a newsletter campaign in the foreground, resuming from its last checkpoint
+    @app.cli.command('send-campaign')
+    @click.argument('campaign_id', type=int)
+    def send_campaign_command(campaign_id):
+        campaign = run_campaign(campaign_id)
+        print(campaign.serialize() if campaign else "Campaign is already sending or has been sent")
+
+    # flask make-admin <email>: give a registered user the admin role (how the first admin is created)
+    @app.cli.command('make-admin')
+    @click.argument('email')
+    def make_admin_command(email):
+        updated = db.session.execute(
+            db.update(User).where(User.email == email).values(role='admin', verified_email=True, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        print(f"{email} is now an admin" if updated else f"No user with the email {email}")
 
-# Admin processing
+    # flask backfill-image-hashes: store the perceptual hashes of product images saved without them
+    @app.cli.command('backfill-image-hashes')
+    def backfill_image_hashes_command():
+        from perceptual_hash import backfill_image_hashes  # OpenCV is only imported where images are processed
+        print(f"Hashed {backfill_image_hashes()} product images")
 
-app.route('/register_admin', methods=['POST'])(register_admin)  # Endpoint to register an admin (email verified by default)
+    # flask backfill-image-facets: store orientation, aspect ratio and colors of product images saved without them
+    @app.cli.command('backfill-image-facets')
+    def backfill_image_facets_command():
+        from facets import backfill_image_facets  # OpenCV is only imported where images are processed
+        print(f"Extracted facets of {backfill_image_facets()} product images")
 
-# SCHEDULED TASKS
-scheduler = BackgroundScheduler()
+    # flask backfill-print-crcs: store the CRC-32 of prints saved without it, used by resumed ZIP bundles
+    @app.cli.command('backfill-print-crcs')
+    def backfill_print_crcs_command():
+        print(f"Stored the CRC of {backfill_print_crcs()} print files")
 
-# Functions for scheduled tasks
-def remove_expired_verification_codes():
-    with app.app_context():
-        expired_users = User.query.filter(
-            User.verification_code_created_at < datetime.utcnow() - timedelta(minutes=10),
-            User.verification_code.isnot(None)
-        ).all()
+    register_routes(app)
 
-        for user in expired_users:
-            user.verification_code = None
-            user.verification_code_created_at = None
+    # With gunicorn --preload the master imports everything once and the workers share it copy-on-write
+    if os.getenv('PRELOAD_LAZY_VIEWS', 'false').lower() in ('1', 'true', 'yes'):
+        for view in app.view_functions.values():
+            if isinstance(view, LazyView):
+                view.view
 
-        db.session.commit()
+    init_metrics(app, collectors=[collect_pool_stats])
 
-scheduler.add_job(remove_expired_verification_codes, 'interval', minutes=1)
+    return app
 
+# API ENDPOINTS
+def register_routes(app):
+    # Test if API is working
+    @app.route('/test')
+    def index():
+        return "The backend is reachable"
+
+    # Connection pool utilization and checkout wait times
+    @app.route('/db_pool_stats')
+    @metrics_token_required
+    def db_pool_stats():
+        return jsonify(pool_stats(db.engine)), 200
+
+    # Image processing
+
+    app.route('/upload', methods=['POST'])(LazyView('image_processing.upload_file'))  # Endpoint to upload images
+    app.route('/upload/resume', methods=['POST'])(LazyView('image_processing.resume_uploads'))  # Endpoint to resume interrupted uploads
+    app.route('/profiles/<key>', methods=['GET'])(LazyView('profiling.download_profile'))  # Endpoint to download an upload profile report
+
+    # Resumable chunked uploads
+
+    app.route('/uploads', methods=['POST'])(LazyView('chunked_upload.create_upload_session'))  # Endpoint to start a chunked upload
+    app.route('/uploads/<upload_id>', methods=['GET'])(LazyView('chunked_upload.get_upload_session'))  # Endpoint to query received byte ranges
+    app.route('/uploads/<upload_id>', methods=['PUT'])(LazyView('chunked_upload.upload_chunk'))  # Endpoint to upload one chunk
+    app.route('/uploads/<upload_id>/finalize', methods=['POST'])(LazyView('chunked_upload.finalize_upload'))  # Endpoint to assemble and process the file
+
+    # User processing
+
+    app.route('/register', methods=['POST'])(register)  # Endpoint to register a user
+    app.route('/logout', methods=['POST'])(logout)  # Endpoint to logout a user
+    app.route('/login', methods=['POST'])(login)  # Endpoint to logout a user
+    app.route('/check_mail_connection', methods=['GET'])(check_mail_connection)  # Endpoint to check email connection
+    app.route('/verify_code', methods=['POST'])(verify_code)  # Endpoint to verify verification code
+    app.route('/send_new_verification_code', methods=['POST'])(send_new_verification_code)  # Endpoint to send a new verification code
+
+    # Catalog
+
+    app.route('/products', methods=['GET'])(list_products)  # Endpoint to list products (keyset paginated)
+    app.route('/products/facets', methods=['GET'])(product_facets)  # Endpoint to count products per image facet
+    app.route('/products/<int:product_id>', methods=['GET'])(get_product)  # Endpoint to get a single product
+    app.route('/search', methods=['GET'])(search_products)  # Endpoint to search products by text
+
+    # Cart
+
+    app.route('/cart', methods=['GET'])(get_cart)  # Endpoint to get the cart with its totals
+    app.route('/cart/items', methods=['POST'])(add_cart_item)  # Endpoint to add a product to the cart
+    app.route('/cart/items/<int:product_id>', methods=['PUT'])(update_cart_item)  # Endpoint to set the quantity of a product
+    app.route('/cart/items/<int:product_id>', methods=['DELETE'])(remove_cart_item)  # Endpoint to remove a product from the cart
+    app.route('/cart/checkout', methods=['POST'])(checkout)  # Endpoint to turn the cart into an order
+
+    # Purchased file delivery
+
+    app.route('/orders/<int:order_id>/download_links', methods=['GET'])(order_download_links)  # Endpoint to get signed download links
+    app.route('/download/<int:order_item_id>', methods=['GET', 'HEAD'])(download_order_item)  # Endpoint to download a purchased print
+    app.route('/orders/<int:order_id>/bundle', methods=['GET', 'HEAD'])(download_order_bundle)  # Endpoint to download all prints of an order as a ZIP
+    app.route('/images/<kind>/<name>/<int:width>.<fmt>', methods=['GET', 'HEAD'])(LazyView('derivatives.serve_derivative'))  # Endpoint to get a storefront size of an image or mockup
+
+    # Admin processing
+
+    app.route('/register_admin', methods=['POST'])(register_admin)  # Endpoint for an admin to register another admin
+    app.route('/admin/users', methods=['GET'])(admin_list_users)  # Endpoint to stream all users
+    app.route('/admin/orders', methods=['GET'])(admin_list_orders)  # Endpoint to stream all orders
+    app.route('/admin/orders/<int:order_id>/paid', methods=['POST'])(admin_mark_order_paid)  # Endpoint to confirm the payment of an order
+    app.route('/admin/email_list', methods=['GET'])(admin_list_email_list)  # Endpoint to stream the email list
+    app.route('/admin/email_list/export', methods=['GET'])(admin_export_email_list)  # Endpoint to download the email list as CSV
+    app.route('/admin/campaigns', methods=['POST'])(create_campaign)  # Endpoint to create a newsletter campaign
+    app.route('/admin/campaigns/<int:campaign_id>', methods=['GET'])(get_campaign)  # Endpoint to get campaign progress
+    app.route('/admin/campaigns/<int:campaign_id>/send', methods=['POST'])(send_campaign)  # Endpoint to start or resume sending a campaign
+    app.route('/unsubscribe', methods=['GET', 'POST'])(unsubscribe)  # Endpoint to leave the newsletter from a signed link
+
+app = create_app()
+
+# Periodic jobs run in their own process: python scheduler.py
 if __name__ == '__main__':
-    # Run the scheduler
-    scheduler.start()
     # Start the Flask app
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+from metrics import Counter
+
+# Load environment variables from .env file
+load_dotenv()
+
+# local: blobs under ARTIFACT_FOLDER; s3: blobs in ARTIFACT_S3_BUCKET, with ARTIFACT_FOLDER as a local read cache
+ARTIFACT_STORAGE = os.getenv('ARTIFACT_STORAGE', 'local')
+ARTIFACT_FOLDER = os.getenv('ARTIFACT_FOLDER', 'artifacts')
+# Blobs younger than this are never collected, so a pipeline that has stored a file but not referenced it yet is safe
+ARTIFACT_GC_GRACE_SECONDS = int(os.getenv('ARTIFACT_GC_GRACE_SECONDS', 24 * 3600))
+BLOCK_SIZE = 1024 * 1024
+
+# <sha256><extension>, e.g. 9f86d0...0f00a08.jpg
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$')
+
+artifacts_stored = Counter('artifacts_stored_total', 'Artifacts written to content-addressed storage', ['result'])
+artifacts_collected = Counter('artifacts_collected_total', 'Unreferenced artifacts deleted by garbage collection')
+
+def is_artifact_key(value):
+    return isinstance(value, str) and bool(KEY_PATTERN.match(value))
+
+def _extension(name):
+    extension = os.path.splitext(name or '')[1].lower()
+    return extension if re.match(r'^\.[a-z0-9]{1,8}$', extension) else ''
+
+def file_key(path, extension=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest() + (extension if extension is not None else _extension(path))
+
+# Two levels of 256 directories keep every directory small however many blobs there are
+def shard_path(key):
+    return os.path.join(key[:2], key[2:4], key)
+
+# Blobs on the local filesystem; identical content is stored once
+class LocalArtifactStore:
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        if not is_artifact_key(key):
+            raise ValueError(f"Not an artifact key: {key}")
+        return os.path.join(self.root, shard_path(key))
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    # Store a file; with move=True the source is renamed into place instead of copied. The bytes are first taken
+    # into a private temporary file and hashed there, so later writes to the source (the upload folder copy is a
+    # working file) can never change a stored blob or make it disagree with its key.
+    def put_file(self, path, extension=None, move=False):
+        extension = extension if extension is not None else _extension(path)
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            if move:
+                os.close(fd)
+                try:
+                    os.replace(path, temp_path)
+                except OSError:
+                    shutil.move(path, temp_path)
+                key = file_key(temp_path, extension)
+            else:
+                digest = hashlib.sha256()
+                with open(path, 'rb') as source, os.fdopen(fd, 'wb') as temp:
+                    for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+                        digest.update(block)
+                        temp.write(block)
+                    temp.flush()
+                    os.fsync(temp.fileno())
+                os.chmod(temp_path, 0o644)  # mkstemp creates it owner-only; a proxy serving downloads must read it
+                key = digest.hexdigest() + extension
+
+            target = self.local_path(key)
+            if os.path.exists(target):
+                artifacts_stored.inc(1, 'duplicate')
+                os.utime(target)  # Restart the grace period of a blob that is being referenced again
+                os.remove(temp_path)
+                return key
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        artifacts_stored.inc(1, 'stored')
+        return key
+
+    def put_bytes(self, data, extension=''):
+        key = hashlib.sha256(data).hexdigest() + extension
+        target = self.local_path(key)
+        if os.path.exists(target):
+            artifacts_stored.inc(1, 'duplicate')
+            os.utime(target)
+            return key
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, target)
+        artifacts_stored.inc(1, 'stored')
+        return key
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    # (key, size, modified time) of every stored blob
+    def iter_blobs(self):
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if not is_artifact_key(name):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield name, stat.st_size, stat.st_mtime
+
+# Blobs in an S3-compatible bucket (AWS, MinIO, R2, ...). Image tools need real files, so reads go through
+# a local cache that is filled on demand.
+class S3ArtifactStore:
+    def __init__(self, bucket, prefix, cache, endpoint_url=None):
+        import boto3  # Optional dependency, only needed when the S3 backend is configured
+        self._s3 = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = cache
+
+    def _object_key(self, key):
+        return self.prefix + shard_path(key).replace(os.sep, '/')
+
+    def exists(self, key):
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._s3.exceptions.ClientError:
+            return False
+
+    def local_path(self, key):
+        path = self.cache.local_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            self._s3.download_file(self.bucket, self._object_key(key), temp_path)
+            os.replace(temp_path, path)
+        return path
+
+    def _upload(self, key):
+        if self.exists(key):
+            artifacts_stored.inc(1, 'duplicate')
+            return
+        self._s3.upload_file(self.cache.local_path(key), self.bucket, self._object_key(key))
+        artifacts_stored.inc(1, 'stored')
+
+    def put_file(self, path, extension=None, move=False):
+        key = self.cache.put_file(path, extension, move)
+        self._upload(key)
+        return key
+
+    def put_bytes(self, data, extension=''):
+        key = self.cache.put_bytes(data, extension)
+        self._upload(key)
+        return key
+
+    def delete(self, key):
+        self._s3.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self.cache.delete(key)
+
+    def iter_blobs(self):
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                key = item['Key'].rsplit('/', 1)[-1]
+                if is_artifact_key(key):
+                    yield key, item['Size'], item['LastModified'].timestamp()
+
+# Choose the backend based on the environment
+def create_artifact_store():
+    local = LocalArtifactStore(ARTIFACT_FOLDER)
+    if ARTIFACT_STORAGE == 's3':
+        return S3ArtifactStore(os.getenv('ARTIFACT_S3_BUCKET'), os.getenv('ARTIFACT_S3_PREFIX', 'artifacts/'),
+                               local, endpoint_url=os.getenv('ARTIFACT_S3_ENDPOINT_URL') or None)
+    return local
+
+artifact_store = create_artifact_store()
+
+# Local path of a stored file; values that are not keys are paths written before artifacts were content-addressed
+def artifact_path(value):
+    if not value:
+        return None
+    return artifact_store.local_path(value) if is_artifact_key(value) else value
+
+# Every artifact key anywhere inside a JSON value (pipeline checkpoints)
+def _keys_in(value, keys):
+    if isinstance(value, dict):
+        for item in value.values():
+            _keys_in(item, keys)
+    elif isinstance(value, list):
+        for item in value:
+            _keys_in(item, keys)
+    elif is_artifact_key(value):
+        keys.add(value)
+    return keys
+
+# Mark: keys referenced by database rows and by pipeline checkpoints
+def referenced_keys():
+    from models import db, ProductImage, ProductMockup
+    from pipeline_checkpoints import CHECKPOINT_FOLDER
+
+    keys = set()
+    for column in (ProductImage.original_key, ProductImage.print_file_key, ProductImage.description_key,
+                   ProductMockup.artifact_key):
+        keys.update(value for value, in db.session.execute(db.select(column).where(column.isnot(None))))
+
+    if os.path.isdir(CHECKPOINT_FOLDER):
+        for name in os.listdir(CHECKPOINT_FOLDER):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(CHECKPOINT_FOLDER, name)) as f:
+                        _keys_in(json.load(f), keys)
+                except (OSError, ValueError):
+                    continue
+    return keys
+
+# Mark-and-sweep over the store; needs an app context for the database
+def collect_garbage(dry_run=False, grace_seconds=ARTIFACT_GC_GRACE_SECONDS):
+    started = time.time()
+    keys = referenced_keys()
+    report = {'referenced': len(keys), 'scanned': 0, 'deleted': 0, 'deleted_bytes': 0, 'dry_run': dry_run}
+    for key, size, modified in artifact_store.iter_blobs():
+        report['scanned'] += 1
+        if key in keys or started - modified < grace_seconds:
+            continue
+        if not dry_run:
+            artifact_store.delete(key)
+            artifacts_collected.inc()
+        report['deleted'] += 1
+        report['deleted_bytes'] += size
+    report['seconds'] = round(time.time() - started, 3)
+    return report
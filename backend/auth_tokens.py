@@ -0,0 +1,165 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from dotenv import load_dotenv
+from flask import request, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_header
+from flask_jwt_extended.exceptions import FreshTokenRequired, RevokedTokenError, WrongTokenError
+from flask_jwt_extended.view_decorators import _load_user
+
+# Load environment variables from .env file
+load_dotenv()
+
+# In-memory set of revoked token ids (jti); entries are dropped once the token would have expired anyway
+class RevocationSet:
+    def __init__(self):
+        self._expires = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            exp, jti = heapq.heappop(self._heap)
+            if self._expires.get(jti) == exp:
+                del self._expires[jti]
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._purge(time.time())
+            self._expires[jti] = exp
+            heapq.heappush(self._heap, (exp, jti))
+
+    def __contains__(self, jti):
+        exp = self._expires.get(jti)
+        return exp is not None and exp > time.time()
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.time())
+            return len(self._expires)
+
+# Revocation set shared between workers through Redis; keys expire together with the token
+class RedisRevocationSet:
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed when a shared backend is configured
+        self._redis = redis.Redis.from_url(url)
+
+    def add(self, jti, exp):
+        ttl = int(exp - time.time()) + 1
+        if ttl > 0:
+            self._redis.set(f"revoked_jti:{jti}", 1, ex=ttl)
+
+    def __contains__(self, jti):
+        return self._redis.exists(f"revoked_jti:{jti}") == 1
+
+    def __len__(self):
+        return sum(1 for _ in self._redis.scan_iter("revoked_jti:*"))
+
+# Choose the backend based on the environment
+def create_revocation_set():
+    redis_url = os.getenv('REVOCATION_REDIS_URL')
+    if redis_url:
+        return RedisRevocationSet(redis_url)
+    return RevocationSet()
+
+revoked_tokens = create_revocation_set()
+
+# Revoke a decoded token until its own expiry
+def revoke_token(jwt_data):
+    exp = jwt_data.get('exp') or time.time() + 24 * 3600
+    revoked_tokens.add(jwt_data['jti'], exp)
+    verified_tokens.discard_jti(jwt_data['jti'])
+
+# Small LRU of already verified raw tokens -> (header, claims), so repeated requests skip the signature check
+class VerifiedTokenCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            header, claims = entry
+            if claims.get('exp') is not None and claims['exp'] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def put(self, token, header, claims):
+        with self._lock:
+            self._entries[token] = (header, claims)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard_jti(self, jti):
+        with self._lock:
+            for token, (header, claims) in list(self._entries.items()):
+                if claims.get('jti') == jti:
+                    del self._entries[token]
+
+verified_tokens = VerifiedTokenCache(int(os.getenv('JWT_VERIFIED_CACHE_SIZE', 10000)))
+
+# Hook the revocation set into Flask-JWT-Extended so every protected route rejects revoked tokens
+def init_token_revocation(jwt):
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(jwt_header, jwt_payload):
+        return jwt_payload.get('jti') in revoked_tokens
+
+# Raw bearer token from the Authorization header
+def _bearer_token():
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header[7:]
+    return None
+
+# Flask-JWT-Extended keeps the verified token in these request-context attributes (get_jwt() & co. read them).
+# They are private to the library, so this is the only place that writes them; Flask-JWT-Extended is pinned
+# in requirements.txt and the names must be checked before upgrading it. The user is loaded the way the library
+# does it, so get_current_user() and a registered user_lookup_loader behave the same on a cache hit.
+def _set_request_jwt(header, claims):
+    g._jwt_extended_jwt_user = _load_user(header, claims)
+    g._jwt_extended_jwt_header = header
+    g._jwt_extended_jwt = claims
+    g._jwt_extended_jwt_location = 'headers'
+
+# The checks verify_jwt_in_request() makes besides the signature: only access tokens, and fresh ones when asked
+def _check_cached_claims(header, claims, fresh):
+    if claims.get('jti') in revoked_tokens:
+        raise RevokedTokenError(header, claims)
+    if claims.get('type') != 'access':
+        raise WrongTokenError("Only non-refresh tokens are allowed")
+    if fresh:
+        token_fresh = claims.get('fresh')
+        if isinstance(token_fresh, bool):
+            if not token_fresh:
+                raise FreshTokenRequired("Fresh token required", header, claims)
+        elif token_fresh is None or token_fresh < time.time():
+            raise FreshTokenRequired("Fresh token required", header, claims)
+
+# Drop-in replacement for @jwt_required() that reuses previously verified claims
+def jwt_cached_required(fresh=False):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            token = _bearer_token()
+            cached = verified_tokens.get(token) if token else None
+            if cached is not None:
+                header, claims = cached
+                _check_cached_claims(header, claims, fresh)
+                _set_request_jwt(header, claims)
+            else:
+                verify_jwt_in_request(fresh=fresh)
+                # Refresh tokens are never cached, so a cache hit is always an access token
+                if token and get_jwt().get('type') == 'access':
+                    verified_tokens.put(token, get_jwt_header(), get_jwt())
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
@@ -0,0 +1,100 @@
+# Catalog listing benchmark over a synthetic product table
+#
+# Run from the backend folder against a scratch database:
+#   python benchmarks/bench_catalog.py --products 100000 --pages 200
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app import app
+from models import db, Category, Product, ProductImage
+
+BENCH_CATEGORY = 'bench-catalog'
+
+# Insert the synthetic catalog once; reruns reuse it
+def seed(product_count, batch_size=5000):
+    category = Category.query.filter_by(name=BENCH_CATEGORY).first()
+    if category is None:
+        category = Category(name=BENCH_CATEGORY, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        db.session.add(category)
+        db.session.commit()
+
+    existing = Product.query.filter_by(category_id=category.id).count()
+    if existing >= product_count:
+        return category
+
+    print(f"Seeding {product_count - existing} products...")
+    description = ' '.join(['lorem ipsum dolor sit amet'] * 80)  # roughly a 400-word description
+    start = datetime.utcnow() - timedelta(days=365)
+    for offset in range(existing, product_count, batch_size):
+        count = min(batch_size, product_count - offset)
+        rows = [
+            {
+                'category_id': category.id,
+                'title': f"Bench print {offset + i}",
+                'status': 'published',
+                'description': description,
+                'meta_description': 'Benchmark product',
+                'focus_keyword': 'benchmark',
+                'price': 9.99,
+                'created_at': start + timedelta(seconds=offset + i),
+                'updated_at': start + timedelta(seconds=offset + i)
+            }
+            for i in range(count)
+        ]
+        ids = db.session.execute(db.insert(Product).returning(Product.id), rows).scalars().all()
+        db.session.execute(db.insert(ProductImage), [
+            {'product_id': product_id, 'main_image': f"https://example.com/{product_id}.png"} for product_id in ids
+        ])
+        db.session.commit()
+    return category
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def run(pages, page_size, category_id):
+    client = app.test_client()
+    queries = []
+
+    def count_query(*args):
+        queries[-1] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    timings = []
+    cursor = None
+    for _ in range(pages):
+        queries.append(0)
+        url = f"/products?limit={page_size}&category_id={category_id}"
+        if cursor:
+            url += f"&cursor={cursor}"
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        body = response.get_json()
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    print(f"Pages fetched:       {len(timings)} x {page_size}")
+    print(f"Latency p50 / p99:   {statistics.median(timings):.2f} ms / {percentile(timings, 99):.2f} ms")
+    print(f"Queries per page:    max {max(queries)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=24)
+    args = parser.parse_args()
+
+    with app.app_context():
+        category = seed(args.products)
+        run(args.pages, args.page_size, category.id)
@@ -0,0 +1,70 @@
+# Near-duplicate lookup benchmark over a synthetic perceptual hash index
+#
+# Run from the backend folder:
+#   python benchmarks/bench_phash.py --images 100000 --queries 2000
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perceptual_hash import HammingIndex, image_hashes
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+# Flip `bits` random bits of a hash, i.e. a variation at exactly that distance
+def variation(value, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+def run(image_count, query_count, max_distance, seed=1):
+    rng = random.Random(seed)
+    index = HammingIndex()
+    hashes = [rng.getrandbits(64) for _ in range(image_count)]
+
+    started = time.perf_counter()
+    for i, value in enumerate(hashes):
+        index.add(i, value)
+    build_seconds = time.perf_counter() - started
+
+    # Half the queries are variations of an indexed image, half are unrelated artwork
+    timings = []
+    found = 0
+    for i in range(query_count):
+        if i % 2 == 0:
+            query = variation(rng.choice(hashes), rng.randint(0, max_distance), rng)
+        else:
+            query = rng.getrandbits(64)
+        started = time.perf_counter()
+        matches = index.search(query, max_distance)
+        timings.append((time.perf_counter() - started) * 1000)
+        found += bool(matches)
+
+    print(f"Indexed hashes:      {len(index)} (built in {build_seconds:.2f} s)")
+    print(f"Queries:             {query_count} at distance <= {max_distance}, {found} with matches")
+    print(f"Latency p50 / p99:   {statistics.median(timings):.3f} ms / {percentile(timings, 99):.3f} ms")
+
+def hash_images(paths):
+    for path in paths:
+        started = time.perf_counter()
+        hashes = image_hashes(path)
+        print(f"{os.path.basename(path)}: phash {hashes['phash']:016x} dhash {hashes['dhash']:016x} "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--distance', type=int, default=6)
+    parser.add_argument('files', nargs='*', help='Image files to time hashing on')
+    args = parser.parse_args()
+
+    run(args.images, args.queries, args.distance)
+    hash_images(args.files)
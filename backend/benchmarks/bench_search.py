@@ -0,0 +1,114 @@
+# Full-text search benchmark over a synthetic product catalog
+#
+# Run from the backend folder against a scratch PostgreSQL database:
+#   python benchmarks/bench_search.py --products 100000 --queries 500
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app import app
+from models import db, Category, Product, create_search_index
+
+BENCH_CATEGORY = 'bench-search'
+
+SUBJECTS = ['sunset', 'beach', 'mountain', 'forest', 'city', 'ocean', 'desert', 'lake', 'river', 'garden',
+            'flower', 'portrait', 'skyline', 'waterfall', 'meadow', 'harbor', 'island', 'canyon', 'glacier', 'village']
+STYLES = ['abstract', 'watercolor', 'minimalist', 'vintage', 'surreal', 'impressionist', 'geometric', 'pastel',
+          'monochrome', 'neon', 'botanical', 'coastal', 'rustic', 'modern', 'dreamy', 'moody']
+
+# Filler vocabulary so descriptions look like ~400 words of varied text to the parser
+def filler_words(rng, count):
+    return ' '.join(f"{rng.choice(STYLES)}{rng.randint(0, 4000)}" if rng.random() < 0.3 else rng.choice(SUBJECTS + STYLES)
+                    for _ in range(count))
+
+# Insert the synthetic catalog once; reruns reuse it
+def seed(product_count, batch_size=2000):
+    category = Category.query.filter_by(name=BENCH_CATEGORY).first()
+    if category is None:
+        category = Category(name=BENCH_CATEGORY, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        db.session.add(category)
+        db.session.commit()
+
+    existing = Product.query.filter_by(category_id=category.id).count()
+    if existing >= product_count:
+        return category
+
+    print(f"Seeding {product_count - existing} products...")
+    rng = random.Random(existing)
+    start = datetime.utcnow() - timedelta(days=365)
+    for offset in range(existing, product_count, batch_size):
+        count = min(batch_size, product_count - offset)
+        rows = []
+        for i in range(count):
+            subject, style = rng.choice(SUBJECTS), rng.choice(STYLES)
+            rows.append({
+                'category_id': category.id,
+                'title': f"{style.title()} {subject} print {offset + i}",
+                'status': 'published',
+                'description': filler_words(rng, 400),
+                'meta_description': f"{style} {subject} wall art",
+                'focus_keyword': f"{style} {subject}",
+                'price': 9.99,
+                'created_at': start + timedelta(seconds=offset + i),
+                'updated_at': start + timedelta(seconds=offset + i)
+            })
+        db.session.execute(db.insert(Product), rows)
+        db.session.commit()
+    return category
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def run(query_count, page_size):
+    client = app.test_client()
+    rng = random.Random(1)
+    queries = []
+
+    def count_query(*args):
+        queries[-1] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    timings = []
+    matched = 0
+    for i in range(query_count):
+        # Full words, two-word phrases and short prefixes as typed in a search box
+        kind = i % 3
+        if kind == 0:
+            q = rng.choice(SUBJECTS)
+        elif kind == 1:
+            q = f"{rng.choice(STYLES)} {rng.choice(SUBJECTS)}"
+        else:
+            q = rng.choice(SUBJECTS)[:3]
+        queries.append(0)
+        started = time.perf_counter()
+        # A unique query string per request keeps the response cache out of the measurement
+        response = client.get(f"/search?q={q}&limit={page_size}&_={i}")
+        timings.append((time.perf_counter() - started) * 1000)
+        matched += bool(response.get_json()['products'])
+    event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    print(f"Queries:             {len(timings)} ({matched} with results), {page_size} per page")
+    print(f"Latency p50 / p99:   {statistics.median(timings):.2f} ms / {percentile(timings, 99):.2f} ms")
+    print(f"SQL per request:     max {max(queries)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=24)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not create_search_index():
+            sys.exit("Full-text search needs PostgreSQL; point the DB_* settings at a scratch database")
+        seed(args.products)
+        run(args.queries, args.page_size)
@@ -0,0 +1,79 @@
+# Worker startup benchmark: import time and memory of a fresh process, before and after the image pipeline loads
+#
+# Run from the backend folder:
+#   python benchmarks/bench_startup.py --runs 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['cv2', 'numpy', 'PIL', 'openai']
+
+# Runs in a fresh interpreter, like a newly forked or cold-started worker
+CHILD = """
+import json, resource, sys, time
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+client.get('/test')
+first_request = time.perf_counter()
+result = {
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'rss_mb': rss_mb(),
+    'heavy_loaded': [name for name in HEAVY if name in sys.modules]
+}
+
+# What the first upload request adds on top
+started = time.perf_counter()
+getattr(app.view_functions['upload_file'], 'view', None)  # Already loaded when views are imported eagerly
+result['pipeline_import_ms'] = (time.perf_counter() - started) * 1000
+result['pipeline_rss_mb'] = rss_mb()
+print(json.dumps(result))
+"""
+
+def child_environment():
+    env = dict(os.environ)
+    # app.py builds its default app at import time, so the settings must at least parse
+    for name, value in (('DB_NAME', 'lemouniq'), ('DB_USERNAME', 'lemouniq'), ('DB_PASSWORD', ''),
+                        ('DB_HOST', 'localhost'), ('DB_PORT', '5432'), ('JWT_SECRET_KEY', 'bench'),
+                        ('UPLOAD_FOLDER', '/tmp/lemouniq-bench-startup'), ('OPENAI_API_KEY', 'bench')):
+        env.setdefault(name, value)
+    env.pop('PRELOAD_LAZY_VIEWS', None)
+    return env
+
+def run(runs):
+    code = f"HEAVY = {HEAVY_MODULES!r}\n" + CHILD
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=BACKEND, env=child_environment(),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    def median(field):
+        return statistics.median(sample[field] for sample in samples)
+
+    print(f"Runs:                          {runs}")
+    print(f"Import app (p50):              {median('import_ms'):.0f} ms")
+    print(f"First /test request (p50):     {median('first_request_ms'):.1f} ms")
+    print(f"RSS after startup (p50):       {median('rss_mb'):.1f} MB")
+    print(f"Heavy modules at startup:      {', '.join(samples[-1]['heavy_loaded']) or 'none'}")
+    print(f"Image pipeline import (p50):   {median('pipeline_import_ms'):.0f} ms, "
+          f"RSS {median('pipeline_rss_mb'):.1f} MB once loaded")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    run(args.runs)
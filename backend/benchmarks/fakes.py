@@ -0,0 +1,342 @@
+# Local stand-ins for Printful, imgbb, OpenAI, SMTP and S3 with configurable latency and failure rates
+
+import io
+import json
+import random
+import socketserver
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+from PIL import Image
+
+# Latency (seconds) and failure rate (0..1) for one fake service
+class ServiceBehaviour:
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def apply(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return random.random() >= self.failure_rate
+
+# A JPEG the fake Printful CDN serves as every mockup
+def _mockup_jpeg(size=(1000, 1000)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 180, 150)).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+class FakeHTTPServices:
+    def __init__(self, printful=None, imgbb=None, openai=None, extra_mockups=12, task_seconds=0.0):
+        self.behaviour = {
+            'printful': printful or ServiceBehaviour(),
+            'imgbb': imgbb or ServiceBehaviour(),
+            'openai': openai or ServiceBehaviour()
+        }
+        self.extra_mockups = extra_mockups
+        self.task_seconds = task_seconds
+        self.tasks = {}
+        self.mockup = _mockup_jpeg()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return self.rfile.read(length) if length else b''
+
+            def do_POST(self):
+                self._read_body()
+                if self.path.startswith('/1/upload'):
+                    if not services.behaviour['imgbb'].apply():
+                        return self._send_json(500, {'error': 'fake imgbb failure'})
+                    return self._send_json(200, {'data': {'url': f"{services.url}/files/{uuid.uuid4().hex}.png"}})
+
+                if self.path.startswith('/mockup-generator/create-task/'):
+                    if not services.behaviour['printful'].apply():
+                        return self._send_json(500, {'error': 'fake printful failure'})
+                    task_key = uuid.uuid4().hex
+                    services.tasks[task_key] = time.time() + services.task_seconds
+                    return self._send_json(200, {'result': {'task_key': task_key, 'status': 'pending'}})
+
+                if self.path.startswith('/v1/chat/completions'):
+                    if not services.behaviour['openai'].apply():
+                        return self._send_json(500, {'error': {'message': 'fake openai failure'}})
+                    return self._send_json(200, {
+                        'id': f"chatcmpl-{uuid.uuid4().hex}",
+                        'object': 'chat.completion',
+                        'created': int(time.time()),
+                        'model': 'gpt-3.5-turbo',
+                        'choices': [{
+                            'index': 0,
+                            'finish_reason': 'stop',
+                            'message': {'role': 'assistant', 'content': ' '.join(['Lorem ipsum dolor sit amet.'] * 80)}
+                        }],
+                        'usage': {'prompt_tokens': 50, 'completion_tokens': 500, 'total_tokens': 550}
+                    })
+
+                self._send_json(404, {'error': 'not found'})
+
+            def do_GET(self):
+                if self.path.startswith('/mockup-generator/task'):
+                    if not services.behaviour['printful'].apply():
+                        return self._send_json(500, {'error': 'fake printful failure'})
+                    task_key = self.path.split('task_key=', 1)[-1]
+                    ready_at = services.tasks.get(task_key)
+                    if ready_at is None or ready_at > time.time():
+                        return self._send_json(200, {'result': {'task_key': task_key, 'status': 'pending'}})
+                    extra = [
+                        {'title': f"Lifestyle {i}", 'option_group': f"Lifestyle {i}", 'url': f"{services.url}/files/mockup_{i}.jpg"}
+                        for i in range(services.extra_mockups)
+                    ]
+                    return self._send_json(200, {'result': {
+                        'task_key': task_key,
+                        'status': 'completed',
+                        'mockups': [{'placement': 'default', 'mockup_url': f"{services.url}/files/default.jpg", 'extra': extra}]
+                    }})
+
+                if self.path.startswith('/files/'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/jpeg')
+                    self.send_header('Content-Length', str(len(services.mockup)))
+                    self.end_headers()
+                    self.wfile.write(services.mockup)
+                    return
+
+                self._send_json(404, {'error': 'not found'})
+
+        return Handler
+
+# Minimal SMTP server: accepts AUTH and DATA, counts delivered messages
+class FakeSMTPServer:
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour or ServiceBehaviour()
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        smtp = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self.reply('220 fake-smtp ready')
+                in_data = False
+                for raw in self.rfile:
+                    line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+                    if in_data:
+                        if line == '.':
+                            in_data = False
+                            if smtp.behaviour.apply():
+                                with smtp._lock:
+                                    smtp.delivered += 1
+                                self.reply('250 OK queued')
+                            else:
+                                self.reply('451 fake smtp failure')
+                        continue
+                    command = line.split(' ', 1)[0].upper()
+                    if command in ('EHLO', 'HELO'):
+                        self.wfile.write(b"250-fake-smtp\r\n250 AUTH PLAIN LOGIN\r\n")
+                    elif command == 'AUTH':
+                        self.reply('235 Authentication successful')
+                    elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    elif command == 'DATA':
+                        in_data = True
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    elif command == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
+
+# Path-style S3 API in memory (PUT/GET/HEAD/DELETE, multipart uploads, ListObjectsV2), for ARTIFACT_S3_ENDPOINT_URL
+class FakeS3Server:
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour or ServiceBehaviour()
+        self.objects = {}
+        self.uploads = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        s3 = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _parse(self):
+                parts = urlsplit(self.path)
+                bucket, _, key = parts.path.lstrip('/').partition('/')
+                query = {name: values[0] for name, values in parse_qs(parts.query, keep_blank_values=True).items()}
+                return bucket, unquote(key), query
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _send(self, status, body=b'', headers=None, content_type='application/xml'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _fail(self):
+                if not s3.behaviour.apply():
+                    self._send(503, b'<Error><Code>SlowDown</Code></Error>')
+                    return True
+                return False
+
+            def do_PUT(self):
+                bucket, key, query = self._parse()
+                body = self._read_body()
+                if self._fail():
+                    return
+                etag = f'"{uuid.uuid4().hex}"'
+                with s3._lock:
+                    if 'uploadId' in query:
+                        s3.uploads[query['uploadId']][int(query['partNumber'])] = body
+                    else:
+                        s3.objects[(bucket, key)] = (body, time.time())
+                self._send(200, headers={'ETag': etag})
+
+            def do_POST(self):
+                bucket, key, query = self._parse()
+                self._read_body()
+                if self._fail():
+                    return
+                if 'uploads' in query:
+                    upload_id = uuid.uuid4().hex
+                    with s3._lock:
+                        s3.uploads[upload_id] = {}
+                    self._send(200, (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                                     f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode())
+                elif 'uploadId' in query:
+                    with s3._lock:
+                        parts = s3.uploads.pop(query['uploadId'])
+                        s3.objects[(bucket, key)] = (b''.join(parts[number] for number in sorted(parts)), time.time())
+                    self._send(200, (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                                     f"<ETag>\"{uuid.uuid4().hex}\"</ETag></CompleteMultipartUploadResult>").encode())
+                else:
+                    self._send(400)
+
+            def do_DELETE(self):
+                bucket, key, query = self._parse()
+                with s3._lock:
+                    s3.objects.pop((bucket, key), None)
+                    s3.uploads.pop(query.get('uploadId'), None)
+                self._send(204)
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                bucket, key, query = self._parse()
+                if self._fail():
+                    return
+                if not key:
+                    prefix = query.get('prefix', '')
+                    with s3._lock:
+                        items = sorted((k, body, modified) for (b, k), (body, modified) in s3.objects.items()
+                                       if b == bucket and k.startswith(prefix))
+                    contents = ''.join(
+                        f"<Contents><Key>{escape(k)}</Key><Size>{len(body)}</Size>"
+                        f"<LastModified>{time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(modified))}</LastModified></Contents>"
+                        for k, body, modified in items
+                    )
+                    self._send(200, (f"<ListBucketResult><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>"
+                                     f"<KeyCount>{len(items)}</KeyCount><IsTruncated>false</IsTruncated>"
+                                     f"{contents}</ListBucketResult>").encode())
+                    return
+
+                with s3._lock:
+                    stored = s3.objects.get((bucket, key))
+                if stored is None:
+                    self._send(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                    return
+                body, modified = stored
+                headers = {'Last-Modified': formatdate(modified, usegmt=True), 'ETag': f'"{len(body):x}-{int(modified)}"',
+                           'Accept-Ranges': 'bytes'}
+                status = 200
+                byte_range = self.headers.get('Range')
+                if byte_range and byte_range.startswith('bytes='):
+                    first, _, last = byte_range[len('bytes='):].partition('-')
+                    start, end = int(first), min(int(last) + 1 if last else len(body), len(body))
+                    headers['Content-Range'] = f"bytes {start}-{end - 1}/{len(body)}"
+                    body, status = body[start:end], 206
+                self._send(status, body, headers, content_type='application/octet-stream')
+
+        return Handler
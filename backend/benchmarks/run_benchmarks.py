@@ -0,0 +1,255 @@
+# End-to-end benchmark of /upload, /register and /login against local stand-ins
+#
+# Run from the backend folder:
+#   python benchmarks/run_benchmarks.py --uploads 6 --users 50 --concurrency 4
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/<commit>.json
+#
+# By default the app uses a throwaway SQLite database; pass --database-url to benchmark against Postgres.
+
+import argparse
+import json
+import os
+import resource
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+BEACH_IMAGES = ['horizontal_beach.png', 'square_beach.png', 'vertical_beach.png']
+
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import FakeHTTPServices, FakeSMTPServer, ServiceBehaviour
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def summarize(durations):
+    return {
+        'count': len(durations),
+        'p50_ms': round(statistics.median(durations) * 1000, 2) if durations else None,
+        'p99_ms': round(percentile(durations, 99) * 1000, 2) if durations else None
+    }
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Samples RSS and attributes the peak to every pipeline stage running at that moment
+class RSSSampler(threading.Thread):
+    def __init__(self, stage_in_flight, interval=0.01):
+        super().__init__(daemon=True)
+        self.stage_in_flight = stage_in_flight
+        self.interval = interval
+        self.peaks = {}
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = current_rss()
+            self.peak = max(self.peak, rss)
+            for label_values, running in list(self.stage_in_flight._values.items()):
+                if running > 0:
+                    stage = label_values[0]
+                    self.peaks[stage] = max(self.peaks.get(stage, 0), rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+# Configure the app to talk to the fakes; must run before the app modules are imported
+def configure_environment(work_dir, http_fakes, smtp_fake):
+    for folder in ('UPLOAD_FOLDER', 'OUTPUT_FOLDER', 'MOCKUP_FOLDER', 'DESCRIPTION_FOLDER', 'CHECKPOINT_FOLDER',
+                   'ARTIFACT_FOLDER', 'DERIVATIVE_FOLDER'):
+        os.environ[folder] = os.path.join(work_dir, folder.lower())
+    os.environ.setdefault('RESIZED_FILE_ENDING', '_resized.png')
+    os.environ['PRINTFUL_API_URL'] = http_fakes.url
+    os.environ['IMGBB_API_URL'] = f"{http_fakes.url}/1/upload"
+    os.environ['PRINTFUL_POLL_INTERVAL'] = '0.05'
+    os.environ['PRINTFUL_TOKEN'] = 'fake'
+    os.environ['IMG_BB_TOKEN'] = 'fake'
+    os.environ['OPENAI_BASE_URL'] = f"{http_fakes.url}/v1"
+    os.environ['OPENAI_API_KEY'] = 'fake'
+    os.environ['MAIL_SERVER'] = '127.0.0.1'
+    os.environ['MAIL_PORT'] = str(smtp_fake.port)
+    os.environ['MAIL_USE_SSL'] = 'false'
+    os.environ['MAIL_USERNAME'] = 'bench'
+    os.environ['MAIL_PASSWORD'] = 'bench'
+    os.environ['MAIL_DEFAULT_SENDER'] = 'bench@lemouniq.test'
+    os.environ.setdefault('JWT_SECRET_KEY', secrets.token_hex(32))
+    # Every simulated user signs up and logs in from 127.0.0.1, far beyond the per-IP limit of one real client
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    # app.py builds its default app at import time, so the Postgres settings must at least parse
+    for name, value in (('DB_NAME', 'lemouniq'), ('DB_USERNAME', 'lemouniq'), ('DB_PASSWORD', ''), ('DB_HOST', 'localhost'), ('DB_PORT', '5432')):
+        os.environ.setdefault(name, value)
+
+# Run `count` calls of `fn(i)` with `concurrency` threads; returns per-call durations and the wall time
+def run_concurrently(fn, count, concurrency):
+    durations = []
+    errors = []
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            ok = fn(i)
+        except Exception as e:
+            ok = False
+            print(f"Benchmark call failed: {e}")
+        durations.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(count)))
+    wall = time.perf_counter() - started
+
+    result = summarize(durations)
+    result.update({
+        'errors': len(errors),
+        'seconds': round(wall, 3),
+        'throughput_per_second': round(count / wall, 3) if wall else None
+    })
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nComparison with {previous.get('commit')} ({previous_path}):")
+    for section in ('scenarios', 'stages'):
+        for name, values in current[section].items():
+            before = previous.get(section, {}).get(name)
+            if not before or not before.get('p50_ms') or not values.get('p50_ms'):
+                continue
+            change = (values['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+            print(f"  {section[:-1]} {name:<24} p50 {before['p50_ms']:>10.2f} -> {values['p50_ms']:>10.2f} ms ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uploads', type=int, default=6)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='Latency of every fake service in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Failure rate of every fake service (0..1)')
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--compare', default=None, help='Previous results file to compare with')
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    work_dir = tempfile.mkdtemp(prefix='lemouniq-bench-')
+
+    behaviour = lambda: ServiceBehaviour(args.latency, args.failure_rate)
+    http_fakes = FakeHTTPServices(printful=behaviour(), imgbb=behaviour(), openai=behaviour()).start()
+    smtp_fake = FakeSMTPServer(behaviour()).start()
+    configure_environment(work_dir, http_fakes, smtp_fake)
+
+    import requests
+    from werkzeug.serving import make_server
+    import metrics
+    from app import create_app
+    from models import db
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    overrides = {'SQLALCHEMY_DATABASE_URI': database_url}
+    if database_url.startswith('sqlite'):
+        overrides['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    app = create_app(overrides)
+    with app.app_context():
+        db.create_all()
+
+    stage_durations = {}
+    metrics.stage_observers.append(lambda stage, seconds: stage_durations.setdefault(stage, []).append(seconds))
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    sampler = RSSSampler(metrics.stage_in_flight)
+    sampler.start()
+
+    def upload(i):
+        name = BEACH_IMAGES[i % len(BEACH_IMAGES)]
+        with open(name, 'rb') as image:
+            response = requests.post(f"{base_url}/upload", files={'image': (f"bench{i}_{name}", image, 'image/png')})
+        return response.status_code == 200 and all(item['status'] == 'completed' for item in response.json()['processed_data'])
+
+    emails = [f"bench-{secrets.token_hex(6)}@lemouniq.test" for _ in range(args.users)]
+    password = f"Bench-{secrets.token_hex(8)}!"
+
+    def register(i):
+        response = requests.post(f"{base_url}/register", json={
+            'first_name': 'Bench', 'last_name': 'User', 'email': emails[i], 'password': password
+        })
+        return response.status_code == 200
+
+    def login(i):
+        response = requests.post(f"{base_url}/login", json={'email': emails[i], 'password': password})
+        return response.status_code == 200
+
+    scenarios = {}
+    print(f"Uploading {args.uploads} images with concurrency {args.concurrency}...")
+    scenarios['upload'] = run_concurrently(upload, args.uploads, args.concurrency)
+    print(f"Registering {args.users} users...")
+    scenarios['register'] = run_concurrently(register, args.users, args.concurrency)
+    print(f"Logging in {args.users} users...")
+    scenarios['login'] = run_concurrently(login, args.users, args.concurrency)
+
+    sampler.stop()
+    server.shutdown()
+    http_fakes.stop()
+    smtp_fake.stop()
+
+    stages = {}
+    for stage, durations in sorted(stage_durations.items()):
+        stages[stage] = summarize(durations)
+        stages[stage]['peak_rss_mb'] = round(sampler.peaks.get(stage, 0) / 1024 / 1024, 1)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'settings': vars(args),
+        'scenarios': scenarios,
+        'stages': stages,
+        'peak_rss_mb': round(sampler.peak / 1024 / 1024, 1),
+        'emails_delivered': smtp_fake.delivered
+    }
+
+    print(f"\n{'scenario':<12}{'count':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>12}{'p99 ms':>12}")
+    for name, values in scenarios.items():
+        print(f"{name:<12}{values['count']:>7}{values['errors']:>8}{values['throughput_per_second']:>10}{values['p50_ms']:>12}{values['p99_ms']:>12}")
+    print(f"\n{'stage':<20}{'count':>7}{'p50 ms':>12}{'p99 ms':>12}{'peak RSS MB':>14}")
+    for name, values in stages.items():
+        print(f"{name:<20}{values['count']:>7}{values['p50_ms']:>12}{values['p99_ms']:>12}{values['peak_rss_mb']:>14}")
+    print(f"\nProcess peak RSS: {results['peak_rss_mb']} MB")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {results_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
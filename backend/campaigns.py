@@ -0,0 +1,338 @@
+import hashlib
+import hmac
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from string import Template
+from urllib.parse import urlencode
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+from flask import current_app, jsonify, request, Response
+from admin import admin_required
+from metrics import Counter, track_external
+from models import db, Campaign, EmailList, User
+from user import smtp_connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Persistent SMTP connections (one per sender thread) and the overall sending rate they share
+CAMPAIGN_SMTP_CONNECTIONS = int(os.getenv('CAMPAIGN_SMTP_CONNECTIONS', 4))
+CAMPAIGN_RATE_PER_SECOND = float(os.getenv('CAMPAIGN_RATE_PER_SECOND', 10))
+# Recipients fetched from the server-side cursor and sent between two progress checkpoints
+CAMPAIGN_BATCH_SIZE = int(os.getenv('CAMPAIGN_BATCH_SIZE', 200))
+# Providers cap messages per session; the connection is replaced after this many
+CAMPAIGN_MESSAGES_PER_CONNECTION = int(os.getenv('CAMPAIGN_MESSAGES_PER_CONNECTION', 500))
+# A sending campaign whose heartbeat is older than this was interrupted and may be resumed
+CAMPAIGN_HEARTBEAT_TIMEOUT = int(os.getenv('CAMPAIGN_HEARTBEAT_TIMEOUT', 300))
+
+campaign_messages = Counter('campaign_messages_total', 'Campaign emails by result', ['result'])
+unsubscribes = Counter('campaign_unsubscribes_total', 'Addresses removed through unsubscribe links')
+
+class SigningKeyMissing(RuntimeError):
+    pass
+
+# Unsubscribe links are never signed or accepted with an empty key, anyone could unsubscribe anyone
+def _unsubscribe_key():
+    key = os.getenv('UNSUBSCRIBE_SIGNING_KEY') or os.getenv('JWT_SECRET_KEY')
+    if not key:
+        raise SigningKeyMissing("Set UNSUBSCRIBE_SIGNING_KEY (or JWT_SECRET_KEY) to sign unsubscribe links")
+    return key.encode()
+
+# HMAC-SHA256 of the (lowercased) address; the link stays valid for as long as the key does
+def unsubscribe_token(email):
+    return hmac.new(_unsubscribe_key(), f"unsubscribe:{email.strip().lower()}".encode(), hashlib.sha256).hexdigest()
+
+def verify_unsubscribe_token(email, token):
+    if not email or not token:
+        return False
+    try:
+        return hmac.compare_digest(unsubscribe_token(email), token)
+    except SigningKeyMissing as e:
+        print(f"Refusing unsubscribe link. Error: {str(e)}")
+        return False
+
+def unsubscribe_url(email):
+    query = urlencode({'email': email, 'token': unsubscribe_token(email)})
+    return f"{os.getenv('BACKEND_URL', '').rstrip('/')}/unsubscribe?{query}"
+
+# The server refused this message or recipient; retrying on another connection would not help
+REFUSED_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+# Spaces sends evenly at a fixed rate across all sender threads
+class Throttle:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# One logged-in SMTP connection per sender thread, kept open across messages
+class SMTPPool:
+    def __init__(self, messages_per_connection=CAMPAIGN_MESSAGES_PER_CONNECTION):
+        self.server = os.getenv('MAIL_SERVER')
+        self.port = int(os.getenv('MAIL_PORT', 465))
+        self.username = os.getenv('MAIL_USERNAME')
+        self.password = os.getenv('MAIL_PASSWORD')
+        self.messages_per_connection = messages_per_connection
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtp_connection(self.server, self.port)
+        if self.username:
+            connection.login(self.username, self.password)
+        with self._lock:
+            self._connections.add(connection)
+        self._local.connection = connection
+        self._local.sent = 0
+        return connection
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _drop(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            with self._lock:
+                self._connections.discard(connection)
+            self._quit(connection)
+        self._local.connection = None
+
+    # A dropped connection is reopened once; a second failure is raised to the campaign
+    def send(self, sender, recipient, message):
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None or self._local.sent >= self.messages_per_connection:
+                self._drop()
+                connection = self._connect()
+            try:
+                with track_external('smtp'):
+                    connection.sendmail(sender, [recipient], message)
+                self._local.sent += 1
+                return
+            except REFUSED_ERRORS:
+                raise
+            except OSError:
+                self._drop()
+                if attempt:
+                    raise
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            self._quit(connection)
+
+# Templates are parsed once per campaign; each recipient only fills in $first_name, $email and $unsubscribe_url
+class CampaignTemplate:
+    def __init__(self, campaign):
+        self.sender = os.getenv('MAIL_DEFAULT_SENDER')
+        sender_name = os.getenv('MAIL_SENDER_NAME')
+        self.from_header = f'{sender_name} <{self.sender}>' if sender_name else self.sender
+        self.subject = Template(campaign.subject or '')
+        self.text = Template(campaign.text_template or '')
+        self.html = Template(campaign.html_template) if campaign.html_template else None
+
+    def render(self, first_name, email):
+        unsubscribe = unsubscribe_url(email)
+        values = {'first_name': first_name or '', 'email': email, 'unsubscribe_url': unsubscribe}
+        message = MIMEMultipart('alternative')
+        message['From'] = self.from_header
+        message['To'] = email
+        message['Subject'] = self.subject.safe_substitute(values)
+        # One-click unsubscribe from the mail client (RFC 8058)
+        message['List-Unsubscribe'] = f"<{unsubscribe}>"
+        message['List-Unsubscribe-Post'] = 'List-Unsubscribe=One-Click'
+        message.attach(MIMEText(self.text.safe_substitute(values), 'plain'))
+        if self.html is not None:
+            message.attach(MIMEText(self.html.safe_substitute(values), 'html'))
+        return message.as_string()
+
+# (name, statement, id column) of every recipient source: the email list, then subscribed users without a row in it
+def recipient_sources():
+    listed = db.select(EmailList.id).where(EmailList.email == User.email).exists()
+    subscribed_users = db.select(User.id, User.first_name, User.email).where(User.email_list.is_(True), ~listed)
+    return [
+        ('email_list', db.select(EmailList.id, EmailList.first_name, EmailList.email), EmailList.id),
+        ('users', subscribed_users, User.id)
+    ]
+
+# Batches of recipients after after_id, from a server-side cursor on a connection of its own so that
+# committing progress on the session does not close the cursor
+def stream_recipients(statement, id_column, after_id, batch_size=CAMPAIGN_BATCH_SIZE):
+    if after_id is not None:
+        statement = statement.where(id_column > after_id)
+    with db.engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(statement.order_by(id_column))
+        for partition in result.partitions():
+            yield partition
+
+def deliver(pool, throttle, template, recipient):
+    throttle.wait()
+    try:
+        pool.send(template.sender, recipient.email, template.render(recipient.first_name, recipient.email))
+    except REFUSED_ERRORS as e:
+        campaign_messages.inc(1, 'refused')
+        print(f"Campaign email to {recipient.email} refused: {e}")
+        return False
+    campaign_messages.inc(1, 'sent')
+    return True
+
+# Take the campaign unless it is finished or another sender's heartbeat is still fresh
+def claim_campaign(campaign_id):
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=CAMPAIGN_HEARTBEAT_TIMEOUT)
+    result = db.session.execute(
+        db.update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status != 'completed',
+               db.or_(Campaign.status != 'sending', Campaign.heartbeat_at.is_(None), Campaign.heartbeat_at < stale))
+        .values(status='sending', heartbeat_at=now, last_error=None, finished_at=None,
+                started_at=db.func.coalesce(Campaign.started_at, now))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def _checkpoint(campaign_id, **values):
+    db.session.execute(db.update(Campaign).where(Campaign.id == campaign_id).values(**values))
+    db.session.commit()
+
+# Send a campaign from its last checkpoint; needs an app context. The cursor only ever passes recipients whose
+# message was accepted or refused, so after an interruption at most one batch of messages is sent again.
+def run_campaign(campaign_id, claimed=False):
+    if not claimed and not claim_campaign(campaign_id):
+        return None
+
+    campaign = db.session.get(Campaign, campaign_id)
+    template = CampaignTemplate(campaign)
+    cursor = dict(campaign.cursor or {})
+    pool = SMTPPool()
+    throttle = Throttle(CAMPAIGN_RATE_PER_SECOND)
+    try:
+        with ThreadPoolExecutor(max_workers=CAMPAIGN_SMTP_CONNECTIONS) as executor:
+            for source, statement, id_column in recipient_sources():
+                for recipients in stream_recipients(statement, id_column, cursor.get(source)):
+                    futures = [executor.submit(deliver, pool, throttle, template, recipient) for recipient in recipients]
+                    sent = failed = 0
+                    error = None
+                    for recipient, future in zip(recipients, futures):
+                        try:
+                            delivered = future.result()
+                        except Exception as e:
+                            error = error or e
+                            continue
+                        if error is None:
+                            cursor[source] = recipient.id
+                            sent += delivered
+                            failed += not delivered
+
+                    _checkpoint(campaign_id, cursor=dict(cursor), heartbeat_at=datetime.utcnow(),
+                                sent_count=Campaign.sent_count + sent, failed_count=Campaign.failed_count + failed)
+                    if error is not None:
+                        raise error
+
+        _checkpoint(campaign_id, status='completed', finished_at=datetime.utcnow())
+    except Exception as e:
+        db.session.rollback()
+        print(f"Campaign {campaign_id} stopped, it can be resumed. Error: {str(e)}")
+        _checkpoint(campaign_id, status='failed', last_error=str(e))
+    finally:
+        pool.close()
+
+    db.session.expire_all()
+    return db.session.get(Campaign, campaign_id)
+
+def _run_in_background(app, campaign_id):
+    with app.app_context():
+        run_campaign(campaign_id, claimed=True)
+
+# POST /admin/campaigns - create a draft; subject and templates may use $first_name, $email and $unsubscribe_url
+@admin_required()
+def create_campaign():
+    data = request.get_json(silent=True)
+
+    if not data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    for field in ['subject', 'text']:
+        if not data.get(field):
+            return jsonify({"error": f"{field} is required"}), 400
+
+    campaign = Campaign(
+        subject=data['subject'],
+        text_template=data['text'],
+        html_template=data.get('html'),
+        status='draft',
+        cursor={},
+        sent_count=0,
+        failed_count=0,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(campaign)
+    db.session.commit()
+
+    return jsonify(campaign.serialize()), 201
+
+# GET /admin/campaigns/<id> - status and progress
+@admin_required()
+def get_campaign(campaign_id):
+    campaign = db.session.get(Campaign, campaign_id)
+    if campaign is None:
+        return jsonify({"error": "Campaign not found"}), 404
+    return jsonify(campaign.serialize()), 200
+
+# POST /admin/campaigns/<id>/send - start, or resume an interrupted campaign, in the background
+@admin_required()
+def send_campaign(campaign_id):
+    if db.session.get(Campaign, campaign_id) is None:
+        return jsonify({"error": "Campaign not found"}), 404
+
+    if not claim_campaign(campaign_id):
+        return jsonify({"error": "Campaign is already sending or has been sent"}), 409
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_run_in_background, args=(app, campaign_id), daemon=True).start()
+
+    return jsonify(db.session.get(Campaign, campaign_id).serialize()), 202
+
+UNSUBSCRIBE_FORM = """<!doctype html>
+<html><body>
+<form method="post"><p>Stop receiving the Lemouniq newsletter?</p><button type="submit">Unsubscribe</button></form>
+</body></html>"""
+
+# GET /unsubscribe?email=...&token=... - a confirmation form, so link scanners opening the URL unsubscribe nobody
+# POST /unsubscribe?email=...&token=... - the form or the mail client's one-click request; no login needed, the
+# signed link is the credential. The address leaves the email list and its user stops being subscribed.
+def unsubscribe():
+    email = request.args.get('email', '')
+    if not verify_unsubscribe_token(email, request.args.get('token')):
+        return jsonify({"error": "Unsubscribe link is invalid"}), 403
+
+    if request.method == 'GET':
+        return Response(UNSUBSCRIBE_FORM, mimetype='text/html')
+
+    address = email.strip().lower()
+    db.session.execute(db.delete(EmailList).where(db.func.lower(EmailList.email) == address))
+    db.session.execute(db.update(User).where(db.func.lower(User.email) == address).values(email_list=False))
+    db.session.commit()
+    unsubscribes.inc()
+
+    return jsonify({"message": "You have been unsubscribed."}), 200
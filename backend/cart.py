@@ -0,0 +1,191 @@
+from datetime import datetime
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, Product, Cart, Order, OrderItem
+from auth_tokens import jwt_cached_required
+
+# Largest quantity of one product in a cart
+MAX_QUANTITY = 100
+
+# INSERT ... ON CONFLICT of the dialects that have it
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
+def current_user_id():
+    return db.session.execute(db.select(User.id).where(User.email == get_jwt_identity())).scalar()
+
+# Price a product sells for right now: the sale price while it is below the regular price
+def unit_price():
+    on_sale = db.and_(Product.sale_price.isnot(None), Product.sale_price < Product.price)
+    return db.case((on_sale, Product.sale_price), else_=Product.price)
+
+# Only published products with a price can be put in a cart; returns the error response otherwise
+def unavailable_product(product_id):
+    product = db.session.get(Product, product_id)
+    if product is None or product.status != Product.PUBLISHED_STATUS:
+        return jsonify({"error": "Product not found"}), 404
+    if product.price is None:
+        return jsonify({"error": "Product is not for sale"}), 400
+    return None
+
+def _money(value):
+    return float(value) if value is not None else None
+
+# Read a positive whole quantity from the JSON body; None when it is missing or invalid
+def parse_quantity(data, default=None, allow_zero=False):
+    quantity = data.get('quantity', default)
+    if isinstance(quantity, bool) or not isinstance(quantity, int):
+        return None
+    if quantity < (0 if allow_zero else 1) or quantity > MAX_QUANTITY:
+        return None
+    return quantity
+
+# One statement per change: concurrent adds of the same product both land, without a read-modify-write
+def upsert_cart_item(user_id, product_id, quantity, increment):
+    now = datetime.utcnow()
+    insert = UPSERT_INSERTS[db.session.get_bind().dialect.name]
+    statement = insert(Cart).values(user_id=user_id, product_id=product_id, quantity=quantity,
+                                    created_at=now, updated_at=now)
+    new_quantity = Cart.quantity + statement.excluded.quantity if increment else statement.excluded.quantity
+    statement = statement.on_conflict_do_update(
+        index_elements=[Cart.user_id, Cart.product_id],
+        set_={'quantity': db.case((new_quantity > MAX_QUANTITY, MAX_QUANTITY), else_=new_quantity), 'updated_at': now}
+    ).returning(Cart.quantity)
+    return db.session.execute(statement).scalar()
+
+# Lines and totals of a cart, priced in SQL with exact decimals
+def cart_contents(user_id):
+    price = unit_price()
+    line_total = price * Cart.quantity
+    rows = db.session.execute(
+        db.select(
+            Cart.product_id, Product.title, Cart.quantity, price.label('unit_price'), line_total.label('line_total'),
+            func.sum(line_total).over().label('total'), func.sum(Cart.quantity).over().label('item_count')
+        )
+        .join(Product, Product.id == Cart.product_id)
+        .where(Cart.user_id == user_id)
+        .order_by(Cart.created_at, Cart.id)
+    ).all()
+
+    return {
+        "items": [{
+            "product_id": row.product_id,
+            "title": row.title,
+            "quantity": row.quantity,
+            "unit_price": _money(row.unit_price),
+            "line_total": _money(row.line_total)
+        } for row in rows],
+        "item_count": int(rows[0].item_count) if rows else 0,
+        "total": _money(rows[0].total) if rows else 0.0
+    }
+
+# GET /cart
+@jwt_cached_required()
+def get_cart():
+    return jsonify(cart_contents(current_user_id())), 200
+
+# POST /cart/items - {"product_id": 1, "quantity": 1} adds to what is already in the cart
+@jwt_cached_required()
+def add_cart_item():
+    data = request.get_json(silent=True)
+
+    if not data or not isinstance(data.get('product_id'), int):
+        return jsonify({"error": "product_id is required"}), 400
+
+    quantity = parse_quantity(data, default=1)
+    if quantity is None:
+        return jsonify({"error": f"quantity must be between 1 and {MAX_QUANTITY}"}), 400
+
+    error = unavailable_product(data['product_id'])
+    if error:
+        return error
+
+    user_id = current_user_id()
+    upsert_cart_item(user_id, data['product_id'], quantity, increment=True)
+    db.session.commit()
+
+    return jsonify(cart_contents(user_id)), 200
+
+# PUT /cart/items/<product_id> - {"quantity": 3} sets the quantity; 0 removes the product
+@jwt_cached_required()
+def update_cart_item(product_id):
+    data = request.get_json(silent=True)
+
+    quantity = parse_quantity(data, allow_zero=True) if data else None
+    if quantity is None:
+        return jsonify({"error": f"quantity must be between 0 and {MAX_QUANTITY}"}), 400
+
+    user_id = current_user_id()
+    if quantity == 0:
+        db.session.execute(db.delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id))
+    else:
+        error = unavailable_product(product_id)
+        if error:
+            return error
+        upsert_cart_item(user_id, product_id, quantity, increment=False)
+    db.session.commit()
+
+    return jsonify(cart_contents(user_id)), 200
+
+# DELETE /cart/items/<product_id>
+@jwt_cached_required()
+def remove_cart_item(product_id):
+    user_id = current_user_id()
+    db.session.execute(db.delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id))
+    db.session.commit()
+
+    return jsonify(cart_contents(user_id)), 200
+
+# POST /cart/checkout - the cart becomes an order in one transaction: the order items are copied from the cart
+# with INSERT ... SELECT at the current prices, the total is summed in SQL and the cart lines are deleted.
+# The order stays pending, with nothing to download, until its payment is confirmed.
+@jwt_cached_required()
+def checkout():
+    user_id = current_user_id()
+
+    # Lock the lines being ordered; a product added meanwhile stays in the cart for the next order
+    lines = db.session.execute(
+        db.select(Cart.id, Product.status, unit_price().label('unit_price'))
+        .join(Product, Product.id == Cart.product_id)
+        .where(Cart.user_id == user_id)
+        .with_for_update(of=Cart)
+    ).all()
+
+    if not lines:
+        db.session.rollback()
+        return jsonify({"error": "Cart is empty"}), 400
+
+    # Products unpublished or unpriced since they were added
+    if any(line.status != Product.PUBLISHED_STATUS or line.unit_price is None for line in lines):
+        db.session.rollback()
+        return jsonify({"error": "Some products in the cart are not for sale"}), 400
+
+    cart_ids = [line.id for line in lines]
+
+    order = Order(user_id=user_id, order_date=datetime.utcnow(), status='pending')
+    db.session.add(order)
+    db.session.flush()
+
+    db.session.execute(db.insert(OrderItem).from_select(
+        ['order_id', 'product_id', 'quantity', 'price_per_unit'],
+        db.select(db.literal(order.id), Cart.product_id, Cart.quantity, unit_price())
+        .join(Product, Product.id == Cart.product_id)
+        .where(Cart.id.in_(cart_ids))
+    ))
+    order_total = (
+        db.select(func.sum(OrderItem.quantity * OrderItem.price_per_unit))
+        .where(OrderItem.order_id == order.id)
+        .scalar_subquery()
+    )
+    db.session.execute(db.update(Order).where(Order.id == order.id).values(total_amount=order_total))
+    db.session.execute(db.delete(Cart).where(Cart.id.in_(cart_ids)))
+    db.session.commit()
+
+    return jsonify({
+        "order": order.serialize(),
+        "items": [item.serialize() for item in order.items]
+    }), 201
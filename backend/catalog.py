@@ -0,0 +1,228 @@
+import base64
+import re
+from datetime import datetime
+from decimal import Decimal
+from flask import request, jsonify
+from sqlalchemy import tuple_, func, or_, and_, distinct, literal_column
+from sqlalchemy.orm import joinedload, selectinload, load_only, noload
+from models import db, Product, Category, ProductImage
+from response_cache import cached_view
+
+# Fields a client can ask for with ?fields=
+PRODUCT_FIELDS = {
+    'id', 'category_id', 'title', 'status', 'description', 'meta_description',
+    'focus_keyword', 'sale_price', 'price', 'created_at', 'updated_at'
+}
+
+# Listing leaves out the long description unless it is explicitly requested
+DEFAULT_LIST_FIELDS = ['id', 'category_id', 'title', 'status', 'sale_price', 'price', 'created_at', 'updated_at']
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+MAX_SEARCH_TERMS = 10
+
+# Image facets a listing can be filtered and counted on (?orientation=vertical&color=blue)
+FACET_COLUMNS = {
+    'orientation': ProductImage.orientation,
+    'color': ProductImage.color_family
+}
+
+# Storefront reads only ever see published products
+def published():
+    return Product.status == Product.PUBLISHED_STATUS
+
+# Parse ?fields=title,price into a list of known columns (id is always included)
+def parse_fields(default_fields):
+    fields_param = request.args.get('fields')
+    if not fields_param:
+        return list(default_fields)
+    fields = [field.strip() for field in fields_param.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+# Conditions on a product's images for the facet filters in the query string, optionally leaving one out
+def facet_conditions(skip=None):
+    conditions = []
+    for name, column in FACET_COLUMNS.items():
+        value = request.args.get(name)
+        if value and name != skip:
+            conditions.append(column == value)
+    min_aspect = request.args.get('min_aspect_ratio')
+    max_aspect = request.args.get('max_aspect_ratio')
+    if min_aspect is not None:
+        conditions.append(ProductImage.aspect_ratio >= float(min_aspect))
+    if max_aspect is not None:
+        conditions.append(ProductImage.aspect_ratio <= float(max_aspect))
+    return conditions
+
+# The cursor is the (created_at, id) of the last product on the previous page
+def encode_cursor(product):
+    raw = f"{product.created_at.isoformat()}|{product.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    created_at, product_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(product_id)
+
+# Only the requested columns of a product, plus category and main image when loaded
+def serialize_product(product, fields, include_mockups=False):
+    data = {}
+    for field in fields:
+        value = getattr(product, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        data[field] = value
+
+    data['category'] = {'id': product.category.id, 'name': product.category.name} if product.category else None
+
+    images = product.images
+    if include_mockups:
+        data['images'] = [image.serialize() for image in images]
+    else:
+        data['main_image'] = images[0].main_image if images else None
+    return data
+
+# Listing query: products + category in one joined SELECT, main images in one SELECT ... IN
+def catalog_query(fields):
+    columns = [getattr(Product, field) for field in fields]
+    # The keyset columns are always needed to build the next cursor
+    columns += [Product.created_at, Product.id]
+    return Product.query.options(
+        load_only(*columns),
+        joinedload(Product.category).load_only(Category.id, Category.name),
+        selectinload(Product.images).options(
+            load_only(ProductImage.id, ProductImage.product_id, ProductImage.main_image),
+            noload(ProductImage.mockups)
+        )
+    )
+
+# GET /products?limit=24&cursor=...&fields=title,price&category_id=1
+@cached_view('products')
+def list_products():
+    try:
+        fields = parse_fields(DEFAULT_LIST_FIELDS)
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+        conditions = facet_conditions()
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Invalid query parameters. {str(e)}"}), 400
+
+    query = catalog_query(fields).filter(Product.created_at.isnot(None), published())
+
+    category_id = request.args.get('category_id', type=int)
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
+
+    if conditions:
+        query = query.filter(Product.images.any(and_(*conditions)))
+
+    if after:
+        query = query.filter(tuple_(Product.created_at, Product.id) < tuple_(*after))
+
+    # Fetch one extra row to know whether there is a next page
+    products = query.order_by(Product.created_at.desc(), Product.id.desc()).limit(limit + 1).all()
+    has_more = len(products) > limit
+    products = products[:limit]
+
+    return jsonify({
+        'products': [serialize_product(product, fields) for product in products],
+        'next_cursor': encode_cursor(products[-1]) if has_more else None
+    }), 200
+
+# GET /products/<id>?fields=...
+@cached_view('product')
+def get_product(product_id):
+    try:
+        fields = parse_fields(PRODUCT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Product + category, then images, then all of their mockups: three queries in total
+    product = Product.query.options(
+        joinedload(Product.category),
+        selectinload(Product.images).selectinload(ProductImage.mockups)
+    ).filter(Product.id == product_id, published()).first()
+
+    if not product:
+        return jsonify({"error": "Product not found"}), 404
+
+    return jsonify(serialize_product(product, sorted(fields), include_mockups=True)), 200
+
+# "sunset bea" -> "sunset:* & bea:*", every term matched as a prefix of an indexed word
+def prefix_tsquery(text):
+    terms = re.findall(r'\w+', text.lower())[:MAX_SEARCH_TERMS]
+    return ' & '.join(f"{term}:*" for term in terms)
+
+# GET /search?q=sunset+beach&limit=24&page=1&fields=title,price
+@cached_view('search')
+def search_products():
+    try:
+        fields = parse_fields(DEFAULT_LIST_FIELDS)
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameters. {str(e)}"}), 400
+
+    tsquery = prefix_tsquery(request.args.get('q', ''))
+    if not tsquery:
+        return jsonify({"error": "q is required"}), 400
+
+    query = catalog_query(fields).filter(published())
+    if db.engine.dialect.name == 'postgresql':
+        # Matches come from the GIN index; only the matching rows are ranked
+        search_vector = literal_column('products.search_vector')
+        ts_query = func.to_tsquery('english', tsquery)
+        rank = func.ts_rank_cd(search_vector, ts_query)
+        query = query.add_columns(rank).filter(search_vector.op('@@')(ts_query)).order_by(rank.desc(), Product.id.desc())
+    else:
+        # Unranked substring fallback for databases without tsvector (development on SQLite)
+        terms = [term.rstrip(':*') for term in tsquery.split(' & ')]
+        for term in terms:
+            pattern = f"%{term}%"
+            query = query.filter(or_(Product.title.ilike(pattern), Product.focus_keyword.ilike(pattern),
+                                     Product.meta_description.ilike(pattern), Product.description.ilike(pattern)))
+        query = query.add_columns(literal_column('0.0')).order_by(Product.id.desc())
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.offset((page - 1) * limit).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for product, rank in rows:
+        data = serialize_product(product, fields)
+        data['rank'] = float(rank)
+        results.append(data)
+
+    return jsonify({
+        'products': results,
+        'page': page,
+        'next_page': page + 1 if has_more else None
+    }), 200
+
+# GET /products/facets?orientation=vertical&color=blue&category_id=1 - product counts per facet value.
+# Each facet is counted with every other filter applied but its own, so alternatives stay visible.
+@cached_view('facets')
+def product_facets():
+    category_id = request.args.get('category_id', type=int)
+    counts = {}
+    try:
+        for name, column in FACET_COLUMNS.items():
+            query = db.session.query(column, func.count(distinct(ProductImage.product_id))).join(
+                Product, Product.id == ProductImage.product_id
+            ).filter(column.isnot(None), published(), *facet_conditions(skip=name))
+            if category_id is not None:
+                query = query.filter(Product.category_id == category_id)
+            counts[name] = dict(query.group_by(column).all())
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameters. {str(e)}"}), 400
+
+    return jsonify(counts), 200
@@ -0,0 +1,243 @@
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from flask import request, jsonify
+from werkzeug.utils import secure_filename
+from image_processing import UPLOAD_FOLDER, allowed_file, process_file_paths, store_upload
+from metrics import Counter, count_bytes, upload_jobs_in_flight
+from profiling import profile_requested
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Partial files live inside the upload folder so finalizing is a rename, not a copy
+PARTIAL_FOLDER = os.path.join(UPLOAD_FOLDER, '.partial')
+MAX_UPLOAD_BYTES = int(os.getenv('CHUNKED_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+SESSION_MAX_AGE = int(os.getenv('CHUNKED_UPLOAD_SESSION_MAX_AGE', 24 * 3600))
+BLOCK_SIZE = 1024 * 1024
+
+chunks_received = Counter('chunked_upload_chunks_total', 'Chunks written by the resumable upload endpoint')
+
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+def _meta_path(session_id):
+    return os.path.join(PARTIAL_FOLDER, f"{session_id}.json")
+
+def _data_path(session_id):
+    return os.path.join(PARTIAL_FOLDER, f"{session_id}.part")
+
+# Merge a new [start, end) range into a sorted list of non-overlapping ranges
+def merge_range(ranges, start, end):
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+# Lock the session metadata across threads and worker processes while it is read and updated
+@contextmanager
+def locked_session(session_id):
+    with open(_meta_path(session_id), 'r+') as meta_file:
+        fcntl.flock(meta_file, fcntl.LOCK_EX)
+        try:
+            # A finalize that held the lock before us has already unlinked the session
+            if os.fstat(meta_file.fileno()).st_nlink == 0:
+                raise FileNotFoundError(_meta_path(session_id))
+            session = json.load(meta_file)
+
+            def save():
+                meta_file.seek(0)
+                meta_file.truncate()
+                json.dump(session, meta_file)
+                meta_file.flush()
+                os.fsync(meta_file.fileno())
+
+            yield session, save
+        finally:
+            fcntl.flock(meta_file, fcntl.LOCK_UN)
+
+def _session_exists(session_id):
+    return bool(SESSION_ID_PATTERN.match(session_id)) and os.path.exists(_meta_path(session_id))
+
+def _session_status(session_id, session):
+    received = sum(end - start for start, end in session['received'])
+    return {
+        'upload_id': session_id,
+        'filename': session['filename'],
+        'size': session['size'],
+        'received': session['received'],
+        'received_bytes': received,
+        'complete': session['received'] == [[0, session['size']]]
+    }
+
+# POST /uploads {"filename": "art.png", "size": 734003200, "product_id": 7} - create a resumable upload session.
+# product_id is optional (see prepare_checkpoint). Sent with a valid X-Profile header, the processing job of this
+# upload is profiled whichever request finalizes it.
+def create_upload_session():
+    data = request.get_json(silent=True)
+    if not data or 'filename' not in data or 'size' not in data:
+        return jsonify({"error": "filename and size are required"}), 400
+
+    filename = secure_filename(data['filename'])
+    if not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+
+    product_id = data.get('product_id')
+    if product_id is not None and not isinstance(product_id, int):
+        return jsonify({"error": "product_id must be an integer"}), 400
+
+    try:
+        size = int(data['size'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "size must be an integer"}), 400
+    if size <= 0 or size > MAX_UPLOAD_BYTES:
+        return jsonify({"error": f"size must be between 1 and {MAX_UPLOAD_BYTES} bytes"}), 400
+
+    os.makedirs(PARTIAL_FOLDER, exist_ok=True)
+    remove_stale_sessions()
+
+    session_id = uuid.uuid4().hex
+    # Reserve the full size up front (sparse on most filesystems) so chunks can land at any offset
+    with open(_data_path(session_id), 'wb') as data_file:
+        data_file.truncate(size)
+    with open(_meta_path(session_id), 'w') as meta_file:
+        json.dump({'filename': filename, 'size': size, 'received': [], 'created_at': time.time(),
+                   'profile': profile_requested(), 'product_id': product_id}, meta_file)
+
+    return jsonify({"upload_id": session_id, "filename": filename, "size": size, "chunk_size": BLOCK_SIZE * 8}), 201
+
+# GET /uploads/<id> - which byte ranges the server already has
+def get_upload_session(upload_id):
+    if not _session_exists(upload_id):
+        return jsonify({"error": "Upload session not found"}), 404
+    try:
+        with locked_session(upload_id) as (session, save):
+            return jsonify(_session_status(upload_id, session)), 200
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+
+# Stream the body straight to its place in the partial file, never holding the chunk in memory.
+# Writers share a lock on the partial file so finalize can wait for them before moving it.
+def _write_chunk(upload_id, offset, expected_length):
+    written = 0
+    fd = os.open(_data_path(upload_id), os.O_WRONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # Finalize moved the file while we waited for the lock
+        if not os.path.exists(_data_path(upload_id)):
+            raise FileNotFoundError(_data_path(upload_id))
+        while written < expected_length:
+            block = request.stream.read(min(BLOCK_SIZE, expected_length - written))
+            if not block:
+                break
+            os.pwrite(fd, block, offset + written)
+            written += len(block)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return written
+
+# PUT /uploads/<id> with Content-Range: bytes 0-8388607/734003200 (or ?offset=0) - write one chunk
+def upload_chunk(upload_id):
+    if not _session_exists(upload_id):
+        return jsonify({"error": "Upload session not found"}), 404
+
+    try:
+        with locked_session(upload_id) as (session, save):
+            size = session['size']
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        match = CONTENT_RANGE_PATTERN.match(content_range.strip())
+        if not match:
+            return jsonify({"error": "Invalid Content-Range header"}), 400
+        offset, last, total = int(match.group(1)), int(match.group(2)), match.group(3)
+        if total != '*' and int(total) != size:
+            return jsonify({"error": f"Content-Range total does not match the upload size of {size} bytes"}), 400
+        expected_length = last - offset + 1
+    else:
+        offset = request.args.get('offset', type=int)
+        expected_length = request.content_length
+        if offset is None or expected_length is None:
+            return jsonify({"error": "Content-Range header or offset and Content-Length are required"}), 400
+
+    if offset < 0 or expected_length <= 0 or offset + expected_length > size:
+        return jsonify({"error": "Chunk is outside of the file"}), 416
+
+    try:
+        written = _write_chunk(upload_id, offset, expected_length)
+        count_bytes('chunked_upload', written)
+        chunks_received.inc()
+
+        # Record only what actually arrived; a cut-off chunk leaves a gap the client re-sends
+        with locked_session(upload_id) as (session, save):
+            if written:
+                session['received'] = merge_range(session['received'], offset, offset + written)
+                save()
+            status = _session_status(upload_id, session)
+    except FileNotFoundError:
+        # The upload was finalized (or expired) while this chunk was in flight
+        return jsonify({"error": "Upload session is already finalized"}), 409
+
+    if written < expected_length:
+        return jsonify({"error": "Chunk was incomplete", **status}), 400
+    return jsonify(status), 200
+
+# POST /uploads/<id>/finalize - move the assembled file into the upload folder and process it
+def finalize_upload(upload_id):
+    if not _session_exists(upload_id):
+        return jsonify({"error": "Upload session not found"}), 404
+
+    try:
+        with locked_session(upload_id) as (session, save):
+            status = _session_status(upload_id, session)
+            if not status['complete']:
+                return jsonify({"error": "Upload is missing data", **status}), 409
+
+            filename = session['filename']
+            profile = session.get('profile') or profile_requested()
+            product_id = session.get('product_id')
+            # Take the partial file out of the session (same filesystem, so a rename without copying any bytes)
+            assembled_path = os.path.join(PARTIAL_FOLDER, f"{upload_id}.assembled")
+            data_fd = os.open(_data_path(upload_id), os.O_RDONLY)
+            try:
+                # Wait for chunk writes still in flight; later ones find the partial file gone
+                fcntl.flock(data_fd, fcntl.LOCK_EX)
+                os.replace(_data_path(upload_id), assembled_path)
+            finally:
+                os.close(data_fd)
+            os.remove(_meta_path(upload_id))
+    except FileNotFoundError:
+        # Another request finalized this upload first
+        return jsonify({"error": "Upload session not found"}), 404
+
+    # Named by its content hash in the upload folder, like files sent to /upload
+    file_path = store_upload(assembled_path, filename, product_id)
+    upload_jobs_in_flight.inc()
+    try:
+        processed_data = process_file_paths([file_path], profile=profile)
+    finally:
+        upload_jobs_in_flight.dec()
+
+    return jsonify({'processed_data': processed_data}), 200
+
+# Sessions nobody finished within SESSION_MAX_AGE are deleted when a new session is created
+def remove_stale_sessions():
+    now = time.time()
+    for name in os.listdir(PARTIAL_FOLDER):
+        path = os.path.join(PARTIAL_FOLDER, name)
+        try:
+            if now - os.path.getmtime(path) > SESSION_MAX_AGE:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -4,6 +4,8 @@ import time
 from dotenv import load_dotenv
 from PIL import Image
 import base64
+from metrics import timed_stage, track_external, count_bytes
+from artifact_storage import artifact_store
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,6 +14,11 @@ load_dotenv()
 api_key = os.getenv('PRINTFUL_TOKEN')
 imgbb_api_key = os.getenv('IMG_BB_TOKEN')  # Replace with your imgbb API key
 
+# Service endpoints (overridable so the pipeline can run against local stand-ins)
+printful_api_url = os.getenv('PRINTFUL_API_URL', 'https://api.printful.com')
+imgbb_api_url = os.getenv('IMGBB_API_URL', 'https://api.imgbb.com/1/upload')
+printful_poll_interval = float(os.getenv('PRINTFUL_POLL_INTERVAL', 10))
+
 # Getting the filename
 def get_base_filename(file_path):
     # Get the base filename without the extension
@@ -21,7 +28,7 @@ def get_base_filename(file_path):
 
 def upload_image_to_imgbb(image_path):
     # Set the API endpoint for imgbb
-    url = "https://api.imgbb.com/1/upload"
+    url = imgbb_api_url
 
     # Read the image file and encode as base64
     with open(image_path, "rb") as file:
@@ -35,7 +42,11 @@ def upload_image_to_imgbb(image_path):
     }
 
     # Make the POST request to imgbb
-    response = requests.post(url, data=payload)
+    with track_external('imgbb') as call:
+        response = requests.post(url, data=payload)
+        if response.status_code != 200:
+            call.fail()
+    count_bytes('imgbb_upload', len(image_data))
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -47,144 +58,165 @@ def upload_image_to_imgbb(image_path):
         print(f"Image upload failed. Status Code: {response.status_code}")
         return None
 
-def get_image_orientation(image_path):
+def orientation_for_size(width, height):
     # Check if the image is square, vertical, or horizontal
-    with Image.open(image_path) as img:
-        width, height = img.size
-        if width == height:
-            return "square"
-        elif width < height:
-            return "vertical"
-        else:
-            return "horizontal"
+    if width == height:
+        return "square"
+    elif width < height:
+        return "vertical"
+    else:
+        return "horizontal"
 
-def mockup_generator(image_path):
-    
+def get_image_orientation(image_path):
+    # Only the header is read to get the size
+    with Image.open(image_path) as img:
+        return orientation_for_size(*img.size)
+
+# Printful products we generate mockups for
+MOCKUP_PRODUCTS = {
+    "canvas": {
+        "task_id": 3,
+        "option_groups": [
+            "Lifestyle",
+            "Lifestyle 10",
+            "Lifestyle 11",
+            "Lifestyle 2",
+            "Lifestyle 3",
+            "Lifestyle 4",
+            "Lifestyle 5",
+            "Lifestyle 6",
+            "Lifestyle 7",
+            "Lifestyle 8",
+            "Lifestyle 9",
+            "Person",
+            "Wall"
+        ]
+    },
+    "poster": {
+        "task_id": 171,
+        "option_groups": [
+            "Flat",
+            "Halloween",
+            "Holiday season",
+            "Lifestyle",
+            "Lifestyle 10",
+            "Lifestyle 2",
+            "Lifestyle 3",
+            "Lifestyle 4",
+            "Lifestyle 5",
+            "Lifestyle 6",
+            "Lifestyle 7",
+            "Lifestyle 8",
+            "Lifestyle 9",
+            "Lifestyle, Premium",
+            "Person",
+            "Spring/summer vibes"
+        ]
+    }
+}
+
+# Define variant IDs for canvas and poster based on orientation
+VARIANT_IDS = {
+    "square": {"canvas": 823, "poster": 6873},
+    "vertical": {"canvas": 5, "poster": 6875},
+    "horizontal": {"canvas": 5, "poster": 6875}
+}
+
+POSITION_SETTINGS = {
+    "square": {"area_width": 1800, "area_height": 1800, "width": 1800, "height": 1800, "top": 0, "left": 0},
+    "vertical": {"area_width": 1800, "area_height": 2400, "width": 1800, "height": 2400, "top": 0, "left": 0},
+    "horizontal": {"area_width": 2400, "area_height": 1800, "width": 2400, "height": 1800, "top": 0, "left": 0}
+}
+
+# Generate the mockups of one product (canvas or poster) from an image already uploaded to imgbb
+def generate_product_mockups(image_path, uploaded_image_url, product):
     filename = get_base_filename(image_path)
-    print(f"Filename is {filename}")
-    
-    # Upload the local image to imgbb and get the image URL
-    uploaded_image_url = upload_image_to_imgbb(image_path)
-    if not uploaded_image_url:
-        print("Image upload to imgbb failed. Aborting mockup generation.")
-        return
 
     # Determine the image orientation
     image_orientation = get_image_orientation(image_path)
     print(f"Image Orientation: {image_orientation}")
 
-    # Define API endpoints
-    url_create_task_canvas = 'https://api.printful.com/mockup-generator/create-task/3'
-    url_create_task_poster = 'https://api.printful.com/mockup-generator/create-task/171'
-    url_task_status = 'https://api.printful.com/mockup-generator/task'
+    url_create_task = f'{printful_api_url}/mockup-generator/create-task/{MOCKUP_PRODUCTS[product]["task_id"]}'
+    url_task_status = f'{printful_api_url}/mockup-generator/task'
 
     # Headers including API key
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {api_key}'
     }
-    
-    # Define option groups for canvas
-    canvas_option_groups = [
-        "Lifestyle",
-        "Lifestyle 10",
-        "Lifestyle 11",
-        "Lifestyle 2",
-        "Lifestyle 3",
-        "Lifestyle 4",
-        "Lifestyle 5",
-        "Lifestyle 6",
-        "Lifestyle 7",
-        "Lifestyle 8",
-        "Lifestyle 9",
-        "Person",
-        "Wall"
-    ]
-
-    # Define option groups for poster
-    poster_option_groups = [
-        "Flat",
-        "Halloween",
-        "Holiday season",
-        "Lifestyle",
-        "Lifestyle 10",
-        "Lifestyle 2",
-        "Lifestyle 3",
-        "Lifestyle 4",
-        "Lifestyle 5",
-        "Lifestyle 6",
-        "Lifestyle 7",
-        "Lifestyle 8",
-        "Lifestyle 9",
-        "Lifestyle, Premium",
-        "Person",
-        "Spring/summer vibes"
-    ]
-
-    # Define variant IDs for canvas and poster based on orientation
-    variant_ids = {
-        "square": {"canvas": 823, "poster": 6873},
-        "vertical": {"canvas": 5, "poster": 6875},
-        "horizontal": {"canvas": 5, "poster": 6875}
-    }
 
-    # Prepare payload templates for canvas and poster
-    payload_template = {
-        "variant_ids": [],
+    payload = {
+        "variant_ids": [VARIANT_IDS[image_orientation][product]],
         "format": "jpg",
         "files": [
             {
                 "placement": "default",
-                "image_url": uploaded_image_url
+                "image_url": uploaded_image_url,
+                "position": POSITION_SETTINGS[image_orientation]
             }
-        ]
+        ],
+        "option_groups": MOCKUP_PRODUCTS[product]["option_groups"]
     }
+
+    with track_external('printful') as call:
+        response = requests.post(url_create_task, json=payload, headers=headers)
+        if response.status_code != 200:
+            call.fail()
+    return handle_mockup_response(response, f"{filename}_{product}", url_task_status, headers, product)
+
+@timed_stage('mockups')
+def mockup_generator(image_path):
     
-    position_settings = {
-        "square": {"area_width": 1800, "area_height": 1800, "width": 1800, "height": 1800, "top": 0, "left": 0
-            },
-        "vertical": {"area_width": 1800, "area_height": 2400, "width": 1800, "height": 2400, "top": 0, "left": 0
-            },
-        "horizontal": {"area_width": 2400, "area_height": 1800, "width": 2400, "height": 1800, "top": 0, "left": 0
-            }
-    }
+    filename = get_base_filename(image_path)
+    print(f"Filename is {filename}")
+    
+    # Upload the local image to imgbb and get the image URL
+    uploaded_image_url = upload_image_to_imgbb(image_path)
+    if not uploaded_image_url:
+        print("Image upload to imgbb failed. Aborting mockup generation.")
+        return []
+
+    mockups = []
+    for product in MOCKUP_PRODUCTS:
+        mockups += generate_product_mockups(image_path, uploaded_image_url, product)
 
-    payload_canvas = payload_template.copy()
-    payload_canvas["variant_ids"] = [variant_ids[image_orientation]["canvas"]]
-    payload_canvas["files"][0]["position"] = position_settings[image_orientation]
-    payload_canvas["option_groups"] = canvas_option_groups
-    response = requests.post(url_create_task_canvas, json=payload_canvas, headers=headers)
-    handle_mockup_response(response, f"{filename}_canvas", url_task_status, headers)
-
-    payload_poster = payload_template.copy()
-    payload_poster["variant_ids"] = [variant_ids[image_orientation]["poster"]]
-    payload_poster["files"][0]["position"] = position_settings[image_orientation]
-    payload_poster["option_groups"] = poster_option_groups
-    response = requests.post(url_create_task_poster, json=payload_poster, headers=headers)
-    handle_mockup_response(response, f"{filename}_poster", url_task_status, headers)
+    # Mockup records ready for models.add_product_mockups()
+    return mockups
     
-# This function saves the file
+# This function saves the file and returns a mockup record (or None if the download failed)
 
 def save_file(url, filename):
-    response = requests.get(url)
+    with track_external('printful_cdn') as call:
+        response = requests.get(url)
+        if response.status_code != 200:
+            call.fail()
     if response.status_code == 200:
-        # Define the output path in the "processed" folder
-        output_folder = os.getenv('MOCKUP_FOLDER')
-        os.makedirs(output_folder, exist_ok=True)
-        with open(os.path.join(output_folder, filename), 'wb') as f:
-            f.write(response.content)
-        print(f"Saved file: {filename}")
+        # Stored by content hash, so mockups of different uploads never overwrite each other
+        key = artifact_store.put_bytes(response.content, '.jpg')
+        output_path = artifact_store.local_path(key)
+        print(f"Saved file: {filename} as {key}")
+        count_bytes('mockup_download', len(response.content))
+
+        # Reading the size only parses the JPEG header
+        with Image.open(output_path) as img:
+            width, height = img.size
+        return {'key': key, 'path': output_path, 'url': url, 'width': width, 'height': height, 'bytes': len(response.content)}
     else:
         print(f"Failed to download file from {url}")
+        return None
 
-def handle_mockup_response(response, product_type, url_task_status, headers):
+def handle_mockup_response(response, product_type, url_task_status, headers, kind):
+    saved_mockups = []
     if response.status_code == 200:
         task_key = response.json().get("result", {}).get("task_key")
         print(f"Mockup generation task created for {product_type}. Task Key: {task_key}")
 
         # Poll for task completion
         for _ in range(10):  # Max 10 attempts
-            task_response = requests.get(f'{url_task_status}?task_key={task_key}', headers=headers)
+            with track_external('printful') as call:
+                task_response = requests.get(f'{url_task_status}?task_key={task_key}', headers=headers)
+                if task_response.status_code != 200:
+                    call.fail()
             task_status = task_response.json().get("result", {}).get("status")
 
             if task_status == "completed":
@@ -195,14 +227,18 @@ def handle_mockup_response(response, product_type, url_task_status, headers):
 
                 # Save the default mockup
                 default_mockup_url = mockups[0].get("mockup_url")
-                save_file(default_mockup_url, f"{product_type}_default_mockup.jpg")
+                record = save_file(default_mockup_url, f"{product_type}_default_mockup.jpg")
+                if record:
+                    saved_mockups.append({'kind': kind, 'option_group': 'Default', **record})
 
                 # Iterate through extra mockups
                 for j, mockup in enumerate(extra_files):
                     url_data = mockup.get("url")  # Get the URL data which might be a dictionary
                     print(f"Extra URL: {url_data}")
                     filename = f'{product_type}_mockup_{j+1}.jpg'
-                    save_file(url_data, filename)
+                    record = save_file(url_data, filename)
+                    if record:
+                        saved_mockups.append({'kind': kind, 'option_group': mockup.get("option_group") or mockup.get("title"), **record})
 
                 print(f"Mockups for {product_type} saved to the 'processed' folder.")
                 break
@@ -210,7 +246,9 @@ def handle_mockup_response(response, product_type, url_task_status, headers):
                 print(f"Mockup generation task for {product_type} failed.")
                 break
             else:
-                print(f"Mockup generation in progress for {product_type}. Checking again in 10 seconds.")
-                time.sleep(10)
+                print(f"Mockup generation in progress for {product_type}. Checking again in {printful_poll_interval} seconds.")
+                time.sleep(printful_poll_interval)
     else:
-        print(f"Error in creating mockup task for {product_type}: {response.status_code} - {response.text}")
\ No newline at end of file
+        print(f"Error in creating mockup task for {product_type}: {response.status_code} - {response.text}")
+
+    return saved_mockups
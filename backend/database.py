@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from urllib.parse import quote_plus
+from dotenv import load_dotenv
+from sqlalchemy.pool import QueuePool
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Construct the database URL from the environment variables
+def database_uri():
+    db_name = os.getenv('DB_NAME')
+    username = os.getenv('DB_USERNAME')
+    password = quote_plus(os.getenv('DB_PASSWORD', ''))  # Encode the password with special characters
+    host = os.getenv('DB_HOST')
+    port = os.getenv('DB_PORT')
+    return f"postgresql://{username}:{password}@{host}:{port}/{db_name}"
+
+# Statistics about how long requests wait for a pooled connection
+_pool_lock = threading.Lock()
+_pool_wait = {'checkouts': 0, 'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'timeouts': 0}
+
+# Queue pool that records how long every checkout had to wait for a connection
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            with _pool_lock:
+                _pool_wait['timeouts'] += 1
+            raise
+        waited = time.perf_counter() - start
+        with _pool_lock:
+            _pool_wait['checkouts'] += 1
+            _pool_wait['total_wait_seconds'] += waited
+            _pool_wait['max_wait_seconds'] = max(_pool_wait['max_wait_seconds'], waited)
+        return connection
+
+# Engine options shared by every part of the app (one engine per process)
+def engine_options():
+    statement_timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+        'connect_args': {'options': f"-c statement_timeout={statement_timeout}"}
+    }
+
+# Current utilization of the pool and the checkout wait times. Only a QueuePool has a size and overflow;
+# other pool classes (StaticPool in tests, NullPool, SingletonThreadPool) report the checkout waits alone.
+def pool_stats(engine):
+    pool = engine.pool
+    with _pool_lock:
+        wait = dict(_pool_wait)
+    stats = {
+        'pool_class': type(pool).__name__,
+        'checkouts': wait['checkouts'],
+        'checkout_timeouts': wait['timeouts'],
+        'avg_checkout_wait_seconds': wait['total_wait_seconds'] / wait['checkouts'] if wait['checkouts'] else 0.0,
+        'max_checkout_wait_seconds': wait['max_wait_seconds']
+    }
+    if isinstance(pool, QueuePool):
+        size = pool.size()
+        checked_out = pool.checkedout()
+        capacity = size + max(pool._max_overflow, 0)
+        stats.update({
+            'pool_size': size,
+            'max_overflow': pool._max_overflow,
+            'checked_in': pool.checkedin(),
+            'checked_out': checked_out,
+            'overflow': pool.overflow(),
+            'utilization': checked_out / capacity if capacity else 0.0
+        })
+    return stats
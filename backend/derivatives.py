@@ -0,0 +1,200 @@
+import os
+import threading
+import hashlib
+from dotenv import load_dotenv
+from flask import request, jsonify, send_file
+from PIL import Image
+from werkzeug.utils import secure_filename
+from artifact_storage import artifact_store, is_artifact_key
+from metrics import Counter, timed_stage, count_bytes
+
+# Load environment variables from .env file
+load_dotenv()
+
+DERIVATIVE_FOLDER = os.getenv('DERIVATIVE_FOLDER', 'derivatives')
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv('DERIVATIVE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Fixed width ladder for srcset; sources are never upscaled
+WIDTHS = (320, 640, 960, 1280, 1920)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+
+# Where the originals of each kind of image lived before they were content-addressed
+def source_folders():
+    return {
+        'main': os.getenv('UPLOAD_FOLDER'),
+        'mockup': os.getenv('MOCKUP_FOLDER')
+    }
+
+derivative_requests = Counter('derivative_requests_total', 'Derivative image requests', ['result'])
+derivative_evictions = Counter('derivative_evictions_total', 'Derivatives evicted from the on-disk cache')
+
+# Short content version of a source file; part of the derivative URL so it can be cached forever.
+# Content-addressed sources are versioned by their key, which already changes with every byte.
+def source_version(source_path, key=None):
+    if key:
+        return key[:12]
+    stat = os.stat(source_path)
+    return hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+
+def derivative_path(kind, name, version, width, fmt):
+    stem = os.path.splitext(name)[0]
+    return os.path.join(DERIVATIVE_FOLDER, kind, stem, version, f"{width}.{fmt}")
+
+def derivative_url(kind, name, version, width, fmt):
+    return f"/images/{kind}/{name}/{width}.{fmt}?v={version}"
+
+# Storefront URLs of every ladder width and format of a content-addressed source
+def artifact_derivative_urls(kind, key):
+    return {fmt: [f"/images/{kind}/{key}/{width}.{fmt}" for width in WIDTHS] for fmt in FORMATS}
+
+# Size-bounded cache: the running total is rebuilt from disk once, then kept up to date on writes
+class DerivativeCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(DERIVATIVE_FOLDER):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    # A hit bumps the mtime, which is what eviction orders by
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(file_size for _, file_size, _ in self._scan())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    # Drop least recently used derivatives until the cache is back under 90% of its budget
+    def _evict(self):
+        files = sorted(self._scan())
+        self._size = sum(file_size for _, file_size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, file_size, path in files:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._size -= file_size
+            derivative_evictions.inc()
+
+cache = DerivativeCache(DERIVATIVE_CACHE_MAX_BYTES)
+
+def _save(image, path, fmt):
+    pil_format, _, options = FORMATS[fmt]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    image.save(temp_path, format=pil_format, **options)
+    os.replace(temp_path, path)
+    size = os.path.getsize(path)
+    count_bytes('derivatives', size)
+    cache.added(size)
+
+def _open_rgb(source_path, width):
+    image = Image.open(source_path)
+    # For JPEG sources let the decoder downscale by 2/4/8 while decoding
+    image.draft('RGB', (width, max(1, image.height * width // image.width)))
+    return image.convert('RGB')
+
+# Build one ladder width in one format (lazy path, on a cache miss)
+def build_derivative(source_path, path, width, fmt):
+    with timed_stage('derivative_miss'):
+        image = _open_rgb(source_path, width)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        _save(image, path, fmt)
+
+# Build the whole ladder in every format, shrinking step by step from the previous size (eager path).
+# With a key the source is the stored artifact and the URLs name the key, so they never change meaning.
+def generate_derivatives(kind, source_path, key=None):
+    name = key or os.path.basename(source_path)
+    version = source_version(source_path, key)
+    image = _open_rgb(source_path, max(WIDTHS))
+    for width in sorted(WIDTHS, reverse=True):
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for fmt in FORMATS:
+            path = derivative_path(kind, name, version, width, fmt)
+            if not os.path.exists(path):
+                _save(image, path, fmt)
+    if key:
+        return artifact_derivative_urls(kind, key)
+    return {fmt: [derivative_url(kind, name, version, width, fmt) for width in WIDTHS] for fmt in FORMATS}
+
+# Derivatives for a processed upload (from its stripped original in artifact storage) and all of its mockups
+@timed_stage('derivatives')
+def generate_upload_derivatives(original_key, mockups):
+    generated = {'main': generate_derivatives('main', artifact_store.local_path(original_key), original_key), 'mockups': {}}
+    for mockup in mockups:
+        key = mockup.get('key')
+        if key and artifact_store.exists(key):
+            generated['mockups'][key] = generate_derivatives('mockup', artifact_store.local_path(key), key)
+    return generated
+
+# GET /images/<kind>/<key>/<width>.<fmt> (or /images/<kind>/<name>/<width>.<fmt>?v=<version> for older rows)
+def serve_derivative(kind, name, width, fmt):
+    folder = source_folders().get(kind)
+    if not folder or fmt not in FORMATS or width not in WIDTHS:
+        return jsonify({"error": "Unknown image variant"}), 404
+
+    name = secure_filename(name)
+    # Uploads and mockups live in content-addressed storage under their key; plain names are images of
+    # rows saved before that, read from the source folder
+    key = name if is_artifact_key(name) else None
+    if key:
+        if not artifact_store.exists(key):
+            return jsonify({"error": "Image not found"}), 404
+        source_path = artifact_store.local_path(key)
+    else:
+        source_path = os.path.join(folder, name)
+    if not os.path.exists(source_path):
+        return jsonify({"error": "Image not found"}), 404
+
+    version = source_version(source_path, key)
+    if not key and request.args.get('v') not in (None, version):
+        # An outdated URL: send the client to the current version instead of caching stale bytes forever
+        derivative_requests.inc(1, 'redirect')
+        return '', 302, {'Location': derivative_url(kind, name, version, width, fmt)}
+
+    path = derivative_path(kind, name, version, width, fmt)
+    if os.path.exists(path):
+        derivative_requests.inc(1, 'hit')
+        cache.touch(path)
+    else:
+        derivative_requests.inc(1, 'miss')
+        build_derivative(source_path, path, width, fmt)
+
+    # Validators come from the source, not the derivative file, whose mtime moves on every cache hit
+    response = send_file(os.path.abspath(path), mimetype=FORMATS[fmt][1], conditional=False, etag=False,
+                         last_modified=os.path.getmtime(source_path))
+    response.set_etag(f"{version}-{width}-{fmt}")
+    response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(path))
+    # A key always names the same bytes, a versioned name only until the file is replaced
+    if key or request.args.get('v'):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
@@ -1,12 +1,20 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import re
+from metrics import timed_stage, track_external
 
 # Load environment variables from .env file
 load_dotenv()
 
-client = OpenAI()
+_client = None
+
+# OpenAI client, created on first use (the SDK is slow to import and most workers never call it)
+def openai_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI()
+    return _client
 
 # Function to create a directory if it doesn't exist
 def create_directory(directory):
@@ -23,29 +31,32 @@ def get_keyword_from_filename(file_path):
 
 # Writing meta description
 def meta_description(keyword):
-    completion = client.chat.completions.create(
-    model="gpt-3.5-turbo",
-    messages=[
-        {"role": "system", "content": "You are a highly-skilled SEO marketer who is focused on amazing meta descriptions."},
-        {"role": "user", "content": f"Write a general meta description for a keyword '{keyword}' for a downloadable digital print. No longer than 150 characters."}
-    ]
-    )
+    with track_external('openai'):
+        completion = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a highly-skilled SEO marketer who is focused on amazing meta descriptions."},
+                {"role": "user", "content": f"Write a general meta description for a keyword '{keyword}' for a downloadable digital print. No longer than 150 characters."}
+            ]
+        )
 
     return(completion.choices[0].message.content)
 
 # Writing product description   
 def product_description(keyword):
-    completion = client.chat.completions.create(
-    model="gpt-3.5-turbo",
-    messages=[
-        {"role": "system", "content": "You are a highly-skilled SEO marketer who is focused on amazing SEO descriptions."},
-        {"role": "user", "content": f"Write a lengthy description for a keyword '{keyword}' for a downloadable digital print created by AI. It should be a minimum of 400 words. Do not overuse the keyword, but use it enough times. The print will have 300dpi with the shorter edge of maximum 20 inches. Do not mention dimensions otherwise as some prints might be square or rectangular and I'm using this description for all of them. Use human-like writing style and avoid detection by ChatGPT detectors."}
-    ]
-    )
+    with track_external('openai'):
+        completion = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a highly-skilled SEO marketer who is focused on amazing SEO descriptions."},
+                {"role": "user", "content": f"Write a lengthy description for a keyword '{keyword}' for a downloadable digital print created by AI. It should be a minimum of 400 words. Do not overuse the keyword, but use it enough times. The print will have 300dpi with the shorter edge of maximum 20 inches. Do not mention dimensions otherwise as some prints might be square or rectangular and I'm using this description for all of them. Use human-like writing style and avoid detection by ChatGPT detectors."}
+            ]
+        )
 
     return(completion.choices[0].message.content)
 
 # Combining everything
+@timed_stage('descriptions')
 def description_creation(file_name):
     keyword = get_keyword_from_filename(file_name)
     meta = meta_description(keyword)
@@ -58,13 +69,13 @@ def description_creation(file_name):
     # Create a file with the keyword as the filename
     filename = f"{descriptions_dir}/{keyword}.txt"
     
-    # Save meta and product descriptions to the file
-    with open(filename, 'w') as file:
+    # Save meta and product descriptions to the file (written aside and renamed, so a retry never sees half a file)
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, 'w') as file:
         file.write("Meta Description:\n")
         file.write(meta)
         file.write("\n\nProduct Description:\n")
         file.write(product)
+    os.replace(temp_filename, filename)
 
-# Example usage
-keyword = "abstract bird"
-description_creation(keyword)
\ No newline at end of file
+    return filename
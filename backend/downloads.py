@@ -0,0 +1,319 @@
+import hashlib
+import hmac
+import os
+import time
+from dotenv import load_dotenv
+from flask import request, jsonify, Response
+from flask_jwt_extended import get_jwt_identity
+from werkzeug.http import http_date, parse_date
+from artifact_storage import ARTIFACT_FOLDER, artifact_path
+from auth_tokens import jwt_cached_required
+from metrics import Counter
+from models import db, User, Order, OrderItem, ProductImage
+from zip_stream import StreamingZip, file_crc32
+
+# Load environment variables from .env file
+load_dotenv()
+
+# direct: the WSGI server streams the file (gunicorn uses os.sendfile through wsgi.file_wrapper)
+# x-accel: nginx serves DOWNLOAD_ACCEL_PREFIX + the path relative to ARTIFACT_FOLDER
+# x-sendfile: Apache/lighttpd serve the absolute path
+DOWNLOAD_DELIVERY = os.getenv('DOWNLOAD_DELIVERY', 'direct')
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-downloads/')
+DOWNLOAD_LINK_TTL = int(os.getenv('DOWNLOAD_LINK_TTL', 24 * 3600))
+BLOCK_SIZE = 1024 * 1024
+
+downloads_served = Counter('downloads_total', 'Print file download responses', ['status', 'delivery'])
+
+class SigningKeyMissing(RuntimeError):
+    pass
+
+# Links are never signed or accepted with an empty key, anyone could forge those
+def _signing_key():
+    key = os.getenv('DOWNLOAD_SIGNING_KEY') or os.getenv('JWT_SECRET_KEY')
+    if not key:
+        raise SigningKeyMissing("Set DOWNLOAD_SIGNING_KEY (or JWT_SECRET_KEY) to sign download links")
+    return key.encode()
+
+# HMAC-SHA256 over what the link grants: one scope (e.g. an order item) until an expiry time
+def sign(scope, expires):
+    return hmac.new(_signing_key(), f"{scope}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def verify_signature(scope, expires, signature):
+    if not expires or not signature:
+        return False
+    try:
+        expected = sign(scope, expires)
+    except SigningKeyMissing as e:
+        print(f"Refusing download link. Error: {str(e)}")
+        return False
+    try:
+        if int(expires) < time.time():
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected, signature)
+
+def signed_download_path(order_item_id, ttl=DOWNLOAD_LINK_TTL):
+    expires = int(time.time()) + ttl
+    return f"/download/{order_item_id}?expires={expires}&signature={sign(f'item:{order_item_id}', expires)}"
+
+def signed_bundle_path(order_id, ttl=DOWNLOAD_LINK_TTL):
+    expires = int(time.time()) + ttl
+    return f"/orders/{order_id}/bundle?expires={expires}&signature={sign(f'order:{order_id}', expires)}"
+
+# Parse a single "bytes=" range into (start, end) with end exclusive; None means send the whole file
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header, size):
+    if not header or not header.startswith('bytes=') or ',' in header:
+        # Multiple ranges are legal to ignore; the full body is a valid answer
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size)
+
+# Validators for a file on disk
+def file_etag(stat):
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+# 304 if the client's copy is current (If-None-Match wins over If-Modified-Since)
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+# Range to send, honouring If-Range (a stale If-Range means the whole file)
+def requested_range(etag, last_modified, size):
+    if_range = request.headers.get('If-Range')
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if if_range.strip('"') != etag:
+                return None
+        else:
+            date = parse_date(if_range)
+            if date is None or int(last_modified) > date.timestamp():
+                return None
+    return parse_range(request.headers.get('Range'), size)
+
+# Yields exactly `length` bytes from `offset`; used when the server has no wsgi.file_wrapper
+def _iter_file(file, offset, length):
+    try:
+        file.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
+
+# Serve a file with ranges and validators, handing the byte copy to the proxy or the kernel
+def file_response(path, download_name, mimetype='application/octet-stream', root=None):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return jsonify({"error": "File not found"}), 404
+
+    size = stat.st_size
+    etag = file_etag(stat)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+        'Cache-Control': 'private, max-age=0'
+    }
+
+    if not_modified(etag, stat.st_mtime):
+        downloads_served.inc(1, 304, DOWNLOAD_DELIVERY)
+        return Response(status=304, headers=headers)
+
+    # The front proxy handles Range itself on the internal redirect
+    if DOWNLOAD_DELIVERY == 'x-accel':
+        relative = os.path.relpath(path, root or ARTIFACT_FOLDER)
+        headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')
+        downloads_served.inc(1, 200, DOWNLOAD_DELIVERY)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+    if DOWNLOAD_DELIVERY == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        downloads_served.inc(1, 200, DOWNLOAD_DELIVERY)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    try:
+        byte_range = requested_range(etag, stat.st_mtime, size)
+    except RangeNotSatisfiable:
+        headers['Content-Range'] = f"bytes */{size}"
+        downloads_served.inc(1, 416, DOWNLOAD_DELIVERY)
+        return Response(status=416, headers=headers)
+
+    status = 200
+    start, end = 0, size
+    if byte_range:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+    headers['Content-Length'] = str(end - start)
+
+    file = open(path, 'rb')
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # A whole file can always go through the server's file wrapper; a range only when the server sends
+    # Content-Length bytes from the current offset, as gunicorn does with os.sendfile
+    if file_wrapper is not None and (status == 200 or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')):
+        file.seek(start)
+        body = file_wrapper(file, BLOCK_SIZE)
+    else:
+        body = _iter_file(file, start, end - start)
+
+    downloads_served.inc(1, status, DOWNLOAD_DELIVERY)
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+# Product image holding the print of an order item
+def order_item_print_image(order_item):
+    images = order_item.product_image or (order_item.product.images if order_item.product else [])
+    for image in images:
+        if image.print_file_key or image.print_file:
+            return image
+    return None
+
+# Print file of an order item: the resized output of the item's product image
+def order_item_print_file(order_item):
+    image = order_item_print_image(order_item)
+    return artifact_path(image.print_file_key or image.print_file) if image else None
+
+# Store the CRC-32 of prints saved without one; returns how many images were updated
+def backfill_print_crcs(batch_size=200):
+    updated = 0
+    last_id = 0
+    while True:
+        images = db.session.execute(
+            db.select(ProductImage)
+            .where(ProductImage.id > last_id, ProductImage.print_file_crc32.is_(None),
+                   (ProductImage.print_file_key.isnot(None)) | (ProductImage.print_file.isnot(None)))
+            .order_by(ProductImage.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not images:
+            return updated
+        for image in images:
+            last_id = image.id
+            path = artifact_path(image.print_file_key or image.print_file)
+            if not path or not os.path.exists(path):
+                continue
+            image.print_file_crc32 = file_crc32(path)
+            updated += 1
+        db.session.commit()
+
+# GET /download/<order_item_id>?expires=...&signature=... - no login needed, the link is the credential; the
+# order must still be paid when the link is used
+def download_order_item(order_item_id):
+    if not verify_signature(f"item:{order_item_id}", request.args.get('expires'), request.args.get('signature')):
+        downloads_served.inc(1, 403, DOWNLOAD_DELIVERY)
+        return jsonify({"error": "Download link is invalid or has expired"}), 403
+
+    order_item = db.session.get(OrderItem, order_item_id)
+    if order_item is not None and not (order_item.order and order_item.order.is_paid):
+        downloads_served.inc(1, 402, DOWNLOAD_DELIVERY)
+        return jsonify({"error": "Order has not been paid"}), 402
+    path = order_item_print_file(order_item) if order_item else None
+    if not path:
+        return jsonify({"error": "File not found"}), 404
+
+    # Release the pooled connection before the (possibly long) transfer starts
+    db.session.remove()
+
+    return file_response(path, os.path.basename(path), mimetype='image/png')
+
+# GET /orders/<order_id>/bundle?expires=...&signature=... - every print of the order in one streamed ZIP
+def download_order_bundle(order_id):
+    if not verify_signature(f"order:{order_id}", request.args.get('expires'), request.args.get('signature')):
+        downloads_served.inc(1, 403, 'bundle')
+        return jsonify({"error": "Download link is invalid or has expired"}), 403
+
+    order = db.session.get(Order, order_id)
+    if not order:
+        return jsonify({"error": "Order not found"}), 404
+    if not order.is_paid:
+        downloads_served.inc(1, 402, 'bundle')
+        return jsonify({"error": "Order has not been paid"}), 402
+
+    # Entry names and order are fixed per order, which keeps the archive layout (and resumed ranges) stable.
+    # The stored CRCs let a resumed range skip the earlier prints without reading them.
+    entries = []
+    for item in sorted(order.items, key=lambda item: item.id):
+        image = order_item_print_image(item)
+        path = artifact_path(image.print_file_key or image.print_file) if image else None
+        if path and os.path.exists(path):
+            entries.append((f"{order.id}-{item.id}-{os.path.basename(path)}", path, image.print_file_crc32))
+    db.session.remove()
+
+    if not entries:
+        return jsonify({"error": "No files to download"}), 404
+
+    archive = StreamingZip(entries)
+    headers = {
+        'ETag': f'"{archive.etag}"',
+        'Last-Modified': http_date(archive.last_modified),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="lemouniq-order-{order_id}.zip"',
+        'Cache-Control': 'private, max-age=0'
+    }
+
+    if not_modified(archive.etag, archive.last_modified):
+        downloads_served.inc(1, 304, 'bundle')
+        return Response(status=304, headers=headers)
+
+    try:
+        byte_range = requested_range(archive.etag, archive.last_modified, archive.size)
+    except RangeNotSatisfiable:
+        headers['Content-Range'] = f"bytes */{archive.size}"
+        downloads_served.inc(1, 416, 'bundle')
+        return Response(status=416, headers=headers)
+
+    status = 200
+    start, end = 0, archive.size
+    if byte_range:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{end - 1}/{archive.size}"
+    headers['Content-Length'] = str(end - start)
+
+    downloads_served.inc(1, status, 'bundle')
+    return Response(archive.iter_bytes(start, end), status=status, headers=headers,
+                    mimetype='application/zip', direct_passthrough=True)
+
+# GET /orders/<order_id>/download_links - fresh signed links for the owner of the order
+@jwt_cached_required()
+def order_download_links(order_id):
+    order = db.session.get(Order, order_id)
+    if not order:
+        return jsonify({"error": "Order not found"}), 404
+
+    user = db.session.get(User, order.user_id) if order.user_id else None
+    if not user or user.email != get_jwt_identity():
+        return jsonify({"error": "Order not found"}), 404
+    if not order.is_paid:
+        return jsonify({"error": "Order has not been paid"}), 402
+
+    return jsonify({
+        "order_id": order.id,
+        "expires_in": DOWNLOAD_LINK_TTL,
+        "bundle_link": signed_bundle_path(order.id),
+        "items": [{"order_item_id": item.id, "download_link": signed_download_path(item.id)} for item in order.items]
+    }), 200
@@ -0,0 +1,100 @@
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from artifact_storage import artifact_path
+from create_mockups import orientation_for_size
+from models import db, ProductImage
+
+# Number of colors in the extracted palette and the side of the thumbnail k-means runs on
+PALETTE_SIZE = 5
+SAMPLE_SIDE = 64
+
+COLOR_FAMILIES = ['red', 'orange', 'yellow', 'green', 'cyan', 'blue', 'purple', 'pink',
+                  'black', 'white', 'gray']
+
+# Upper OpenCV hue bound (0-180) of each chromatic family; hues past the last bound wrap to red
+HUE_FAMILIES = [(10, 'red'), (22, 'orange'), (34, 'yellow'), (78, 'green'), (100, 'cyan'),
+                (130, 'blue'), (150, 'purple'), (170, 'pink'), (180, 'red')]
+
+def _hex(bgr):
+    blue, green, red = (int(round(channel)) for channel in bgr)
+    return f"#{red:02x}{green:02x}{blue:02x}"
+
+# Coarse, filterable name of a BGR color
+def color_family(bgr):
+    hue, saturation, value = cv2.cvtColor(np.uint8([[bgr]]), cv2.COLOR_BGR2HSV)[0][0]
+    if value < 50:
+        return 'black'
+    if saturation < 40:
+        return 'white' if value > 200 else 'gray'
+    for bound, family in HUE_FAMILIES:
+        if hue < bound:
+            return family
+    return 'red'
+
+# Dominant colors by k-means over a small copy of the image, most common first
+def dominant_palette(image, size=PALETTE_SIZE):
+    small = cv2.resize(image, (SAMPLE_SIDE, SAMPLE_SIDE), interpolation=cv2.INTER_AREA)
+    pixels = np.float32(small.reshape(-1, 3))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    cv2.setRNGSeed(0)  # Same image, same palette
+    _, labels, centers = cv2.kmeans(pixels, size, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+    counts = np.bincount(labels.flatten(), minlength=size)
+    return [
+        {'color': _hex(centers[index]), 'family': color_family(centers[index]),
+         'share': round(float(counts[index]) / len(pixels), 3)}
+        for index in np.argsort(-counts) if counts[index]
+    ]
+
+# Orientation, aspect ratio and palette of an image file; stored on ProductImage for catalog filtering
+def extract_facets(file_path):
+    with Image.open(file_path) as img:
+        width, height = img.size
+
+    # 1/8 scale decode: k-means only ever sees a 64x64 thumbnail
+    image = cv2.imread(file_path, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        raise ValueError(f"Could not read image {file_path}")
+
+    palette = dominant_palette(image)
+    # Several shades of one family (e.g. three blues of a seascape) add up against a single background color
+    family_shares = {}
+    for entry in palette:
+        family_shares[entry['family']] = family_shares.get(entry['family'], 0) + entry['share']
+    return {
+        'orientation': orientation_for_size(width, height),
+        'aspect_ratio': round(width / height, 4),
+        'dominant_color': palette[0]['color'],
+        'color_family': max(family_shares, key=family_shares.get),
+        'palette': palette
+    }
+
+# Extract the facets of product images saved without them (rows from before facets were stored, images added
+# by hand) from their original or print file; returns how many rows were updated
+def backfill_image_facets(batch_size=200):
+    updated = 0
+    last_id = 0
+    while True:
+        images = db.session.execute(
+            db.select(ProductImage)
+            .where(ProductImage.id > last_id, ProductImage.orientation.is_(None))
+            .order_by(ProductImage.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not images:
+            return updated
+        for image in images:
+            last_id = image.id
+            path = artifact_path(image.original_key or image.print_file_key or image.print_file)
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                facets = extract_facets(path)
+            except (OSError, ValueError) as e:
+                print(f"Skipping product image {image.id}. Error: {str(e)}")
+                continue
+            for column, value in facets.items():
+                setattr(image, column, value)
+            updated += 1
+        db.session.commit()
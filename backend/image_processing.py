@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import request, jsonify
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from PIL import Image
-import cryptography
-import cv2
-import numpy as np
 import os
-from create_mockups import mockup_generator
+import tempfile
+import time
+import uuid
+from create_mockups import MOCKUP_PRODUCTS, generate_product_mockups, upload_image_to_imgbb
 from description_creation import description_creation
+from metrics import timed_stage, count_bytes, upload_jobs_in_flight
+from pipeline_checkpoints import Checkpoint, file_sha256, incomplete_checkpoints
+from derivatives import generate_upload_derivatives
+from artifact_storage import artifact_store, artifact_path, is_artifact_key
+from facets import extract_facets
+from perceptual_hash import PHASH_DUPLICATE_ACTION, image_hashes, near_duplicates_found, phash_index, reuse_artifacts, to_signed
+from profiling import profile_job, profile_link, profile_requested
+from models import db, Product, ProductImage, add_product_mockups
+from zip_stream import file_crc32
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,45 +25,261 @@ UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_uploaded_files(files):
+# Stages every file has to complete; finished stages are checkpointed and skipped on resume
+PIPELINE_STAGES = ['stripped', 'phash', 'facets', 'resized'] + [f"mockups_{product}" for product in MOCKUP_PRODUCTS] + ['descriptions', 'derivatives', 'saved']
+
+# imgbb links are uploaded with a 600 second expiration, reuse them only while Printful can still fetch them
+IMGBB_URL_MAX_AGE = 500
+
+# Width of the storefront derivative used as ProductImage.main_image
+MAIN_IMAGE_WIDTH = 960
+
+def process_uploaded_files(files, profile=False, product_id=None):
     print("Starting the process")
-    processed_data = []
-    total_files = len(files)
-    for idx, file in enumerate(files):
+    upload_jobs_in_flight.inc()
+    try:
+        return _process_uploaded_files(files, profile, product_id)
+    finally:
+        upload_jobs_in_flight.dec()
+
+def _process_uploaded_files(files, profile=False, product_id=None):
+    file_paths = []
+    for file in files:
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Run through functions
-            processed_file_path = metadata_strip(file_path)
-            resize_image(file_path)
-            mockup_generator(file_path)
-            description_creation(file_path)
-
-            # Perform image processing here and calculate processing percentage
-            processing_percentage = (idx + 1) * 100 / total_files
-
-            if processed_file_path:
-                processing_percentage = (idx + 1) * 100 / total_files
-                # Store processed data for each file including the processing percentage
-                processed_data.append({
-                    'filename': filename,
-                    'file_path': processed_file_path,
-                    'processing_percentage': processing_percentage
-                })
-            else:
-                # Handle the case where processing fails
-                return jsonify({'error': 'Failed to process one or more files'})
+            fd, temp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.upload')
+            os.close(fd)
+            try:
+                with timed_stage('save_upload'):
+                    file.save(temp_path)
+                count_bytes('save_upload', os.path.getsize(temp_path))
+                file_paths.append(store_upload(temp_path, secure_filename(file.filename), product_id))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    return process_file_paths(file_paths, profile)
+
+# Move a received file into the upload folder under the SHA-256 of its content, which is also the id of its
+# checkpoint: uploads that share a file name never touch each other's working file, checkpoint or results.
+# Returns the path of the working file.
+def store_upload(temp_path, filename, product_id=None):
+    upload_id = file_sha256(temp_path) + os.path.splitext(filename)[1].lower()
+    file_path = os.path.join(UPLOAD_FOLDER, upload_id)
+    os.replace(temp_path, file_path)
+    prepare_checkpoint(file_path, filename, product_id)
+    return file_path
 
+# Run the pipeline over files already in the upload folder and report progress per file; with profile=True
+# every file gets a stage profile report
+def process_file_paths(file_paths, profile=False):
+    processed_data = []
+    total_files = len(file_paths)
+    for idx, file_path in enumerate(file_paths):
+        profiler = None
+        try:
+            with profile_job(os.path.basename(file_path), profile) as profiler:
+                result = run_pipeline(file_path)
+        finally:
+            if profiler is not None and profiler.report_key:
+                keep_profile(file_path, profiler.report_key)
+        if profiler is not None:
+            result['profile'] = profile_link(profiler.report_key)
+        result['processing_percentage'] = (idx + 1) * 100 / total_files
+        processed_data.append(result)
     return processed_data
 
+# A re-uploaded original finds the checkpoint of the identical earlier upload (both are named by the content
+# hash) and keeps its finished stages. filename is the name it was uploaded as, used for the product title and
+# the descriptions; product_id is the product the upload belongs to (a draft product is created when there is none).
+def prepare_checkpoint(file_path, filename, product_id=None):
+    checkpoint = Checkpoint.load(os.path.basename(file_path))
+    checkpoint.data['upload_name'] = filename
+    if product_id is not None and checkpoint.data.get('product_id') != product_id:
+        # Same artwork for another product: it needs rows of its own
+        checkpoint.data['product_id'] = product_id
+        checkpoint.data['stages'].pop('saved', None)
+    # A new working file is only there when stripping has to run (again); it is consumed by that stage
+    checkpoint.data['stages'].pop('stripped', None)
+    checkpoint.save()
+
+# Profile reports are referenced from the file's checkpoint, which keeps them from artifact garbage collection
+def keep_profile(file_path, key):
+    checkpoint = Checkpoint.load(os.path.basename(file_path))
+    checkpoint.data.setdefault('profiles', []).append(key)
+    checkpoint.save()
+
+# imgbb URL for the mockup stages, reused from the checkpoint while it has not expired
+def checkpointed_imgbb_url(checkpoint, file_path):
+    uploaded = checkpoint.get('imgbb')
+    if uploaded and time.time() - uploaded['completed_at'] < IMGBB_URL_MAX_AGE:
+        return uploaded['result']
+    url = upload_image_to_imgbb(file_path)
+    if url:
+        checkpoint.complete('imgbb', url)
+    return url
+
+# Run only the stages of a file that have not completed yet
+def run_pipeline(file_path):
+    upload_id = os.path.basename(file_path)
+    checkpoint = Checkpoint.load(upload_id)
+    filename = checkpoint.data.get('upload_name', upload_id)
+    result = {'upload_id': upload_id, 'filename': filename}
+
+    def failed(stage):
+        print(f"Pipeline for {filename} ({upload_id}) stopped at stage '{stage}'. Resume to retry from there.")
+        result.update({'status': 'failed', 'failed_stage': stage})
+        return result
+
+    if not checkpoint.is_done('stripped'):
+        if not os.path.exists(file_path):
+            return failed('upload')
+        if not metadata_strip(file_path):
+            return failed('stripped')
+        # The working file moves into content-addressed storage, nothing is left behind in the upload folder
+        checkpoint.complete('stripped', {'key': artifact_store.put_file(file_path, move=True)})
+    # Every later stage reads the stored original
+    original_key = checkpoint.get('stripped')['result']['key']
+    source_path = artifact_store.local_path(original_key)
+
+    if not checkpoint.is_done('phash'):
+        try:
+            with timed_stage('phash'):
+                hashes = image_hashes(source_path)
+                matches = phash_index.near_duplicates(hashes['phash'], hashes['dhash'], exclude=('upload', upload_id))
+        except Exception as e:
+            print(f"Error hashing image: {e}")
+            return failed('phash')
+        checkpoint.complete('phash', dict(hashes, near_duplicates=matches))
+        phash_index.add(('upload', upload_id), hashes['phash'], hashes['dhash'])
+
+        # Variations of an artwork already processed can take over the mockups and descriptions of the closest one
+        if matches and PHASH_DUPLICATE_ACTION == 'reuse':
+            stages = [f"mockups_{product}" for product in MOCKUP_PRODUCTS] + ['descriptions']
+            reused = reuse_artifacts(checkpoint, matches[0], stages)
+            near_duplicates_found.inc(1, 'reused' if reused else 'flagged')
+        elif matches:
+            near_duplicates_found.inc(1, 'flagged')
+    result['near_duplicates'] = checkpoint.get('phash')['result']['near_duplicates']
+
+    # Orientation, aspect ratio and palette, stored on the product image so the catalog can filter on them
+    if not checkpoint.is_done('facets'):
+        try:
+            with timed_stage('facets'):
+                facets = extract_facets(source_path)
+        except Exception as e:
+            print(f"Error extracting facets: {e}")
+            return failed('facets')
+        checkpoint.complete('facets', facets)
+    result['facets'] = checkpoint.get('facets')['result']
+
+    if not checkpoint.is_done('resized'):
+        resized_key = resize_image(source_path)
+        if not resized_key:
+            return failed('resized')
+        checkpoint.complete('resized', resized_key)
+
+    with timed_stage('mockups'):
+        for product in MOCKUP_PRODUCTS:
+            stage = f"mockups_{product}"
+            if checkpoint.is_done(stage):
+                continue
+            uploaded_image_url = checkpointed_imgbb_url(checkpoint, source_path)
+            if not uploaded_image_url:
+                return failed(stage)
+            mockups = generate_product_mockups(source_path, uploaded_image_url, product)
+            if not mockups:
+                return failed(stage)
+            checkpoint.complete(stage, mockups)
+
+    if not checkpoint.is_done('descriptions'):
+        try:
+            # The keyword comes from the name the file was uploaded as
+            description_key = artifact_store.put_file(description_creation(filename), move=True)
+        except Exception as e:
+            print(f"Error creating descriptions: {e}")
+            return failed('descriptions')
+        checkpoint.complete('descriptions', description_key)
+
+    mockups = [mockup for product in MOCKUP_PRODUCTS for mockup in checkpoint.get(f"mockups_{product}")['result']]
+
+    # Storefront sizes of the image and its mockups, so the first page view does not have to build them
+    if not checkpoint.is_done('derivatives'):
+        try:
+            derivatives = generate_upload_derivatives(original_key, mockups)
+        except Exception as e:
+            print(f"Error creating derivatives: {e}")
+            return failed('derivatives')
+        checkpoint.complete('derivatives', derivatives)
+
+    # The product image and its mockups become visible in the catalog and purchasable
+    if not checkpoint.is_done('saved'):
+        try:
+            saved = save_product_image(checkpoint, mockups)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving the product image: {e}")
+            return failed('saved')
+        checkpoint.complete('saved', saved)
+        # From now on the image is found through its product image row
+        phash_index.remove(('upload', upload_id))
+
+    # Checkpoints written before artifacts were content-addressed hold plain paths instead of keys
+    stored = {stage: checkpoint.get(stage)['result'] for stage in ('resized', 'descriptions')}
+    result.update({
+        'status': 'completed',
+        'original_key': original_key,
+        'resized_key': stored['resized'] if is_artifact_key(stored['resized']) else None,
+        'resized_path': artifact_path(stored['resized']),
+        'mockups': mockups,
+        'description_key': stored['descriptions'] if is_artifact_key(stored['descriptions']) else None,
+        'description_file': artifact_path(stored['descriptions']),
+        'derivatives': checkpoint.get('derivatives')['result'],
+        **checkpoint.get('saved')['result']
+    })
+    return result
+
+# Write the ProductImage row of a finished upload and its ProductMockup rows in one transaction
+@timed_stage('save_rows')
+def save_product_image(checkpoint, mockups):
+    product_id = checkpoint.data.get('product_id')
+    if product_id is None:
+        product = Product(title=os.path.splitext(checkpoint.data.get('upload_name', checkpoint.filename))[0], status='draft')
+        db.session.add(product)
+        db.session.flush()
+        product_id = product.id
+    elif db.session.get(Product, product_id) is None:
+        raise ValueError(f"Product {product_id} does not exist")
+
+    hashes = checkpoint.get('phash')['result']
+    facets = checkpoint.get('facets')['result']
+    resized = checkpoint.get('resized')['result']
+    descriptions = checkpoint.get('descriptions')['result']
+    main_urls = checkpoint.get('derivatives')['result']['main']['jpg']
+    image = ProductImage(
+        product_id=product_id,
+        main_image=next((url for url in main_urls if f"/{MAIN_IMAGE_WIDTH}." in url), main_urls[-1]),
+        print_file=None if is_artifact_key(resized) else resized,
+        print_file_key=resized if is_artifact_key(resized) else None,
+        print_file_crc32=file_crc32(artifact_path(resized)),
+        description_key=descriptions if is_artifact_key(descriptions) else None,
+        original_key=checkpoint.get('stripped')['result']['key'],
+        phash=to_signed(hashes['phash']),
+        dhash=to_signed(hashes['dhash']),
+        orientation=facets['orientation'],
+        aspect_ratio=facets['aspect_ratio'],
+        dominant_color=facets['dominant_color'],
+        color_family=facets['color_family'],
+        palette=facets['palette']
+    )
+    db.session.add(image)
+    db.session.flush()
+    add_product_mockups(image.id, mockups)
+    db.session.commit()
+    return {'product_id': product_id, 'product_image_id': image.id}
+
 # Function to upload and process the image files
 def upload_file():
     if 'image' not in request.files:
@@ -68,36 +293,75 @@ def upload_file():
     if not allowed_files:
         return jsonify({'error': 'No valid files uploaded'})
 
-    processed_data = process_uploaded_files(allowed_files)
+    # Optional: the product the images belong to (otherwise each one gets a new draft product)
+    product_id = request.form.get('product_id', type=int)
+    if product_id is not None and db.session.get(Product, product_id) is None:
+        return jsonify({'error': 'Product not found'}), 404
+
+    processed_data = process_uploaded_files(allowed_files, profile=profile_requested(), product_id=product_id)
     
     # Return processed data as JSON response
     return jsonify({'processed_data': processed_data})
 
-# This function rewrites metadata
+# Resume files whose pipeline stopped part way, running only their missing stages
+def resume_uploads():
+    data = request.get_json(silent=True) or {}
+
+    # upload_id of each result of /upload (or of /uploads/<id>/finalize); all unfinished uploads when none are given
+    if 'upload_ids' in data:
+        upload_ids = [secure_filename(upload_id) for upload_id in data['upload_ids']]
+    else:
+        upload_ids = [checkpoint.filename for checkpoint in incomplete_checkpoints(PIPELINE_STAGES)]
+
+    if not upload_ids:
+        return jsonify({'processed_data': []})
+
+    upload_jobs_in_flight.inc()
+    try:
+        processed_data = process_file_paths([os.path.join(UPLOAD_FOLDER, upload_id) for upload_id in upload_ids],
+                                            profile=profile_requested())
+    finally:
+        upload_jobs_in_flight.dec()
+
+    return jsonify({'processed_data': processed_data})
+
+# This function rewrites metadata. The clean image is written next to the upload, fsynced and renamed over it,
+# so a crash or a failed save never leaves a truncated original behind.
+@timed_stage('metadata_strip')
 def metadata_strip(file_path):
+    temp_path = f"{file_path}.tmp"
     try:
         # Open the image
-        image = Image.open(file_path)
+        with Image.open(file_path) as image:
+            image_format = image.format
 
-        # Strip all metadata from the image
-        image_without_metadata = Image.new(image.mode, image.size)
-        image_without_metadata.putdata(list(image.getdata()))
+            # Strip all metadata from the image
+            image_without_metadata = Image.new(image.mode, image.size)
+            image_without_metadata.putdata(list(image.getdata()))
 
         # Add custom metadata
         image_without_metadata.info['Author'] = 'Lemouniq'
         image_without_metadata.info['Website'] = 'https://lemouniq.com'
         image_without_metadata.info['Email'] = 'info@lemouniq.com'
 
-        # Save the processed image, overwriting the existing image
-        image_without_metadata.save(file_path)
+        # Save the processed image to the temporary file, then replace the upload with it
+        with open(temp_path, 'wb') as f:
+            image_without_metadata.save(f, format=image_format)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+        count_bytes('metadata_strip', os.path.getsize(file_path))
 
         return file_path  # Return the path to the processed image (same as input path)
 
     except Exception as e:
         print(f"Error processing image: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         return None
 
 # This function resizes the file
+@timed_stage('resize')
 def resize_image(input_image_path):
     try:
         # Open the original image
@@ -124,19 +388,17 @@ def resize_image(input_image_path):
         resized_file_ending = os.getenv('RESIZED_FILE_ENDING')
         new_filename = f"{original_filename}{resized_file_ending}"
 
-        # Define the output path in the "resized" folder
+        # Define the staging path in the "resized" folder (unique, so two uploads with one name never clash)
         output_folder = os.getenv('OUTPUT_FOLDER')
         os.makedirs(output_folder, exist_ok=True)
-        output_path = os.path.join(output_folder, new_filename)
+        output_path = os.path.join(output_folder, f"{uuid.uuid4().hex}-{new_filename}")
 
-        # Save the processed image as PNG in the "resized" folder
+        # Save the processed image as PNG, then move it into content-addressed storage
         resized_image.save(output_path, format='PNG', dpi=(300, 300))
+        count_bytes('resize', os.path.getsize(output_path))
 
-        return output_path  # Return the path to the processed image
+        return artifact_store.put_file(output_path, extension='.png', move=True)  # Return the key of the processed image
 
     except Exception as e:
         print(f"Error resizing image: {e}")
         return None
-        
-if __name__ == '__main__':
-    app.run(debug=True, ssl_context='adhoc')
@@ -0,0 +1,232 @@
+import bisect
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from dotenv import load_dotenv
+from flask import request, g, jsonify, Response
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Scrapers send "Authorization: Bearer <METRICS_TOKEN>"; without a token the operational endpoints are disabled
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Default latency buckets in seconds (from fast PIL operations up to Printful polling)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Every metric registers itself here and is rendered by /metrics
+REGISTRY = []
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+# Monotonic counter, optionally split by labels
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+# Value that goes up and down (in-flight jobs, pool usage)
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+# Cumulative histogram with fixed buckets
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Per-bucket counts (last slot is +Inf), then the sum
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        for label_values, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, ('le', bound))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {counts[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}"
+
+# Pipeline metrics
+stage_seconds = Histogram('pipeline_stage_seconds', 'Time spent in each upload pipeline stage', ['stage'])
+stage_in_flight = Gauge('pipeline_stage_in_flight', 'Pipeline stages currently running', ['stage'])
+stage_errors = Counter('pipeline_stage_errors_total', 'Pipeline stages that raised an exception', ['stage'])
+bytes_processed = Counter('pipeline_bytes_processed_total', 'Bytes read or written by pipeline stages', ['stage'])
+upload_jobs_in_flight = Gauge('upload_jobs_in_flight', 'Upload batches currently being processed')
+
+# External services (imgbb, Printful, OpenAI, SMTP)
+external_calls = Counter('external_calls_total', 'Calls made to external services', ['service', 'outcome'])
+external_call_seconds = Histogram('external_call_seconds', 'Latency of calls to external services', ['service'])
+
+# HTTP routes
+http_requests = Counter('http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'])
+http_request_seconds = Histogram('http_request_seconds', 'HTTP request latency', ['endpoint', 'method'])
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests currently being handled')
+collector_errors = Counter('metrics_collector_errors_total', 'Scrape-time collectors that raised', ['collector'])
+
+# Optional callbacks receiving (stage, seconds) for every finished stage, e.g. the benchmark harness
+stage_observers = []
+# Optional callbacks receiving the stage name when a stage starts, e.g. the profiler
+stage_start_observers = []
+
+# Time a pipeline stage; usable as a decorator or a context manager
+class timed_stage:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        stage_in_flight.inc(1, self.stage)
+        for observer in stage_start_observers:
+            observer(self.stage)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        stage_seconds.observe(elapsed, self.stage)
+        for observer in stage_observers:
+            observer(self.stage, elapsed)
+        stage_in_flight.dec(1, self.stage)
+        if exc_type is not None:
+            stage_errors.inc(1, self.stage)
+        return False
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            with timed_stage(self.stage):
+                return fn(*args, **kwargs)
+        return decorator
+
+# Time a call to an external service; mark the outcome with call.fail() when the response is an error
+class _ExternalCall:
+    def __init__(self):
+        self.outcome = 'ok'
+
+    def fail(self):
+        self.outcome = 'error'
+
+@contextmanager
+def track_external(service):
+    call = _ExternalCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.fail()
+        raise
+    finally:
+        external_call_seconds.observe(time.perf_counter() - start, service)
+        external_calls.inc(1, service, call.outcome)
+
+def count_bytes(stage, amount):
+    bytes_processed.inc(amount, stage)
+
+# Prometheus text exposition format
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+def metrics_authorized():
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[7:] if auth_header.startswith('Bearer ') else ''
+    return bool(METRICS_TOKEN and token and hmac.compare_digest(token, METRICS_TOKEN))
+
+# Operational endpoints (/metrics, pool statistics) answer 404 to anyone without the metrics token
+def metrics_token_required(fn):
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        if not metrics_authorized():
+            return jsonify({"error": "Not found"}), 404
+        return fn(*args, **kwargs)
+    return decorator
+
+# Time every Flask route and expose /metrics
+def init_metrics(app, collectors=()):
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        http_requests_in_flight.inc()
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        http_requests_in_flight.dec()
+        endpoint = request.endpoint or 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - start, endpoint, request.method)
+
+    @app.after_request
+    def _count_request(response):
+        http_requests.inc(1, request.endpoint or 'unmatched', request.method, response.status_code)
+        return response
+
+    @app.route('/metrics')
+    @metrics_token_required
+    def metrics():
+        # Collectors refresh gauges that are cheaper to read at scrape time (e.g. the DB pool); one that fails
+        # is counted and its gauges keep their last values, the rest of the scrape still goes out
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                collector_errors.inc(1, collect.__name__)
+                print(f"Metrics collector {collect.__name__} failed. Error: {str(e)}")
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
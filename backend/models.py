@@ -1,36 +1,17 @@
 from sqlalchemy import create_engine, TIMESTAMP, Column, Integer, String, Boolean, Float, Text, ForeignKey
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from urllib.parse import quote_plus
-from flask import Flask
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Create a Flask web application instance
-app = Flask(__name__)
-
-# Database configuration - Retrieve values from environment variables
-db_name = os.getenv('DB_NAME')
-username = os.getenv('DB_USERNAME')
-password = quote_plus(os.getenv('DB_PASSWORD'))  # Encode the password with special characters
-host = os.getenv('DB_HOST')
-port = os.getenv('DB_PORT')
-
-# Construct the database URL using the retrieved configuration values
-db_url = f"postgresql://{username}:{password}@{host}:{port}/{db_name}"
-
-# Configure the Flask app with the database URL and disable modification tracking
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+from datetime import datetime
+from response_cache import mark_products_touched
+from derivatives import artifact_derivative_urls
 
+# Shared extension instances, bound to the app in app.create_app()
 db = SQLAlchemy()
 
 # Creating Flask-Migrate instance
-migrate = Migrate(app, db)
+migrate = Migrate()
 
 # User table with information about the user
 class User(db.Model):
@@ -89,21 +70,28 @@ class Category(db.Model):
 # Product information
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Keyset pagination of the catalog walks this index
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+    )
+
+    # Only active products are in the storefront and can be bought; uploads without a product create drafts
+    PUBLISHED_STATUS = 'active'
 
     id = db.Column(db.Integer, primary_key=True)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     title = db.Column(db.String(255))
-    status = db.Column(db.String(255))
+    status = db.Column(db.String(255))  # active, draft
     description = db.Column(db.Text)
     meta_description = db.Column(db.String(160))
     focus_keyword = db.Column(db.String(160))
-    sale_price = db.Column(db.Float)
-    price = db.Column(db.Float)
-    created_at = db.Column(db.TIMESTAMP)
-    updated_at = db.Column(db.TIMESTAMP)
+    sale_price = db.Column(db.Numeric(10, 2))  # Exact money; totals are computed in SQL
+    price = db.Column(db.Numeric(10, 2))
+    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)  # Drives catalog ETags
 
     category = db.relationship("Category", back_populates="products")
-    images = db.relationship("ProductImage", back_populates="product")
+    images = db.relationship("ProductImage", back_populates="product", order_by="ProductImage.id")
     order_items = db.relationship("OrderItem", back_populates="product")
     cart = db.relationship("Cart", back_populates="product")
 
@@ -116,59 +104,139 @@ class Product(db.Model):
             'description': self.description,
             'meta_description': self.meta_description,
             'focus_keyword': self.focus_keyword,
-            'sale_price': self.sale_price,
-            'price': self.price,
+            'sale_price': float(self.sale_price) if self.sale_price is not None else None,
+            'price': float(self.price) if self.price is not None else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+# Weighted full-text document of a product, generated and indexed by Postgres itself. It is not mapped on
+# the model (other databases have no tsvector); catalog.search_products queries it as products.search_vector.
+SEARCH_VECTOR_DDL = [
+    """ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(focus_keyword, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(meta_description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)"
+]
+
+for statement in SEARCH_VECTOR_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+# Add the search column and index to an existing database (flask create-search-index)
+def create_search_index():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    with db.engine.begin() as connection:
+        for statement in SEARCH_VECTOR_DDL:
+            connection.execute(DDL(statement))
+    return True
+
 # Product images
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
+    __table_args__ = (
+        # Facet filters and counts are answered from these indexes without touching the table
+        db.Index('ix_product_images_facets', 'orientation', 'color_family', 'product_id'),
+        db.Index('ix_product_images_color_family', 'color_family', 'product_id'),
+        db.Index('ix_product_images_aspect_ratio', 'aspect_ratio', 'product_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), index=True)
     main_image = db.Column(db.Text)
-    mockup_01 = db.Column(db.Text)
-    mockup_02 = db.Column(db.Text)
-    mockup_03 = db.Column(db.Text)
-    mockup_04 = db.Column(db.Text)
-    mockup_05 = db.Column(db.Text)
-    mockup_06 = db.Column(db.Text)
-    mockup_07 = db.Column(db.Text)
-    mockup_08 = db.Column(db.Text)
-    mockup_09 = db.Column(db.Text)
-    mockup_10 = db.Column(db.Text)
-    mockup_11 = db.Column(db.Text)
-    mockup_12 = db.Column(db.Text)
-    mockup_13 = db.Column(db.Text)
-    mockup_14 = db.Column(db.Text)
+    print_file = db.Column(db.Text)  # Resized print sold to customers (never serialized, delivered through signed links)
+    # Content-addressed artifacts (artifact_storage.py); rows referencing a key keep it from garbage collection
+    original_key = db.Column(db.String(80))
+    print_file_key = db.Column(db.String(80))
+    description_key = db.Column(db.String(80))  # Generated title and descriptions (JSON), reused by near-duplicate uploads
+    print_file_crc32 = db.Column(db.BigInteger)  # CRC-32 of the print, so ZIP bundles can resume without re-reading it
+    phash = db.Column(db.BigInteger)  # 64-bit perceptual hashes (signed), indexed in memory by perceptual_hash.py
+    dhash = db.Column(db.BigInteger)
+    # Facets extracted by the upload pipeline (facets.extract_facets)
+    orientation = db.Column(db.String(16))  # square, vertical, horizontal
+    aspect_ratio = db.Column(db.Float)  # width / height
+    dominant_color = db.Column(db.String(7))  # #rrggbb
+    color_family = db.Column(db.String(16))  # red, blue, white, ...
+    palette = db.Column(db.JSON)
 
     order_item_id = db.Column(db.Integer, db.ForeignKey('order_items.id'))
     
     product = db.relationship("Product", back_populates="images")
     order_item = db.relationship("OrderItem", back_populates="product_image")
+    # All mockups of the loaded images are fetched together in one extra SELECT ... IN query
+    mockups = db.relationship("ProductMockup", back_populates="product_image", lazy="selectin",
+                              order_by="ProductMockup.id", cascade="all, delete-orphan")
 
     def serialize(self):
         return {
             'id': self.id,
             'product_id': self.product_id,
             'main_image': self.main_image,
-            'mockup_01': self.mockup_01,
-            'mockup_02': self.mockup_02,
-            'mockup_03': self.mockup_03,
-            'mockup_04': self.mockup_04,
-            'mockup_05': self.mockup_05,
-            'mockup_06': self.mockup_06,
-            'mockup_07': self.mockup_07,
-            'mockup_08': self.mockup_08,
-            'mockup_09': self.mockup_09,
-            'mockup_10': self.mockup_10,
-            'mockup_11': self.mockup_11,
-            'mockup_12': self.mockup_12,
-            'mockup_13': self.mockup_13,
-            'mockup_14': self.mockup_14
+            'orientation': self.orientation,
+            'aspect_ratio': self.aspect_ratio,
+            'dominant_color': self.dominant_color,
+            'color_family': self.color_family,
+            'palette': self.palette,
+            'mockups': [mockup.serialize() for mockup in self.mockups]
+        }
+
+# Mockups generated for a product image (one row per Printful mockup)
+class ProductMockup(db.Model):
+    __tablename__ = 'product_mockups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_image_id = db.Column(db.Integer, db.ForeignKey('product_images.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(32))  # canvas, poster
+    option_group = db.Column(db.String(255))
+    path = db.Column(db.Text)  # Local file of the artifact when it was stored (internal, never serialized)
+    artifact_key = db.Column(db.String(80))
+    url = db.Column(db.Text)  # Printful's temporary CDN link (internal, never serialized)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    bytes = db.Column(db.BigInteger)
+
+    product_image = db.relationship("ProductImage", back_populates="mockups")
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'option_group': self.option_group,
+            'key': self.artifact_key,
+            # Resized copies served by /images/mockup/<key>/<width>.<fmt>
+            'images': artifact_derivative_urls('mockup', self.artifact_key) if self.artifact_key else None,
+            'width': self.width,
+            'height': self.height,
+            'bytes': self.bytes
+        }
+
+# Insert all mockups returned by mockup_generator() for an image in a single executemany
+def add_product_mockups(product_image_id, mockups):
+    if not mockups:
+        return 0
+    rows = [
+        {
+            'product_image_id': product_image_id,
+            'kind': mockup.get('kind'),
+            'option_group': mockup.get('option_group'),
+            'path': mockup.get('path'),
+            'artifact_key': mockup.get('key'),
+            'url': mockup.get('url'),
+            'width': mockup.get('width'),
+            'height': mockup.get('height'),
+            'bytes': mockup.get('bytes')
         }
+        for mockup in mockups
+    ]
+    db.session.execute(db.insert(ProductMockup), rows)
+
+    # Cached product reads are invalidated once this transaction commits
+    product_image = db.session.get(ProductImage, product_image_id)
+    mark_products_touched(db.session, [product_image.product_id if product_image else None])
+    return len(rows)
 
 # Completed order
 class Order(db.Model):
@@ -176,8 +244,11 @@ class Order(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     download_link = db.Column(db.String(255))
-    order_date = db.Column(db.TIMESTAMP)
-    total_amount = db.Column(db.Float)
+    order_date = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    total_amount = db.Column(db.Numeric(12, 2))
+    # pending until the payment is confirmed; prints can only be downloaded from paid orders
+    status = db.Column(db.String(32), default='pending', nullable=False)
+    paid_at = db.Column(db.TIMESTAMP)
 
     # Add the foreign key to establish the relationship
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -190,9 +261,15 @@ class Order(db.Model):
             'id': self.id,
             'download_link': self.download_link,
             'order_date': self.order_date.isoformat() if self.order_date else None,
-            'total_amount': self.total_amount
+            'total_amount': float(self.total_amount) if self.total_amount is not None else None,
+            'status': self.status,
+            'paid_at': self.paid_at.isoformat() if self.paid_at else None
         }
 
+    @property
+    def is_paid(self):
+        return self.status == 'paid'
+
 # Information about a single item in the completed order
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
@@ -200,7 +277,8 @@ class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-    price_per_unit = db.Column(db.Float)
+    quantity = db.Column(db.Integer, default=1)
+    price_per_unit = db.Column(db.Numeric(10, 2))
 
     order = db.relationship("Order", back_populates="items")
     product = db.relationship("Product", back_populates="order_items")
@@ -211,19 +289,25 @@ class OrderItem(db.Model):
             'id': self.id,
             'order_id': self.order_id,
             'product_id': self.product_id,
-            'price_per_unit': self.price_per_unit
+            'quantity': self.quantity,
+            'price_per_unit': float(self.price_per_unit) if self.price_per_unit is not None else None
         }
 
 # Information about what the user put in the cart
+# One row per product: adding the same product again is an upsert on (user_id, product_id). Prices are not
+# copied here, cart totals are computed from the product prices at read time.
 class Cart(db.Model):
     __tablename__ = 'cart'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_user_product'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-    quantity = db.Column(db.Integer)
-    total_price = db.Column(db.Float)
-    created_at = db.Column(db.TIMESTAMP)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = db.relationship("User", back_populates="cart_items")
     product = db.relationship("Product", back_populates="cart")
@@ -234,8 +318,8 @@ class Cart(db.Model):
             'user_id': self.user_id,
             'product_id': self.product_id,
             'quantity': self.quantity,
-            'total_price': self.total_price,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 # A list of user who agreed to join the email list
@@ -256,6 +340,35 @@ class EmailList(db.Model):
             'first_name': self.first_name,
             'email': self.email
         }
-        
-if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+
+# Newsletter campaign sent to the email list; cursor and counts are checkpointed after every batch
+class Campaign(db.Model):
+    __tablename__ = 'campaigns'
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    text_template = db.Column(db.Text)  # string.Template: $first_name, $email, $unsubscribe_url
+    html_template = db.Column(db.Text)
+    status = db.Column(db.String(32), default='draft')  # draft, sending, completed, failed
+    cursor = db.Column(db.JSON)  # Last recipient id sent per recipient source
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    heartbeat_at = db.Column(db.TIMESTAMP)
+    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    started_at = db.Column(db.TIMESTAMP)
+    finished_at = db.Column(db.TIMESTAMP)
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'subject': self.subject,
+            'status': self.status,
+            'cursor': self.cursor,
+            'sent_count': self.sent_count,
+            'failed_count': self.failed_count,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,26 @@
+import threading
+from pybloom_live import BloomFilter
+
+# Checking if the password is in 100K Most Common Passwords list
+
+password_file = "required_files/100k-most-used-passwords.txt"
+
+_bloom_filter = None
+_lock = threading.Lock()
+
+# Built once per process on the first password check, shared by user and admin registration
+def common_passwords():
+    global _bloom_filter
+    if _bloom_filter is None:
+        with _lock:
+            if _bloom_filter is None:
+                with open(password_file, "r", encoding="latin-1") as file:
+                    rockyou_passwords = set(file.read().split("\n"))
+                bloom_filter = BloomFilter(capacity=len(rockyou_passwords), error_rate=0.1)
+                for password in rockyou_passwords:
+                    bloom_filter.add(password)
+                _bloom_filter = bloom_filter
+    return _bloom_filter
+
+def is_weak_password(password):
+    return password in common_passwords()
@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from itertools import combinations
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from flask import has_app_context
+from artifact_storage import artifact_path
+from metrics import Counter
+from models import db, ProductImage
+from pipeline_checkpoints import Checkpoint
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Maximum pHash Hamming distance (out of 64 bits) for two images to count as near duplicates
+PHASH_DUPLICATE_DISTANCE = int(os.getenv('PHASH_DUPLICATE_DISTANCE', 6))
+# flag: report near duplicates only, reuse: also take over their mockups and descriptions
+PHASH_DUPLICATE_ACTION = os.getenv('PHASH_DUPLICATE_ACTION', 'flag')
+
+near_duplicates_found = Counter('near_duplicate_uploads_total', 'Uploads matching an existing image by perceptual hash', ['action'])
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+# 64-bit pHash (DCT of a 32x32 thumbnail) and dHash (9x8 gradient) of an image file, from one decode
+def image_hashes(file_path):
+    # Decoding at 1/4 scale is plenty for a 32x32 thumbnail and much cheaper on large prints
+    image = cv2.imread(file_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        raise ValueError(f"Could not read image {file_path}")
+
+    pixels = np.float32(cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA))
+    low = cv2.dct(pixels)[:8, :8].flatten()
+    phash = _bits_to_int(low > np.median(low[1:]))  # The DC term would skew the median
+
+    pixels = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    return {'phash': phash, 'dhash': dhash}
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+# Postgres BIGINT is signed; hashes are stored in two's complement and read back as unsigned
+def to_signed(value):
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+# Multi-index hashing: the 64 bits are split into chunks, each with its own exact-match table.
+# Two hashes within distance r differ by at most r // chunks bits in at least one chunk, so probing
+# every chunk value within that radius finds all matches while only a handful of candidates get compared.
+class HammingIndex:
+    def __init__(self, chunks=4, bits=64):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(chunks)]
+        self.hashes = {}
+        self._flips = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _parts(self, value):
+        return [(value >> (i * self.chunk_bits)) & self.mask for i in range(self.chunks)]
+
+    def _flip_masks(self, radius):
+        if radius not in self._flips:
+            self._flips[radius] = [sum(1 << bit for bit in bits)
+                                   for r in range(radius + 1)
+                                   for bits in combinations(range(self.chunk_bits), r)]
+        return self._flips[radius]
+
+    def add(self, key, value):
+        with self._lock:
+            self._remove(key)
+            self.hashes[key] = value
+            for table, part in zip(self.tables, self._parts(value)):
+                table.setdefault(part, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        value = self.hashes.pop(key, None)
+        if value is None:
+            return
+        for table, part in zip(self.tables, self._parts(value)):
+            keys = table.get(part)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del table[part]
+
+    # (distance, key) of every indexed hash within max_distance, closest first
+    def search(self, value, max_distance):
+        flips = self._flip_masks(max_distance // self.chunks)
+        seen = set()
+        results = []
+        with self._lock:
+            for table, part in zip(self.tables, self._parts(value)):
+                for flip in flips:
+                    for key in table.get(part ^ flip, ()):
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        distance = (self.hashes[key] ^ value).bit_count()
+                        if distance <= max_distance:
+                            results.append((distance, key))
+        return sorted(results)
+
+# pHashes of product images (from the database) and of uploads this worker is processing. Every search first
+# picks up the product images other workers saved since the last one (those with a higher id), so a refresh
+# costs one indexed query however many uploads there have been. An upload is indexed under its own key only
+# until its row is saved; after that it is found once, as that product image.
+class PerceptualIndex:
+    def __init__(self):
+        self.index = HammingIndex()
+        self.dhashes = {}
+        self.last_image_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, key, phash, dhash=None):
+        self.index.add(key, phash)
+        self.dhashes[key] = dhash
+
+    def remove(self, key):
+        self.index.remove(key)
+        self.dhashes.pop(key, None)
+
+    def _refresh_product_images(self):
+        rows = db.session.execute(
+            db.select(ProductImage.id, ProductImage.phash, ProductImage.dhash)
+            .where(ProductImage.id > self.last_image_id, ProductImage.phash.isnot(None))
+            .order_by(ProductImage.id)
+        )
+        for image_id, phash, dhash in rows:
+            self.add(('product_image', image_id), to_unsigned(phash), to_unsigned(dhash))
+            self.last_image_id = image_id
+
+    def refresh(self):
+        if not has_app_context():
+            return
+        with self._lock:
+            self._refresh_product_images()
+
+    def near_duplicates(self, phash, dhash=None, max_distance=PHASH_DUPLICATE_DISTANCE, exclude=None):
+        self.refresh()
+        matches = []
+        for distance, key in self.index.search(phash, max_distance):
+            if key == exclude:
+                continue
+            other_dhash = self.dhashes.get(key)
+            matches.append({
+                'source': key[0],
+                'id': key[1],
+                'phash_distance': distance,
+                'dhash_distance': hamming(dhash, other_dhash) if dhash is not None and other_dhash is not None else None
+            })
+        return matches
+
+phash_index = PerceptualIndex()
+
+# Hash product images saved without one (rows from before hashes were stored, images added by hand) from
+# their original or print file; returns how many rows were updated
+def backfill_image_hashes(batch_size=200):
+    updated = 0
+    last_id = 0
+    while True:
+        images = db.session.execute(
+            db.select(ProductImage)
+            .where(ProductImage.id > last_id, ProductImage.phash.is_(None))
+            .order_by(ProductImage.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not images:
+            return updated
+        for image in images:
+            last_id = image.id
+            path = artifact_path(image.original_key or image.print_file_key or image.print_file)
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                hashes = image_hashes(path)
+            except ValueError as e:
+                print(f"Skipping product image {image.id}. Error: {str(e)}")
+                continue
+            image.phash, image.dhash = to_signed(hashes['phash']), to_signed(hashes['dhash'])
+            updated += 1
+        db.session.commit()
+
+# Mockup and description stages rebuilt from the rows of a saved product image
+def _product_image_stages(image_id):
+    image = db.session.get(ProductImage, image_id)
+    if image is None or not image.description_key:
+        return {}
+    completed_at = time.time()
+    stages = {'descriptions': {'completed_at': completed_at, 'result': image.description_key}}
+    for mockup in image.mockups:
+        stage = stages.setdefault(f"mockups_{mockup.kind}", {'completed_at': completed_at, 'result': []})
+        stage['result'].append({
+            'kind': mockup.kind, 'option_group': mockup.option_group, 'key': mockup.artifact_key,
+            'path': artifact_path(mockup.artifact_key or mockup.path), 'url': mockup.url,
+            'width': mockup.width, 'height': mockup.height, 'bytes': mockup.bytes
+        })
+    return stages
+
+# Copy the mockup and description stages of a near duplicate into this file's checkpoint, from the checkpoint of
+# an upload still being processed or from the rows of a saved product image
+def reuse_artifacts(checkpoint, match, stages):
+    if match['source'] == 'upload':
+        source = Checkpoint.load(match['id'])
+        results = {stage: source.get(stage) for stage in stages}
+    else:
+        results = _product_image_stages(match['id'])
+    if any(results.get(stage) is None for stage in stages):
+        return False
+    for stage in stages:
+        checkpoint.data['stages'][stage] = dict(results[stage], reused_from=f"{match['source']}:{match['id']}")
+    checkpoint.save()
+    return True
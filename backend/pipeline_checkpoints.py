@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import time
+from dotenv import load_dotenv
+from metrics import Counter
+
+# Load environment variables from .env file
+load_dotenv()
+
+CHECKPOINT_FOLDER = os.getenv('CHECKPOINT_FOLDER', 'checkpoints')
+
+stages_skipped = Counter('pipeline_stages_skipped_total', 'Pipeline stages skipped because a checkpoint already had them', ['stage'])
+
+# SHA-256 of a file, read in 1 MB blocks
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Durable record of which stages of the pipeline finished for one uploaded file
+class Checkpoint:
+    def __init__(self, filename, data=None):
+        self.filename = filename
+        self.data = data or {'filename': filename, 'stages': {}}
+
+    @property
+    def path(self):
+        return os.path.join(CHECKPOINT_FOLDER, f"{self.filename}.json")
+
+    @classmethod
+    def load(cls, filename):
+        checkpoint = cls(filename)
+        try:
+            with open(checkpoint.path) as f:
+                checkpoint.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        return checkpoint
+
+    # Write to a temporary file, fsync and rename, so a crash never leaves a half-written checkpoint
+    def save(self):
+        os.makedirs(CHECKPOINT_FOLDER, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, stage):
+        return self.data['stages'].get(stage)
+
+    def is_done(self, stage):
+        done = stage in self.data['stages']
+        if done:
+            stages_skipped.inc(1, stage)
+        return done
+
+    def complete(self, stage, result=None):
+        self.data['stages'][stage] = {'completed_at': time.time(), 'result': result}
+        self.save()
+
+    def reset(self):
+        self.data = {'filename': self.filename, 'stages': {}}
+        self.save()
+
+# Checkpoints of every file whose pipeline has not completed yet
+def incomplete_checkpoints(required_stages):
+    if not os.path.isdir(CHECKPOINT_FOLDER):
+        return []
+    checkpoints = []
+    for name in sorted(os.listdir(CHECKPOINT_FOLDER)):
+        if not name.endswith('.json'):
+            continue
+        checkpoint = Checkpoint.load(name[:-len('.json')])
+        if any(stage not in checkpoint.data['stages'] for stage in required_stages):
+            checkpoints.append(checkpoint)
+    return checkpoints
@@ -0,0 +1,194 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+from flask import request, jsonify, send_file, Response
+import metrics
+from admin import admin_required
+from artifact_storage import artifact_store, is_artifact_key
+from serialization import dumps
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Requests carrying "X-Profile: <PROFILE_TOKEN>" are profiled; without a token the header is ignored
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
+# tracemalloc slows Python allocations down noticeably, so stage timings of a memory-traced job run high
+PROFILE_TRACE_MEMORY = os.getenv('PROFILE_TRACE_MEMORY', 'true').lower() not in ('0', 'false', 'no')
+PROFILE_MAX_DEPTH = 64
+PROFILE_TOP_FUNCTIONS = 15
+
+# tracemalloc and the stage hooks are process-wide, so one profiled job at a time
+_profile_lock = threading.Lock()
+
+def profile_requested():
+    header = request.headers.get('X-Profile')
+    return bool(PROFILE_TOKEN and header and hmac.compare_digest(header, PROFILE_TOKEN))
+
+def _frame_name(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+# Samples the stack of one thread at a fixed interval and attributes every sample to the innermost timed_stage
+# running in it. Samples are wall clock, so time spent waiting on the network shows up as the blocking call.
+# Per stage it also records CPU time of the thread and, with tracemalloc, the peak of traced allocations
+# (numpy arrays are traced, PIL image buffers are allocated outside Python's allocator and are not).
+class StageProfiler:
+    def __init__(self, label, interval_ms=PROFILE_SAMPLE_INTERVAL_MS, trace_memory=PROFILE_TRACE_MEMORY):
+        self.label = label
+        self.interval = interval_ms / 1000
+        self.trace_memory = trace_memory
+        self.thread_id = threading.get_ident()
+        self.open_stages = []
+        self.stage_stats = {}
+        self.stack_counts = {}
+        self.report_key = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        metrics.stage_start_observers.append(self.stage_started)
+        metrics.stage_observers.append(self.stage_finished)
+        self.started_at = datetime.utcnow()
+        self._wall = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self._wall
+        metrics.stage_start_observers.remove(self.stage_started)
+        metrics.stage_observers.remove(self.stage_finished)
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            open_stages = self.open_stages
+            stage = open_stages[-1]['stage'] if open_stages else 'other'
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            key = ';'.join([stage] + stack[::-1])
+            self.stack_counts[key] = self.stack_counts.get(key, 0) + 1
+
+    def stage_started(self, stage):
+        if threading.get_ident() != self.thread_id:
+            return
+        entry = {'stage': stage, 'cpu': time.thread_time()}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Resetting the peak for this stage must not lose the peak the enclosing stage reached so far
+            if self.open_stages:
+                self.open_stages[-1]['peak'] = max(self.open_stages[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            entry.update(start_bytes=current, peak=current)
+        self.open_stages = self.open_stages + [entry]
+
+    def stage_finished(self, stage, seconds):
+        if threading.get_ident() != self.thread_id or not self.open_stages or self.open_stages[-1]['stage'] != stage:
+            return
+        entry = self.open_stages[-1]
+        self.open_stages = self.open_stages[:-1]
+
+        stats = self.stage_stats.setdefault(stage, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        stats['calls'] += 1
+        stats['wall_seconds'] += seconds
+        stats['cpu_seconds'] += time.thread_time() - entry['cpu']
+        if self.trace_memory:
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            stats['peak_traced_bytes'] = max(stats.get('peak_traced_bytes', 0), peak)
+            stats['peak_increase_bytes'] = max(stats.get('peak_increase_bytes', 0), peak - entry['start_bytes'])
+            if self.open_stages:
+                self.open_stages[-1]['peak'] = max(self.open_stages[-1]['peak'], peak)
+
+    def report(self):
+        leaf_counts = {}
+        for key, count in self.stack_counts.items():
+            stage, leaf = key.split(';', 1)[0], key.rsplit(';', 1)[-1]
+            functions = leaf_counts.setdefault(stage, {})
+            functions[leaf] = functions.get(leaf, 0) + count
+
+        stages = {}
+        for stage in list(self.stage_stats) + [stage for stage in leaf_counts if stage not in self.stage_stats]:
+            stats = dict(self.stage_stats.get(stage, {}))
+            functions = leaf_counts.get(stage, {})
+            samples = sum(functions.values())
+            if 'wall_seconds' in stats:
+                stats['wall_seconds'] = round(stats['wall_seconds'], 4)
+                stats['cpu_seconds'] = round(stats['cpu_seconds'], 4)
+            stats['samples'] = samples
+            stats['top_functions'] = [
+                {'function': function, 'samples': count, 'share': round(count / samples, 3)}
+                for function, count in sorted(functions.items(), key=lambda item: -item[1])[:PROFILE_TOP_FUNCTIONS]
+            ]
+            stages[stage] = stats
+
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(),
+            'seconds': round(self.seconds, 4),
+            'sample_interval_ms': self.interval * 1000,
+            'samples': sum(self.stack_counts.values()),
+            'memory_traced': self.trace_memory,
+            'stages': stages,
+            # "stage;outer;...;inner count" lines, the input format of flamegraph.pl and speedscope
+            'collapsed_stacks': '\n'.join(f"{key} {count}" for key, count in sorted(self.stack_counts.items()))
+        }
+
+    def save(self):
+        self.report_key = artifact_store.put_bytes(dumps(self.report()), '.json')
+        return self.report_key
+
+# Profile the enclosed job when enabled; yields the profiler (None when not profiling) whose report is
+# stored as an artifact on exit, also when the job fails
+@contextmanager
+def profile_job(label, enabled):
+    if not enabled:
+        yield None
+        return
+    if not _profile_lock.acquire(blocking=False):
+        print(f"Profiler busy, {label} runs without profiling")
+        yield None
+        return
+
+    profiler = StageProfiler(label)
+    try:
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            profiler.save()
+            print(f"Profile of {label} stored as {profiler.report_key}")
+    finally:
+        _profile_lock.release()
+
+def profile_link(key):
+    return {'key': key, 'url': f"/profiles/{key}"}
+
+# GET /profiles/<key> - a stored profile report; ?format=collapsed returns the stacks for flame graph tools
+@admin_required()
+def download_profile(key):
+    if not is_artifact_key(key) or not key.endswith('.json') or not artifact_store.exists(key):
+        return jsonify({"error": "Profile not found"}), 404
+
+    path = artifact_store.local_path(key)
+    if request.args.get('format') == 'collapsed':
+        with open(path) as f:
+            return Response(json.load(f)['collapsed_stacks'], mimetype='text/plain')
+    return send_file(path, mimetype='application/json', as_attachment=True, download_name=f"profile-{key[:12]}.json")
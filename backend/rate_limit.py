@@ -0,0 +1,136 @@
+import math
+import os
+import threading
+import time
+from functools import wraps
+from dotenv import load_dotenv
+from flask import request, jsonify
+from metrics import Counter
+
+# Load environment variables from .env file
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv('RATE_LIMIT_WINDOW_SECONDS', 60))
+# Requests per window from one client IP and for one email address, on each limited endpoint
+RATE_LIMIT_PER_IP = int(os.getenv('RATE_LIMIT_PER_IP', 20))
+RATE_LIMIT_PER_EMAIL = int(os.getenv('RATE_LIMIT_PER_EMAIL', 5))
+# Reverse proxies in front of the app; the client IP is taken that many hops from the end of X-Forwarded-For
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 0))
+SWEEP_INTERVAL = 60
+
+rate_limit_rejections = Counter('rate_limit_rejections_total', 'Requests rejected by the rate limiter',
+                                ['endpoint', 'key'])
+
+# Seconds until the sliding estimate drops below the limit again
+def _retry_after(limit, window, elapsed, current, previous):
+    if current < limit:
+        wait = window * (1 - (limit - current) / previous) - elapsed
+    else:
+        wait = window - elapsed + window * (1 - limit / current)
+    return max(1, math.ceil(wait))
+
+# Sliding window counter: the previous fixed window's count, weighted by how much of it still overlaps the
+# sliding window, plus the current window's count. Two integers per key instead of a log of timestamps.
+class SlidingWindowCounter:
+    def __init__(self):
+        self._windows = {}  # key -> (window index, count, previous window count, expires at)
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        for key in [key for key, entry in self._windows.items() if entry[3] <= now]:
+            del self._windows[key]
+
+    # Count a request unless it is over the limit; returns (allowed, retry after seconds)
+    def hit(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        elapsed = now - index * window
+        with self._lock:
+            self._sweep(now)
+            current = previous = 0
+            entry = self._windows.get(key)
+            if entry is not None:
+                if entry[0] == index:
+                    current, previous = entry[1], entry[2]
+                elif entry[0] == index - 1:
+                    previous = entry[1]
+
+            if previous * (window - elapsed) / window + current >= limit:
+                return False, _retry_after(limit, window, elapsed, current, previous)
+            self._windows[key] = (index, current + 1, previous, (index + 2) * window)
+            return True, 0
+
+    def __len__(self):
+        return len(self._windows)
+
+# Same counter shared between workers through Redis; each window is a key that expires after two windows
+class RedisSlidingWindowCounter:
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed when a shared backend is configured
+        self._redis = redis.Redis.from_url(url)
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        elapsed = now - index * window
+        current_key = f"ratelimit:{key}:{index}"
+        previous, current = (int(value or 0) for value in self._redis.mget(f"ratelimit:{key}:{index - 1}", current_key))
+
+        if previous * (window - elapsed) / window + current >= limit:
+            return False, _retry_after(limit, window, elapsed, current, previous)
+        pipeline = self._redis.pipeline()
+        pipeline.incr(current_key)
+        pipeline.expire(current_key, 2 * window)
+        pipeline.execute()
+        return True, 0
+
+# Choose the backend based on the environment
+def create_rate_limit_counter():
+    redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+    if redis_url:
+        return RedisSlidingWindowCounter(redis_url)
+    return SlidingWindowCounter()
+
+rate_limit_counter = create_rate_limit_counter()
+
+def client_ip():
+    if RATE_LIMIT_PROXY_HOPS:
+        route = request.access_route
+        return route[max(0, len(route) - RATE_LIMIT_PROXY_HOPS)]
+    return request.remote_addr
+
+def _email():
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+# Reject a request over the per-IP or per-email limit with 429 before the view does any hashing, database
+# or SMTP work
+def rate_limited(endpoint, per_ip=None, per_email=None, window=None):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return fn(*args, **kwargs)
+
+            seconds = window or RATE_LIMIT_WINDOW_SECONDS
+            checks = [('ip', client_ip(), per_ip or RATE_LIMIT_PER_IP)]
+            email = _email()
+            if email:
+                checks.append(('email', email, per_email or RATE_LIMIT_PER_EMAIL))
+
+            for key_type, value, limit in checks:
+                allowed, retry_after = rate_limit_counter.hit(f"{endpoint}:{key_type}:{value}", limit, seconds)
+                if not allowed:
+                    rate_limit_rejections.inc(1, endpoint, key_type)
+                    response = jsonify({"error": "Too many requests. Please try again later."})
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response, 429
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
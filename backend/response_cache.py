@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from dotenv import load_dotenv
+from flask import request, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Load environment variables from .env file
+load_dotenv()
+
+# In-process LRU bounded by the total size of the cached bodies. Its invalidations only reach this process, so
+# with several workers (or writes from the scheduler and CLI) entries also expire after ttl seconds: that is
+# the longest another worker can serve a stale read. Use the Redis backend when that is too long.
+class LRUCache:
+    def __init__(self, max_bytes, max_entries, ttl):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            etag, body, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.size -= len(body)
+                return None
+            self._entries.move_to_end(key)
+            return etag, body
+
+    def set(self, key, etag, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (etag, body, time.monotonic() + self.ttl)
+            self.size += len(body)
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def generation(self, name):
+        return self._generations.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self.size = 0
+
+# Shared cache in Redis so every worker serves (and invalidates) the same entries
+class RedisCache:
+    def __init__(self, url, ttl):
+        import redis  # Optional dependency, only needed when a shared backend is configured
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self._redis.get(f"response_cache:{key}")
+        if value is None:
+            return None
+        etag, body = value.split(b"\n", 1)
+        return etag.decode(), body
+
+    def set(self, key, etag, body):
+        self._redis.set(f"response_cache:{key}", etag.encode() + b"\n" + body, ex=self.ttl)
+
+    def generation(self, name):
+        return int(self._redis.get(f"response_cache_gen:{name}") or 0)
+
+    def bump(self, name):
+        self._redis.incr(f"response_cache_gen:{name}")
+
+    def clear(self):
+        for key in self._redis.scan_iter("response_cache*"):
+            self._redis.delete(key)
+
+# Choose the backend based on the environment
+def create_response_cache():
+    redis_url = os.getenv('RESPONSE_CACHE_REDIS_URL')
+    if redis_url:
+        return RedisCache(redis_url, int(os.getenv('RESPONSE_CACHE_TTL', 3600)))
+    return LRUCache(int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+                    int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+                    int(os.getenv('RESPONSE_CACHE_LOCAL_TTL', 30)))
+
+response_cache = create_response_cache()
+
+# ETag of a response body: any change to anything the view read (images, categories, prices) changes it
+def body_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+# Cache key = scope + generation counter(s) + the full query string
+def _cache_key(scope, kwargs):
+    generations = [f"catalog:{response_cache.generation('catalog')}"]
+    if 'product_id' in kwargs:
+        product_gen = response_cache.generation(f"product:{kwargs['product_id']}")
+        generations.append(f"product:{kwargs['product_id']}:{product_gen}")
+    return f"{scope}|{'|'.join(generations)}|{request.query_string.decode()}"
+
+def _conditional_response(etag, body):
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body, 200)
+        response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
+
+# Serve a read endpoint from the cache; 200 responses get an ETag of their body
+def cached_view(scope):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            key = _cache_key(scope, kwargs)
+            entry = response_cache.get(key)
+            if entry is not None:
+                etag, body = entry
+                return _conditional_response(etag, body)
+
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            etag = body_etag(body)
+            response_cache.set(key, etag, body)
+            return _conditional_response(etag, body)
+        return decorator
+    return wrapper
+
+# Drop cached reads for a product (and every listing, which may include it)
+def invalidate_product(product_id=None):
+    response_cache.bump('catalog')
+    if product_id is not None:
+        response_cache.bump(f"product:{product_id}")
+
+# Collect the products touched by a flush and invalidate them once the transaction commits; a category change
+# (None) only invalidates the listings
+def _product_ids_for(obj):
+    from models import Category, Product, ProductImage, ProductMockup
+    if isinstance(obj, Category):
+        return [None]
+    if isinstance(obj, Product):
+        return [obj.id]
+    if isinstance(obj, ProductImage):
+        return [obj.product_id]
+    if isinstance(obj, ProductMockup):
+        image = obj.product_image
+        return [image.product_id if image else None]
+    return []
+
+# Bulk statements bypass the flush, so their callers register the products they touched
+def mark_products_touched(session, product_ids):
+    session.info.setdefault('touched_products', set()).update(product_ids)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_product_writes(session, flush_context):
+    touched = session.info.setdefault('touched_products', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        touched.update(_product_ids_for(obj))
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    touched = session.info.pop('touched_products', None)
+    if not touched:
+        return
+    response_cache.bump('catalog')
+    for product_id in touched:
+        if product_id is not None:
+            response_cache.bump(f"product:{product_id}")
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('touched_products', None)
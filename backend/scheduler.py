@@ -0,0 +1,155 @@
+# Periodic maintenance jobs, run as a process of their own next to the web workers:
+#   python scheduler.py
+#
+# Any number of scheduler instances may run; a Postgres advisory lock per job makes sure only one of them
+# runs a given job at a time, the others skip that run.
+
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
+from apscheduler.schedulers.blocking import BlockingScheduler
+from dotenv import load_dotenv
+from sqlalchemy import text
+from app import app
+from artifact_storage import collect_garbage
+from metrics import Counter, Histogram, render_metrics
+from models import db, User
+from response_cache import RedisCache, response_cache
+
+# Load environment variables from .env file
+load_dotenv()
+
+VERIFICATION_CODE_TTL_MINUTES = 10
+SCHEDULER_ARTIFACT_GC_HOURS = int(os.getenv('SCHEDULER_ARTIFACT_GC_HOURS', 24))
+SCHEDULER_CACHE_WARM_MINUTES = int(os.getenv('SCHEDULER_CACHE_WARM_MINUTES', 10))
+# Read endpoints requested by the cache warming job
+CACHE_WARM_PATHS = [path.strip() for path in os.getenv('CACHE_WARM_PATHS', '/products,/products/facets').split(',')
+                    if path.strip()]
+# Port serving this process's /metrics (job durations, overlaps); 0 disables it
+SCHEDULER_METRICS_PORT = int(os.getenv('SCHEDULER_METRICS_PORT', 9101))
+
+job_seconds = Histogram('scheduler_job_seconds', 'Duration of scheduled jobs', ['job'],
+                        buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+job_runs = Counter('scheduler_job_runs_total', 'Scheduled job runs by result', ['job', 'result'])
+# locked: another scheduler instance holds the job's lock; running: the previous run here had not finished
+job_overlaps = Counter('scheduler_job_overlaps_total', 'Scheduled runs skipped because the job was still running',
+                       ['job', 'reason'])
+
+# Stable 64-bit advisory lock id of a job name
+def lock_id(name):
+    return int.from_bytes(hashlib.sha1(f"scheduler:{name}".encode()).digest()[:8], 'big', signed=True)
+
+_local_locks = {}
+
+# Session-level advisory lock on a connection of its own, held for the whole run; Postgres releases it by itself
+# if the process dies. Other databases (SQLite in development) only get a lock within this process.
+@contextmanager
+def job_lock(name):
+    if db.engine.dialect.name != 'postgresql':
+        lock = _local_locks.setdefault(name, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    with db.engine.connect() as connection:
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id(name)}).scalar()
+        connection.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': lock_id(name)})
+                connection.commit()
+
+# Run a job in an app context under its lock, recording how long it took
+def run_job(name, fn):
+    with app.app_context():
+        with job_lock(name) as acquired:
+            if not acquired:
+                job_overlaps.inc(1, name, 'locked')
+                print(f"Scheduler: {name} skipped, another instance is running it")
+                return
+
+            started = time.perf_counter()
+            try:
+                result = fn()
+                job_runs.inc(1, name, 'ok')
+            except Exception as e:
+                db.session.rollback()
+                job_runs.inc(1, name, 'error')
+                print(f"Scheduler: {name} failed. Error: {str(e)}")
+                return
+            finally:
+                job_seconds.observe(time.perf_counter() - started, name)
+                db.session.remove()
+            print(f"Scheduler: {name} finished in {time.perf_counter() - started:.2f}s {result or ''}")
+
+# Clear verification codes older than VERIFICATION_CODE_TTL_MINUTES in one UPDATE
+def remove_expired_verification_codes():
+    expired = db.session.execute(
+        db.update(User)
+        .where(User.verification_code_created_at < datetime.utcnow() - timedelta(minutes=VERIFICATION_CODE_TTL_MINUTES),
+               User.verification_code.isnot(None))
+        .values(verification_code=None, verification_code_created_at=None)
+    ).rowcount
+    db.session.commit()
+    return {'expired': expired}
+
+def collect_artifact_garbage():
+    return collect_garbage()
+
+# Re-render the busiest read endpoints into the shared response cache after it expired or was invalidated.
+# The in-process cache belongs to each web worker, so there is nothing to warm from here without Redis.
+def warm_caches():
+    if not isinstance(response_cache, RedisCache):
+        return {'skipped': 'RESPONSE_CACHE_REDIS_URL is not set'}
+    client = app.test_client()
+    return {path: client.get(path).status_code for path in CACHE_WARM_PATHS}
+
+JOBS = [
+    ('remove_expired_verification_codes', remove_expired_verification_codes, {'minutes': 1}),
+    ('collect_artifact_garbage', collect_artifact_garbage, {'hours': SCHEDULER_ARTIFACT_GC_HOURS}),
+    ('warm_caches', warm_caches, {'minutes': SCHEDULER_CACHE_WARM_MINUTES})
+]
+
+def _count_running_overlap(event):
+    job_overlaps.inc(1, event.job_id, 'running')
+
+def serve_metrics(port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def create_scheduler():
+    scheduler = BlockingScheduler()
+    for name, fn, interval in JOBS:
+        # One run at a time per process and missed runs collapsed into one
+        scheduler.add_job(run_job, 'interval', args=(name, fn), id=name, max_instances=1, coalesce=True, **interval)
+    scheduler.add_listener(_count_running_overlap, EVENT_JOB_MAX_INSTANCES)
+    return scheduler
+
+if __name__ == '__main__':
+    if SCHEDULER_METRICS_PORT:
+        serve_metrics(SCHEDULER_METRICS_PORT)
+    create_scheduler().start()
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response, request, stream_with_context
+from models import db
+
+try:
+    import orjson  # Optional dependency; the standard library encoder is the fallback
+except ImportError:
+    orjson = None
+
+# Rows fetched from the server-side cursor (and encoded) per chunk of a streamed listing
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', 2000))
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# JSON bytes of a value; datetimes come out the same as isoformat()
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(',', ':')).encode()
+
+# Spreadsheets run text cells starting with these as formulas; such cells are prefixed with a quote
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+# One CSV chunk of rows; None becomes an empty field
+def csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_cell(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+# Stream the rows of a column SELECT as one JSON array (or NDJSON with ?format=ndjson, CSV with ?format=csv)
+# without building ORM objects: rows come from a server-side cursor chunk by chunk and each chunk is encoded
+# in one call. With a filename the response is sent as a download.
+def stream_rows(statement, chunk_rows=STREAM_CHUNK_ROWS, default_format='json', filename=None):
+    keys = list(statement.selected_columns.keys())
+    output_format = request.args.get('format', default_format)
+    result = db.session.execute(statement.execution_options(yield_per=chunk_rows))
+
+    def generate():
+        try:
+            if output_format == 'csv':
+                yield csv_chunk([keys])
+            elif output_format != 'ndjson':
+                yield b'['
+            first = True
+            for partition in result.partitions():
+                if output_format == 'csv':
+                    yield csv_chunk(partition)
+                    continue
+                rows = [dict(zip(keys, row)) for row in partition]
+                if output_format == 'ndjson':
+                    yield b''.join(dumps(row) + b'\n' for row in rows)
+                else:
+                    # Encode the whole chunk as a list and drop its brackets
+                    yield (b'' if first else b',') + dumps(rows)[1:-1]
+                    first = False
+            if output_format not in ('csv', 'ndjson'):
+                yield b']'
+        finally:
+            result.close()
+
+    mimetype = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}.get(output_format, 'application/json')
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if filename:
+        extension = {'csv': 'csv', 'ndjson': 'ndjson'}.get(output_format, 'json')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
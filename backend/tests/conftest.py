@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='lemouniq-tests-')
+
+# app.py builds its default app at import time, so the settings must be in place before anything is imported
+for name, value in (('DB_NAME', 'lemouniq'), ('DB_USERNAME', 'lemouniq'), ('DB_PASSWORD', ''), ('DB_HOST', 'localhost'),
+                    ('DB_PORT', '5432'), ('JWT_SECRET_KEY', 'test-secret'), ('OPENAI_API_KEY', 'test'),
+                    ('RATE_LIMIT_ENABLED', 'false')):
+    os.environ.setdefault(name, value)
+for folder in ('UPLOAD_FOLDER', 'CHECKPOINT_FOLDER', 'ARTIFACT_FOLDER', 'DERIVATIVE_FOLDER', 'DESCRIPTION_FOLDER',
+               'MOCKUP_FOLDER', 'OUTPUT_FOLDER'):
+    os.environ[folder] = os.path.join(WORK_DIR, folder.lower())
+
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)
+
+@pytest.fixture
+def app():
+    from app import create_app
+    from models import db
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLALCHEMY_ENGINE_OPTIONS': {}, 'TESTING': True})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# A user and the Authorization header of an access token for it
+@pytest.fixture
+def make_user(app):
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+
+    def make_user(email='customer@lemouniq.test', role='user'):
+        user = User(first_name='Test', last_name='User', email=email, role=role, email_list=True)
+        db.session.add(user)
+        db.session.commit()
+        return user, {'Authorization': f"Bearer {create_access_token(identity=email)}"}
+    return make_user
@@ -0,0 +1,26 @@
+from models import db, User
+
+NEW_USER = {'first_name': 'Ann', 'last_name': 'Lee', 'email': 'ann@example.com', 'password': 'Correct-Horse-42!'}
+
+def test_register_ignores_privileged_fields(app, client, monkeypatch):
+    monkeypatch.setattr('user.send_verification_code', lambda user: None)
+    response = client.post('/register', json=dict(NEW_USER, role='admin', verified_email=True, logged_in=False))
+    assert response.status_code == 200, response.get_json()
+
+    user = db.session.execute(db.select(User).where(User.email == NEW_USER['email'])).scalar_one()
+    assert (user.role, user.verified_email, user.logged_in) == ('user', False, True)
+
+def test_register_admin_needs_an_admin(app, client, make_user):
+    assert client.post('/register_admin', json=NEW_USER).status_code == 401
+    _, user_headers = make_user('user@example.com', 'user')
+    assert client.post('/register_admin', json=NEW_USER, headers=user_headers).status_code == 403
+
+    _, admin_headers = make_user('admin@example.com', 'admin')
+    assert client.post('/register_admin', json=NEW_USER, headers=admin_headers).status_code in (200, 201)
+    assert db.session.execute(db.select(User.role).where(User.email == NEW_USER['email'])).scalar() == 'admin'
+
+def test_make_admin_command(app, make_user):
+    make_user('first@example.com', 'user')
+    result = app.test_cli_runner().invoke(args=['make-admin', 'first@example.com'])
+    assert 'is now an admin' in result.output
+    assert db.session.execute(db.select(User.role).where(User.email == 'first@example.com')).scalar() == 'admin'
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+import artifact_storage
+import pipeline_checkpoints
+from artifact_storage import LocalArtifactStore, S3ArtifactStore, collect_garbage
+from models import db, ProductImage
+from pipeline_checkpoints import Checkpoint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fakes import FakeS3Server  # noqa: E402 - the S3 stand-in the benchmarks use
+
+def test_stored_blob_is_independent_of_the_source(tmp_path):
+    store = LocalArtifactStore(str(tmp_path / 'artifacts'))
+    source = tmp_path / 'upload.png'
+    source.write_bytes(b'original')
+
+    key = store.put_file(str(source))
+    assert key == hashlib.sha256(b'original').hexdigest() + '.png'
+    # Rewriting the source afterwards never reaches the stored blob
+    with open(source, 'r+b') as f:
+        f.write(b'CHANGED!')
+    with open(store.local_path(key), 'rb') as f:
+        assert f.read() == b'original'
+    assert os.stat(store.local_path(key)).st_ino != os.stat(source).st_ino
+
+def test_move_and_duplicates(tmp_path):
+    store = LocalArtifactStore(str(tmp_path / 'artifacts'))
+    first, second = tmp_path / 'a.json', tmp_path / 'b.json'
+    first.write_bytes(b'{}')
+    second.write_bytes(b'{}')
+
+    key = store.put_file(str(first), move=True)
+    assert not first.exists()
+    assert store.put_file(str(second), move=True) == key
+    assert not second.exists()
+    assert [name for name, _, _ in store.iter_blobs()] == [key]
+    # No temporary files are left behind
+    assert [name for name in os.listdir(store.root) if name.endswith('.tmp')] == []
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'test'), ('AWS_SECRET_ACCESS_KEY', 'test'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    server = FakeS3Server().start()
+    store = S3ArtifactStore('lemouniq', 'artifacts/', LocalArtifactStore(str(tmp_path / 'cache')), endpoint_url=server.url)
+    yield server, store
+    server.stop()
+
+def test_s3_store_round_trip(s3):
+    server, store = s3
+    key = store.put_bytes(b'mockup', '.jpg')
+    assert set(server.objects) == {('lemouniq', f"artifacts/{key[:2]}/{key[2:4]}/{key}")}
+    assert store.exists(key)
+    assert not store.exists(hashlib.sha256(b'other').hexdigest() + '.jpg')
+
+    # A worker with an empty cache downloads the blob on first use
+    os.remove(store.cache.local_path(key))
+    with open(store.local_path(key), 'rb') as f:
+        assert f.read() == b'mockup'
+
+    duplicates = artifact_storage.artifacts_stored.value('duplicate')
+    assert store.put_bytes(b'mockup', '.jpg') == key
+    assert artifact_storage.artifacts_stored.value('duplicate') > duplicates
+    assert [(name, size) for name, size, _ in store.iter_blobs()] == [(key, len(b'mockup'))]
+
+    store.delete(key)
+    assert server.objects == {}
+    assert not store.cache.exists(key)
+
+def age(server, days):
+    for object_key, (body, modified) in list(server.objects.items()):
+        server.objects[object_key] = (body, modified - days * 24 * 3600)
+
+def test_collect_garbage_keeps_referenced_and_recent_blobs(app, s3, tmp_path, monkeypatch):
+    server, store = s3
+    monkeypatch.setattr(artifact_storage, 'artifact_store', store)
+    monkeypatch.setattr(pipeline_checkpoints, 'CHECKPOINT_FOLDER', str(tmp_path / 'checkpoints'))
+
+    row_key = store.put_bytes(b'print', '.png')
+    checkpoint_key = store.put_bytes(b'mockup of an upload in progress', '.jpg')
+    orphan_key = store.put_bytes(b'left behind', '.json')
+    db.session.add(ProductImage(print_file_key=row_key))
+    db.session.commit()
+    checkpoint = Checkpoint('upload.png')
+    checkpoint.complete('mockups_canvas', [{'key': checkpoint_key}])
+
+    # Everything is still inside the grace period
+    assert collect_garbage()['deleted'] == 0
+    age(server, 2)
+    recent_key = store.put_bytes(b'stored but not referenced yet', '.png')
+
+    report = collect_garbage(dry_run=True)
+    assert (report['referenced'], report['scanned'], report['deleted']) == (2, 4, 1)
+    assert store.exists(orphan_key)
+
+    report = collect_garbage()
+    assert (report['deleted'], report['deleted_bytes']) == (1, len(b'left behind'))
+    assert {name for name, _, _ in store.iter_blobs()} == {row_key, checkpoint_key, recent_key}
+    assert not store.cache.exists(orphan_key)
@@ -0,0 +1,59 @@
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
+
+from auth_tokens import verified_tokens
+
+def _cache(token):
+    claims = decode_token(token)
+    verified_tokens.put(token, {'alg': 'HS256', 'typ': 'JWT'}, claims)
+
+def test_access_token_is_cached_and_accepted(client, make_user):
+    _, headers = make_user()
+    first = client.post('/cart/items', json={'product_id': 999}, headers=headers)
+    assert first.status_code == 404
+    assert verified_tokens.get(headers['Authorization'][7:]) is not None
+    assert client.get('/cart', headers=headers).status_code == 200
+
+def test_cached_refresh_token_is_rejected(app, client, make_user):
+    make_user()
+    token = create_refresh_token(identity='customer@lemouniq.test')
+    _cache(token)
+    response = client.get('/cart', headers={'Authorization': f"Bearer {token}"})
+    assert response.status_code == 422
+
+def test_revoked_cached_token_is_rejected(client, make_user):
+    _, headers = make_user()
+    assert client.get('/cart', headers=headers).status_code == 200
+    assert client.post('/logout', headers=headers).status_code == 200
+    assert client.get('/cart', headers=headers).status_code == 401
+
+def test_fresh_check_on_cache_hit(app):
+    import pytest
+    from flask_jwt_extended.exceptions import FreshTokenRequired
+    from auth_tokens import _check_cached_claims
+    token = create_access_token(identity='customer@lemouniq.test', fresh=False)
+    with pytest.raises(FreshTokenRequired):
+        _check_cached_claims({}, decode_token(token), fresh=True)
+    _check_cached_claims({}, decode_token(token), fresh=False)
+
+def test_current_user_on_cache_hit_and_miss(app, make_user):
+    from flask_jwt_extended import get_current_user
+    from auth_tokens import jwt_cached_required
+
+    loaded = []
+
+    @app.extensions['flask-jwt-extended'].user_lookup_loader
+    def load_user(header, claims):
+        loaded.append(claims['sub'])
+        return {'email': claims['sub']}
+
+    @jwt_cached_required()
+    def whoami():
+        return get_current_user()['email']
+    app.add_url_rule('/whoami', 'whoami', whoami)
+
+    _, headers = make_user('ann@example.com')
+    client = app.test_client()
+    # First request verifies the token, the second is a cache hit; both load the user
+    assert client.get('/whoami', headers=headers).get_data(as_text=True) == 'ann@example.com'
+    assert client.get('/whoami', headers=headers).get_data(as_text=True) == 'ann@example.com'
+    assert loaded == ['ann@example.com', 'ann@example.com']
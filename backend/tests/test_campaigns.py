@@ -0,0 +1,51 @@
+import email
+from urllib.parse import parse_qs, urlsplit
+
+from campaigns import CampaignTemplate, unsubscribe_url
+from models import db, Campaign, EmailList, User
+
+def unsubscribe_path(address):
+    url = urlsplit(unsubscribe_url(address))
+    return f"{url.path}?{url.query}"
+
+def test_messages_carry_a_signed_unsubscribe_link():
+    campaign = Campaign(subject='News for $first_name', text_template='Leave: $unsubscribe_url', html_template=None)
+    message = email.message_from_string(CampaignTemplate(campaign).render('Ann', 'ann@example.com'))
+
+    link = message['List-Unsubscribe'].strip('<>')
+    assert message['List-Unsubscribe-Post'] == 'List-Unsubscribe=One-Click'
+    assert message.get_payload()[0].get_payload() == f"Leave: {link}"
+    assert parse_qs(urlsplit(link).query)['email'] == ['ann@example.com']
+
+def test_unsubscribe_removes_the_address(app, client, make_user):
+    user, _ = make_user('ann@example.com', 'user')
+    user.email_list = True
+    db.session.add(EmailList(user_id=user.id, first_name='Ann', email='ann@example.com'))
+    db.session.add(EmailList(first_name='Bob', email='bob@example.com'))
+    db.session.commit()
+    path = unsubscribe_path('ann@example.com')
+
+    # Opening the link only shows the confirmation form
+    assert client.get(path).status_code == 200
+    assert db.session.execute(db.select(EmailList.email).order_by(EmailList.id)).scalars().all() == [
+        'ann@example.com', 'bob@example.com']
+
+    # The mail client's one-click request
+    assert client.post(path, data={'List-Unsubscribe': 'One-Click'}).status_code == 200
+    assert db.session.execute(db.select(EmailList.email)).scalars().all() == ['bob@example.com']
+    assert db.session.execute(db.select(User.email_list).where(User.id == user.id)).scalar() is False
+
+def test_unsubscribe_rejects_forged_links(client):
+    token = parse_qs(urlsplit(unsubscribe_url('ann@example.com')).query)['token'][0]
+    assert client.post(f"/unsubscribe?email=bob@example.com&token={token}").status_code == 403
+    assert client.post('/unsubscribe?email=bob@example.com').status_code == 403
+
+def test_email_list_export_escapes_formulas(app, client, make_user):
+    _, headers = make_user('admin@example.com', 'admin')
+    db.session.add(EmailList(first_name='=HYPERLINK("http://evil")', email='-2+3@example.com'))
+    db.session.add(EmailList(first_name='Ann', email='ann@example.com'))
+    db.session.commit()
+
+    lines = client.get('/admin/email_list/export', headers=headers).get_data(as_text=True).splitlines()
+    assert lines[1].endswith(',"\'=HYPERLINK(""http://evil"")",\'-2+3@example.com')
+    assert lines[2].endswith(',Ann,ann@example.com')
@@ -0,0 +1,100 @@
+import pytest
+
+from artifact_storage import artifact_store
+from downloads import signed_download_path
+from models import db, Cart, Order, Product, ProductImage
+
+@pytest.fixture
+def products(app):
+    poster = Product(title='Poster', status='active', price=20, sale_price=15)
+    canvas = Product(title='Canvas', status='active', price=49.99)
+    draft = Product(title='Draft', status='draft', price=10)
+    unpriced = Product(title='Unpriced', status='active')
+    db.session.add_all([poster, canvas, draft, unpriced])
+    db.session.flush()
+    db.session.add(ProductImage(product_id=poster.id, print_file_key=artifact_store.put_bytes(b'poster print', '.png')))
+    db.session.commit()
+    return poster.id, canvas.id, draft.id, unpriced.id
+
+def test_cart_totals_use_sale_prices(client, make_user, products):
+    poster, canvas, _, _ = products
+    _, headers = make_user('ann@example.com', 'user')
+
+    client.post('/cart/items', json={'product_id': poster, 'quantity': 2}, headers=headers)
+    cart = client.post('/cart/items', json={'product_id': canvas}, headers=headers).get_json()
+    assert [(item['product_id'], item['quantity'], item['unit_price']) for item in cart['items']] == [
+        (poster, 2, 15.0), (canvas, 1, 49.99)]
+    assert (cart['item_count'], cart['total']) == (3, 79.99)
+
+    # Adding again increments; PUT sets; 0 removes
+    assert client.post('/cart/items', json={'product_id': poster}, headers=headers).get_json()['items'][0]['quantity'] == 3
+    assert client.put(f'/cart/items/{poster}', json={'quantity': 1}, headers=headers).get_json()['total'] == 64.99
+    assert client.put(f'/cart/items/{canvas}', json={'quantity': 0}, headers=headers).get_json()['item_count'] == 1
+
+def test_invalid_cart_changes(client, make_user, products):
+    poster, _, _, _ = products
+    _, headers = make_user('ann@example.com', 'user')
+    assert client.post('/cart/items', json={'product_id': poster, 'quantity': 0}, headers=headers).status_code == 400
+    assert client.post('/cart/items', json={'product_id': poster, 'quantity': True}, headers=headers).status_code == 400
+    assert client.post('/cart/items', json={'product_id': 999}, headers=headers).status_code == 404
+    assert client.post('/cart/items', json={'product_id': poster}).status_code == 401
+
+def test_only_products_for_sale_go_in_the_cart(client, make_user, products):
+    poster, _, draft, unpriced = products
+    _, headers = make_user('ann@example.com', 'user')
+
+    assert client.post('/cart/items', json={'product_id': draft}, headers=headers).status_code == 404
+    assert client.post('/cart/items', json={'product_id': unpriced}, headers=headers).status_code == 400
+    assert client.put(f'/cart/items/{draft}', json={'quantity': 2}, headers=headers).status_code == 404
+    assert client.put(f'/cart/items/{unpriced}', json={'quantity': 2}, headers=headers).status_code == 400
+    assert client.get('/cart', headers=headers).get_json()['items'] == []
+
+    # A product unpublished after it was added stays in the cart but cannot be ordered
+    client.post('/cart/items', json={'product_id': poster}, headers=headers)
+    db.session.get(Product, poster).status = 'draft'
+    db.session.commit()
+    assert client.post('/cart/checkout', headers=headers).status_code == 400
+    # Removing it still works
+    assert client.put(f'/cart/items/{poster}', json={'quantity': 0}, headers=headers).get_json()['items'] == []
+
+def test_quantity_is_capped(client, make_user, products):
+    poster, _, _, _ = products
+    _, headers = make_user('ann@example.com', 'user')
+    client.post('/cart/items', json={'product_id': poster, 'quantity': 80}, headers=headers)
+    cart = client.post('/cart/items', json={'product_id': poster, 'quantity': 80}, headers=headers).get_json()
+    assert cart['items'][0]['quantity'] == 100
+
+def test_checkout_creates_a_pending_order(client, make_user, products):
+    poster, canvas, _, _ = products
+    user, headers = make_user('ann@example.com', 'user')
+    _, admin_headers = make_user('admin@example.com', 'admin')
+
+    assert client.post('/cart/checkout', headers=headers).status_code == 400
+
+    client.post('/cart/items', json={'product_id': poster, 'quantity': 2}, headers=headers)
+    client.post('/cart/items', json={'product_id': canvas}, headers=headers)
+    response = client.post('/cart/checkout', headers=headers)
+    assert response.status_code == 201
+    order = response.get_json()['order']
+    items = response.get_json()['items']
+    assert (order['total_amount'], order['status'], order['paid_at']) == (79.99, 'pending', None)
+    assert sorted((item['product_id'], item['quantity'], item['price_per_unit']) for item in items) == sorted([
+        (poster, 2, 15.0), (canvas, 1, 49.99)])
+    assert db.session.execute(db.select(Cart).where(Cart.user_id == user.id)).first() is None
+
+    # No downloads until the payment is confirmed
+    links = f"/orders/{order['id']}/download_links"
+    assert client.get(links, headers=headers).status_code == 402
+    poster_item = next(item['id'] for item in items if item['product_id'] == poster)
+    assert client.get(signed_download_path(poster_item)).status_code == 402
+
+    assert client.post(f"/admin/orders/{order['id']}/paid", headers=headers).status_code == 403
+    paid = client.post(f"/admin/orders/{order['id']}/paid", headers=admin_headers).get_json()
+    assert paid['status'] == 'paid' and paid['paid_at']
+    # Confirming twice keeps the first payment time
+    assert client.post(f"/admin/orders/{order['id']}/paid", headers=admin_headers).get_json()['paid_at'] == paid['paid_at']
+
+    download_links = client.get(links, headers=headers).get_json()
+    link = next(item['download_link'] for item in download_links['items'] if item['order_item_id'] == poster_item)
+    assert client.get(link).data == b'poster print'
+    assert db.session.get(Order, order['id']).is_paid
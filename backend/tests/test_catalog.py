@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from models import db, Product, ProductImage
+from response_cache import response_cache
+
+@pytest.fixture
+def catalog(app):
+    response_cache.clear()
+    published = Product(title='Sunset print', status='active', price=20, created_at=datetime(2024, 1, 1))
+    draft = Product(title='Secret draft sunset', status='draft', created_at=datetime(2024, 1, 2))
+    db.session.add_all([published, draft])
+    db.session.flush()
+    for product in (published, draft):
+        db.session.add(ProductImage(product_id=product.id, orientation='vertical', color_family='red'))
+    db.session.commit()
+    return published.id, draft.id
+
+def test_drafts_stay_out_of_the_storefront(client, catalog):
+    published, draft = catalog
+
+    assert [product['id'] for product in client.get('/products').get_json()['products']] == [published]
+    assert client.get(f'/products/{published}').status_code == 200
+    assert client.get(f'/products/{draft}').status_code == 404
+    assert [product['id'] for product in client.get('/search?q=sunset').get_json()['products']] == [published]
+    assert client.get('/products/facets').get_json() == {'orientation': {'vertical': 1}, 'color': {'red': 1}}
+
+def test_published_draft_appears(client, catalog):
+    _, draft = catalog
+    assert client.get(f'/products/{draft}').status_code == 404
+
+    db.session.get(Product, draft).status = 'active'
+    db.session.commit()
+    assert client.get(f'/products/{draft}').status_code == 200
+    assert len(client.get('/products').get_json()['products']) == 2
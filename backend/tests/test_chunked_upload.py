@@ -0,0 +1,104 @@
+import os
+import shutil
+
+import pytest
+
+import chunked_upload
+
+DATA = bytes(range(256)) * 40
+
+@pytest.fixture
+def uploads(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(chunked_upload, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(chunked_upload, 'PARTIAL_FOLDER', str(tmp_path / '.partial'))
+    processed = []
+    monkeypatch.setattr(chunked_upload, 'store_upload', lambda path, filename, product_id: processed.append(('store', filename, product_id))
+                        or shutil.move(path, str(tmp_path / filename)))
+    monkeypatch.setattr(chunked_upload, 'process_file_paths', lambda paths, profile=False: processed.append(('process', paths)) or ['done'])
+    return tmp_path, processed
+
+def create(client, size=len(DATA), **extra):
+    response = client.post('/uploads', json={'filename': 'big art.png', 'size': size, **extra})
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+def test_create_validates_the_session(client, uploads):
+    assert client.post('/uploads', json={'filename': 'art.png'}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'art.exe', 'size': 10}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'art.png', 'size': 0}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'art.png', 'size': 10, 'product_id': 'x'}).status_code == 400
+
+    upload_id = create(client)
+    status = client.get(f'/uploads/{upload_id}').get_json()
+    assert (status['filename'], status['size'], status['received'], status['complete']) == ('big_art.png', len(DATA), [], False)
+    assert client.get(f"/uploads/{'0' * 32}").status_code == 404
+
+def test_chunks_by_offset_and_content_range_fill_the_file(client, uploads):
+    upload_id = create(client)
+
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=DATA[:4000])
+    assert response.status_code == 200
+    assert response.get_json()['received'] == [[0, 4000]]
+
+    # Out of order, then the gap in between
+    last = len(DATA) - 1
+    assert client.put(f'/uploads/{upload_id}', data=DATA[8000:],
+                      headers={'Content-Range': f'bytes 8000-{last}/{len(DATA)}'}).status_code == 200
+    status = client.get(f'/uploads/{upload_id}').get_json()
+    assert status['received'] == [[0, 4000], [8000, len(DATA)]]
+    assert status['received_bytes'] == len(DATA) - 4000
+
+    assert client.put(f'/uploads/{upload_id}', data=DATA[4000:8000],
+                      headers={'Content-Range': 'bytes 4000-7999/*'}).status_code == 200
+    status = client.get(f'/uploads/{upload_id}').get_json()
+    assert status['received'] == [[0, len(DATA)]] and status['complete']
+
+def test_chunk_outside_the_file_or_with_a_wrong_total_is_rejected(client, uploads):
+    upload_id = create(client)
+    assert client.put(f'/uploads/{upload_id}', data=b'x' * 10,
+                      headers={'Content-Range': f'bytes {len(DATA)}-{len(DATA) + 9}/{len(DATA)}'}).status_code == 416
+    assert client.put(f'/uploads/{upload_id}', data=b'x' * 10,
+                      headers={'Content-Range': f'bytes 0-9/{len(DATA) + 1}'}).status_code == 400
+    assert client.put(f'/uploads/{upload_id}', data=b'x' * 10, headers={'Content-Range': 'bytes=0-9'}).status_code == 400
+    assert client.put(f'/uploads/{upload_id}', data=b'x' * 10).status_code == 400
+    assert client.get(f'/uploads/{upload_id}').get_json()['received'] == []
+
+def test_finalize_moves_the_file_and_processes_it(client, uploads):
+    folder, processed = uploads
+    upload_id = create(client, product_id=7)
+    client.put(f'/uploads/{upload_id}?offset=0', data=DATA[:100])
+
+    response = client.post(f'/uploads/{upload_id}/finalize')
+    assert response.status_code == 409
+    assert response.get_json()['received'] == [[0, 100]]
+
+    client.put(f'/uploads/{upload_id}?offset=100', data=DATA[100:])
+    response = client.post(f'/uploads/{upload_id}/finalize')
+    assert response.status_code == 200
+    assert response.get_json() == {'processed_data': ['done']}
+
+    file_path = str(folder / 'big_art.png')
+    with open(file_path, 'rb') as f:
+        assert f.read() == DATA
+    assert processed == [('store', 'big_art.png', 7), ('process', [file_path])]
+    assert os.listdir(folder / '.partial') == []
+
+    # The session is gone for later chunks and a second finalize
+    assert client.put(f'/uploads/{upload_id}?offset=0', data=DATA[:10]).status_code == 404
+    assert client.post(f'/uploads/{upload_id}/finalize').status_code == 404
+
+def test_chunk_racing_a_finalize_gets_a_conflict(client, uploads, monkeypatch):
+    upload_id = create(client)
+    client.put(f'/uploads/{upload_id}?offset=0', data=DATA)
+
+    # Finalize wins between the chunk's session check and its write
+    write_chunk = chunked_upload._write_chunk
+    def finalize_first(*args):
+        assert client.post(f'/uploads/{upload_id}/finalize').status_code == 200
+        return write_chunk(*args)
+    monkeypatch.setattr(chunked_upload, '_write_chunk', finalize_first)
+
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=DATA[:10])
+    assert response.status_code == 409
+    with open(uploads[0] / 'big_art.png', 'rb') as f:
+        assert f.read() == DATA
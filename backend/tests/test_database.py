@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool, StaticPool
+
+from database import TimedQueuePool, pool_stats
+
+def test_queue_pool_reports_utilization():
+    engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=2, max_overflow=1)
+    with engine.connect():
+        stats = pool_stats(engine)
+    assert (stats['pool_class'], stats['pool_size'], stats['max_overflow'], stats['checked_out']) == (
+        'TimedQueuePool', 2, 1, 1)
+    assert stats['utilization'] == 1 / 3
+    assert stats['checkouts'] >= 1
+
+def test_other_pools_report_checkout_waits_only():
+    for poolclass in (StaticPool, NullPool):
+        stats = pool_stats(create_engine('sqlite://', poolclass=poolclass))
+        assert stats['pool_class'] == poolclass.__name__
+        assert 'utilization' not in stats
+        assert 'checkouts' in stats
+
+def test_pool_stats_endpoint_on_the_test_app(client, monkeypatch):
+    monkeypatch.setattr('metrics.METRICS_TOKEN', 'scrape-token')
+    response = client.get('/db_pool_stats', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert response.get_json()['pool_class'] == 'StaticPool'
@@ -0,0 +1,43 @@
+import io
+import os
+
+from PIL import Image
+
+import derivatives
+from artifact_storage import artifact_store
+from derivatives import generate_upload_derivatives
+
+def stored_png(color, size=(1000, 500)):
+    data = io.BytesIO()
+    Image.new('RGB', size, color).save(data, format='PNG')
+    return artifact_store.put_bytes(data.getvalue(), '.png')
+
+def test_upload_derivatives_are_named_by_the_stored_original(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(derivatives, 'DERIVATIVE_FOLDER', str(tmp_path))
+    original_key = stored_png((200, 20, 20))
+    mockup_key = stored_png((20, 20, 200), (400, 400))
+
+    generated = generate_upload_derivatives(original_key, [{'key': mockup_key, 'path': artifact_store.local_path(mockup_key)}])
+
+    assert generated['main']['jpg'][2] == f"/images/main/{original_key}/960.jpg"
+    assert list(generated['mockups']) == [mockup_key]
+    assert generated['mockups'][mockup_key]['webp'][0] == f"/images/mockup/{mockup_key}/320.webp"
+    assert os.path.exists(derivatives.derivative_path('main', original_key, original_key[:12], 960, 'jpg'))
+
+def test_key_urls_keep_serving_their_own_image(app, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(derivatives, 'DERIVATIVE_FOLDER', str(tmp_path))
+    first = generate_upload_derivatives(stored_png((200, 20, 20)), [])['main']['jpg'][0]
+    # A later upload of a different image (whatever its file name) gets its own key and URL
+    second = generate_upload_derivatives(stored_png((20, 200, 20)), [])['main']['jpg'][0]
+    assert first != second
+
+    response = client.get(first)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.size == (320, 160)
+        assert image.getpixel((160, 80))[0] > 150
+
+    # Keys are their own version, a stray ?v= never redirects to other bytes
+    assert client.get(f"{first}?v=old").status_code == 200
+    assert client.get(f"/images/main/{'0' * 64}.png/320.jpg").status_code == 404
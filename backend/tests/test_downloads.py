@@ -0,0 +1,108 @@
+import time
+import zlib
+
+import pytest
+
+import downloads
+import zip_stream
+from artifact_storage import artifact_store
+from downloads import RangeNotSatisfiable, parse_range, sign, signed_bundle_path, signed_download_path, verify_signature
+from models import db, Order, OrderItem, Product, ProductImage
+
+PRINT_BYTES = bytes(range(256)) * 40
+
+@pytest.fixture
+def print_item(app):
+    product = Product(title='Dunes', status='active', price=10)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add(ProductImage(product_id=product.id, print_file_key=artifact_store.put_bytes(PRINT_BYTES, '.png')))
+    order = Order(total_amount=10, status='paid')
+    db.session.add(order)
+    db.session.flush()
+    item = OrderItem(order_id=order.id, product_id=product.id, quantity=1, price_per_unit=10)
+    db.session.add(item)
+    db.session.commit()
+    return item.id
+
+def test_signature_round_trip():
+    expires = int(time.time()) + 60
+    signature = sign('item:1', expires)
+    assert verify_signature('item:1', str(expires), signature)
+    assert not verify_signature('item:2', str(expires), signature)
+    assert not verify_signature('item:1', str(expires + 1), signature)
+    assert not verify_signature('item:1', str(expires), None)
+
+def test_expired_signature_is_refused():
+    expires = int(time.time()) - 1
+    assert not verify_signature('item:1', str(expires), sign('item:1', expires))
+
+def test_empty_signing_key_fails_closed(monkeypatch):
+    monkeypatch.setenv('DOWNLOAD_SIGNING_KEY', '')
+    monkeypatch.setenv('JWT_SECRET_KEY', '')
+    expires = int(time.time()) + 60
+    forged = downloads.hmac.new(b'', f"item:1:{expires}".encode(), downloads.hashlib.sha256).hexdigest()
+    with pytest.raises(downloads.SigningKeyMissing):
+        sign('item:1', expires)
+    assert not verify_signature('item:1', str(expires), forged)
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-9', (0, 10)),
+    ('bytes=10-', (10, 100)),
+    ('bytes=-10', (90, 100)),
+    ('bytes=90-500', (90, 100)),
+    ('bytes=0-1,5-6', None),
+    ('bytes=a-b', None)
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=5-2', 'bytes=-0'])
+def test_unsatisfiable_range(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+def test_download_serves_ranges(client, print_item):
+    path = signed_download_path(print_item)
+
+    full = client.get(path)
+    assert full.status_code == 200
+    assert full.data == PRINT_BYTES
+
+    partial = client.get(path, headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert partial.data == PRINT_BYTES[100:200]
+    assert partial.headers['Content-Range'] == f"bytes 100-199/{len(PRINT_BYTES)}"
+
+    assert client.get(path, headers={'Range': f"bytes={len(PRINT_BYTES)}-"}).status_code == 416
+    assert client.get(path, headers={'If-None-Match': full.headers['ETag']}).status_code == 304
+    # A stale If-Range gets the whole file instead of the range
+    stale = client.get(path, headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert stale.status_code == 200
+
+def test_download_refuses_bad_signature(client, print_item):
+    expires = int(time.time()) + 60
+    assert client.get(f"/download/{print_item}?expires={expires}&signature=0").status_code == 403
+
+def test_unpaid_orders_have_nothing_to_download(client, print_item):
+    item = db.session.get(OrderItem, print_item)
+    item.order.status = 'pending'
+    db.session.commit()
+
+    assert client.get(signed_download_path(print_item)).status_code == 402
+    assert client.get(signed_bundle_path(item.order_id)).status_code == 402
+
+def test_bundle_uses_the_stored_print_crc(client, print_item, monkeypatch):
+    assert downloads.backfill_print_crcs() == 1
+    image = db.session.execute(db.select(ProductImage)).scalar_one()
+    assert image.print_file_crc32 == zlib.crc32(PRINT_BYTES)
+    assert downloads.backfill_print_crcs() == 0
+
+    path = signed_bundle_path(db.session.get(OrderItem, print_item).order_id)
+    whole = client.get(path).data
+    zip_stream._crc_cache.clear()
+    monkeypatch.setattr(zip_stream, 'file_crc32', lambda path: pytest.fail(f"{path} was read for its CRC"))
+    resumed = client.get(path, headers={'Range': f"bytes={len(whole) - 100}-"})
+    assert resumed.status_code == 206
+    assert resumed.data == whole[-100:]
@@ -0,0 +1,25 @@
+from PIL import Image
+
+from artifact_storage import artifact_store
+from facets import backfill_image_facets
+from models import db, Product, ProductImage
+
+def test_backfilled_facets_are_filterable(app, client, tmp_path):
+    product = Product(title='Lagoon', status='active', price=10)
+    db.session.add(product)
+    db.session.flush()
+    path = tmp_path / 'lagoon.png'
+    Image.new('RGB', (60, 120), (20, 60, 220)).save(path)
+    image = ProductImage(product_id=product.id, original_key=artifact_store.put_file(str(path)))
+    db.session.add(image)
+    db.session.commit()
+
+    assert client.get('/products?orientation=vertical&color=blue').get_json()['products'] == []
+
+    assert backfill_image_facets() == 1
+    assert (image.orientation, image.aspect_ratio, image.color_family) == ('vertical', 0.5, 'blue')
+    # Nothing left to backfill
+    assert backfill_image_facets() == 0
+
+    listing = client.get('/products?orientation=vertical&color=blue').get_json()['products']
+    assert [item['id'] for item in listing] == [product.id]
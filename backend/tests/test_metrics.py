@@ -0,0 +1,40 @@
+import pytest
+from flask import Flask
+
+import metrics
+from metrics import init_metrics
+
+HEADERS = {'Authorization': 'Bearer scrape-token'}
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'scrape-token')
+
+@pytest.mark.parametrize('path', ['/metrics', '/db_pool_stats'])
+def test_operational_endpoints_need_the_token(client, token, path):
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    assert client.get(path, headers=HEADERS).status_code == 200
+
+def test_endpoints_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+def test_failing_collector_does_not_fail_the_scrape(token):
+    gauge = metrics.Gauge('test_collected_value', 'Set by a collector')
+
+    def broken_collector():
+        raise AttributeError('pool has no size()')
+
+    def working_collector():
+        gauge.set(7)
+
+    app = Flask(__name__)
+    init_metrics(app, collectors=[broken_collector, working_collector])
+    response = app.test_client().get('/metrics', headers=HEADERS)
+    metrics.REGISTRY.remove(gauge)
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'test_collected_value 7' in body
+    assert 'metrics_collector_errors_total{collector="broken_collector"} 1' in body
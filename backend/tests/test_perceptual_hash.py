@@ -0,0 +1,111 @@
+import random
+
+from PIL import Image
+
+from artifact_storage import artifact_store
+from models import db, Product, ProductImage, ProductMockup
+from perceptual_hash import (HammingIndex, PerceptualIndex, backfill_image_hashes, hamming, image_hashes, reuse_artifacts,
+                             to_signed, to_unsigned)
+from pipeline_checkpoints import Checkpoint
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+def test_search_finds_every_hash_within_the_distance():
+    rng = random.Random(7)
+    index = HammingIndex()
+    hashes = {key: rng.getrandbits(64) for key in range(500)}
+    for key, value in hashes.items():
+        index.add(key, value)
+    query = flip(hashes[10], [0, 17, 33, 60, 61])
+    index.add('near', flip(query, [5, 40]))
+
+    for max_distance in (0, 3, 6, 10):
+        expected = sorted((hamming(value, query), key) for key, value in list(hashes.items()) + [('near', index.hashes['near'])]
+                          if hamming(value, query) <= max_distance)
+        assert index.search(query, max_distance) == expected
+    assert (2, 'near') in index.search(query, 6)
+
+def test_readding_and_removing_keys():
+    index = HammingIndex()
+    index.add('a', 0)
+    index.add('a', (1 << 64) - 1)
+    assert len(index) == 1
+    assert index.search(0, 6) == []
+    index.remove('a')
+    assert len(index) == 0
+    assert all(not table for table in index.tables)
+
+def test_signed_storage_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert -(1 << 63) <= to_signed(value) < 1 << 63
+        assert to_unsigned(to_signed(value)) == value
+
+def test_index_picks_up_images_saved_elsewhere(app):
+    index = PerceptualIndex()
+    assert index.near_duplicates(1 << 63) == []
+
+    # Written by another worker after this one built its index
+    product = Product(title='Dunes', status='active')
+    db.session.add(product)
+    db.session.flush()
+    image = ProductImage(product_id=product.id, phash=to_signed(1 << 63), dhash=to_signed(5))
+    db.session.add(image)
+    db.session.commit()
+
+    matches = index.near_duplicates((1 << 63) | 1, dhash=4)
+    assert matches == [{'source': 'product_image', 'id': image.id, 'phash_distance': 1, 'dhash_distance': 1}]
+
+def test_backfill_hashes_images_saved_without_them(app, tmp_path):
+    path = tmp_path / 'art.png'
+    Image.effect_mandelbrot((64, 64), (-2, -1.5, 1, 1.5), 50).save(path)
+    product = Product(title='Fractal', status='active')
+    db.session.add(product)
+    db.session.flush()
+    image = ProductImage(product_id=product.id, original_key=artifact_store.put_file(str(path)))
+    db.session.add_all([image, ProductImage(product_id=product.id, print_file='/missing.png')])
+    db.session.commit()
+
+    assert backfill_image_hashes() == 1
+    assert (to_unsigned(image.phash), to_unsigned(image.dhash)) == tuple(image_hashes(str(path)).values())
+
+def test_saved_upload_is_matched_once(app):
+    index = PerceptualIndex()
+    index.add(('upload', 'dunes.png'), 1 << 63, 5)
+    assert [match['source'] for match in index.near_duplicates(1 << 63)] == ['upload']
+
+    # The pipeline saves the row and drops the upload key
+    product = Product(title='Dunes', status='active')
+    db.session.add(product)
+    db.session.flush()
+    image = ProductImage(product_id=product.id, phash=to_signed(1 << 63), dhash=to_signed(5))
+    db.session.add(image)
+    db.session.commit()
+    index.remove(('upload', 'dunes.png'))
+
+    assert [(match['source'], match['id']) for match in index.near_duplicates(1 << 63)] == [('product_image', image.id)]
+    assert index.last_image_id == image.id
+
+def test_reuse_from_a_saved_product_image(app):
+    product = Product(title='Dunes', status='active')
+    db.session.add(product)
+    db.session.flush()
+    description_key = artifact_store.put_bytes(b'{"title": "Dunes"}', '.json')
+    mockup_key = artifact_store.put_bytes(b'canvas mockup', '.jpg')
+    image = ProductImage(product_id=product.id, phash=1, description_key=description_key)
+    db.session.add(image)
+    db.session.flush()
+    db.session.add(ProductMockup(product_image_id=image.id, kind='canvas', option_group='Wall', artifact_key=mockup_key,
+                                 url='https://cdn.test/m.jpg', width=10, height=10, bytes=13))
+    db.session.commit()
+
+    checkpoint = Checkpoint('dunes-2.png')
+    match = {'source': 'product_image', 'id': image.id}
+    assert reuse_artifacts(checkpoint, match, ['mockups_canvas', 'descriptions'])
+    assert checkpoint.get('descriptions')['result'] == description_key
+    assert checkpoint.get('mockups_canvas')['result'][0]['key'] == mockup_key
+    assert checkpoint.get('mockups_canvas')['reused_from'] == f"product_image:{image.id}"
+    # Without poster mockups there is nothing to reuse for that stage, so nothing is copied
+    assert not reuse_artifacts(Checkpoint('dunes-3.png'), match, ['mockups_canvas', 'mockups_poster', 'descriptions'])
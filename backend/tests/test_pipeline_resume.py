@@ -0,0 +1,141 @@
+import io
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import image_processing
+import pipeline_checkpoints
+from artifact_storage import artifact_store
+from create_mockups import MOCKUP_PRODUCTS
+from image_processing import PIPELINE_STAGES, run_pipeline, store_upload
+from pipeline_checkpoints import Checkpoint, incomplete_checkpoints
+
+# Stand-ins for the stages that call external services, counting their calls
+class Services:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.calls = {}
+        self.failing = set()
+        self.described = []
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return name not in self.failing
+
+    def resize_image(self, file_path):
+        return artifact_store.put_bytes(b'print file', '.png') if self._call('resize') else None
+
+    def upload_image_to_imgbb(self, file_path):
+        return 'https://imgbb.test/image.png' if self._call('imgbb') else None
+
+    def generate_product_mockups(self, file_path, url, product):
+        if not self._call(f"mockups_{product}"):
+            return None
+        key = artifact_store.put_bytes(f"{product} mockup".encode(), '.jpg')
+        return [{'kind': product, 'option_group': 'Wall', 'key': key, 'path': artifact_store.local_path(key),
+                 'url': f"https://cdn.test/{product}.jpg", 'width': 10, 'height': 10, 'bytes': 10}]
+
+    def description_creation(self, file_name):
+        self.described.append(file_name)
+        if not self._call('descriptions'):
+            raise RuntimeError('OpenAI is down')
+        path = self.tmp_path / f"description-{self.calls['descriptions']}.json"
+        path.write_text(json.dumps({'title': 'Art'}))
+        return str(path)
+
+    def generate_upload_derivatives(self, original_key, mockups):
+        self._call('derivatives')
+        return {'main': {'jpg': ['/images/main/x/320.jpg', '/images/main/x/960.jpg']}, 'mockups': {}}
+
+@pytest.fixture
+def services(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline_checkpoints, 'CHECKPOINT_FOLDER', str(tmp_path / 'checkpoints'))
+    monkeypatch.setattr(image_processing, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    os.makedirs(image_processing.UPLOAD_FOLDER)
+    fakes = Services(tmp_path)
+    for name in ('resize_image', 'upload_image_to_imgbb', 'generate_product_mockups', 'description_creation',
+                 'generate_upload_derivatives'):
+        monkeypatch.setattr(image_processing, name, getattr(fakes, name))
+    return fakes
+
+def png(color, size=(48, 32)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def save_upload(name, data, product_id=None):
+    temp_path = os.path.join(image_processing.UPLOAD_FOLDER, 'received.upload')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    return store_upload(temp_path, name, product_id)
+
+def test_checkpoint_round_trip_and_incomplete_listing(services):
+    done = Checkpoint.load('done.png')
+    for stage in PIPELINE_STAGES:
+        done.complete(stage, {'stage': stage})
+    partial = Checkpoint.load('partial.png')
+    partial.complete('stripped', {'key': None})
+
+    assert Checkpoint.load('done.png').get('resized')['result'] == {'stage': 'resized'}
+    assert [checkpoint.filename for checkpoint in incomplete_checkpoints(PIPELINE_STAGES)] == ['partial.png']
+    # No temporary files are left next to the checkpoints
+    assert sorted(os.listdir(pipeline_checkpoints.CHECKPOINT_FOLDER)) == ['done.png.json', 'partial.png.json']
+
+def test_resume_runs_only_the_missing_stages(services, client):
+    path = save_upload('waves.png', png((30, 90, 200)))
+    upload_id = os.path.basename(path)
+    services.failing.add('descriptions')
+
+    result = run_pipeline(path)
+    assert (result['status'], result['failed_stage']) == ('failed', 'descriptions')
+    assert (result['upload_id'], result['filename']) == (upload_id, 'waves.png')
+    assert [checkpoint.filename for checkpoint in incomplete_checkpoints(PIPELINE_STAGES)] == [upload_id]
+    # The working file went into artifact storage with the stripped stage
+    assert os.listdir(image_processing.UPLOAD_FOLDER) == []
+
+    services.failing.clear()
+    response = client.post('/upload/resume', json={'upload_ids': [upload_id]})
+    assert response.status_code == 200
+    (resumed,) = response.get_json()['processed_data']
+    assert resumed['status'] == 'completed'
+    assert resumed['product_image_id']
+
+    # Everything before the failed stage ran exactly once, from the stored original
+    assert services.calls['resize'] == 1
+    assert all(services.calls[f"mockups_{product}"] == 1 for product in MOCKUP_PRODUCTS)
+    assert services.calls['descriptions'] == 2
+    assert services.described == ['waves.png', 'waves.png']
+    assert incomplete_checkpoints(PIPELINE_STAGES) == []
+    assert client.post('/upload/resume', json={}).get_json() == {'processed_data': []}
+
+def test_reupload_keeps_stages_of_identical_content(services):
+    data = png((200, 40, 40))
+    path = save_upload('poppy.png', data)
+    run_pipeline(path)
+    finished = Checkpoint.load(os.path.basename(path)).data['stages']
+
+    # The same bytes again: the same checkpoint, where only stripping of the new working file runs again
+    assert save_upload('poppy.png', data) == path
+    stages = Checkpoint.load(os.path.basename(path)).data['stages']
+    assert 'stripped' not in stages
+    assert stages['resized'] == finished['resized']
+    assert run_pipeline(path)['status'] == 'completed'
+    assert services.calls['resize'] == 1
+    assert os.listdir(image_processing.UPLOAD_FOLDER) == []
+
+def test_other_content_under_the_same_name_is_a_separate_upload(services):
+    first_path = save_upload('poppy.png', png((200, 40, 40)))
+    first = run_pipeline(first_path)
+
+    second_path = save_upload('poppy.png', png((10, 200, 10)))
+    assert second_path != first_path
+    assert Checkpoint.load(os.path.basename(second_path)).data['stages'] == {}
+    second = run_pipeline(second_path)
+
+    assert first['original_key'] != second['original_key']
+    assert first['product_image_id'] != second['product_image_id']
+    # The first upload's results are untouched
+    assert Checkpoint.load(os.path.basename(first_path)).get('stripped')['result']['key'] == first['original_key']
+    assert artifact_store.exists(first['original_key'])
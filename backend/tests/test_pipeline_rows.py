@@ -0,0 +1,112 @@
+import os
+import zlib
+
+from PIL import Image
+
+from artifact_storage import artifact_store
+from image_processing import PIPELINE_STAGES, UPLOAD_FOLDER, metadata_strip, prepare_checkpoint, run_pipeline
+from models import db, Product, ProductImage, ProductMockup
+from pipeline_checkpoints import Checkpoint
+
+MOCKUPS = [
+    {'kind': 'canvas', 'option_group': 'Wall', 'path': '/tmp/m1.jpg', 'key': 'a' * 64 + '.jpg',
+     'url': 'https://cdn.test/m1.jpg', 'width': 1000, 'height': 800, 'bytes': 1234},
+    {'kind': 'poster', 'option_group': 'Lifestyle', 'path': '/tmp/m2.jpg', 'key': 'b' * 64 + '.jpg',
+     'url': 'https://cdn.test/m2.jpg', 'width': 900, 'height': 900, 'bytes': 4321}
+]
+
+# An upload whose every stage except saving the rows has finished
+def finished_upload(filename, product_id=None):
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    Image.new('RGB', (40, 30), (10, 120, 200)).save(file_path)
+    prepare_checkpoint(file_path, filename, product_id)
+
+    checkpoint = Checkpoint.load(filename)
+    original_key = artifact_store.put_file(file_path)
+    resized_key = artifact_store.put_bytes(b'resized print', '.png')
+    results = {
+        'stripped': {'key': original_key},
+        'phash': {'phash': 1, 'dhash': 2, 'near_duplicates': []},
+        'facets': {'orientation': 'horizontal', 'aspect_ratio': 1.3333, 'dominant_color': '#0a78c8',
+                   'color_family': 'blue', 'palette': [{'color': '#0a78c8', 'family': 'blue', 'share': 1.0}]},
+        'resized': resized_key,
+        'descriptions': artifact_store.put_bytes(b'{}', '.json'),
+        'derivatives': {'main': {'jpg': [f"/images/main/{original_key}/{width}.jpg" for width in (320, 960)]},
+                        'mockups': {}}
+    }
+    for stage in PIPELINE_STAGES:
+        if stage == 'saved':
+            continue
+        if stage.startswith('mockups_'):
+            product = stage[len('mockups_'):]
+            results[stage] = [mockup for mockup in MOCKUPS if mockup['kind'] == product]
+        checkpoint.complete(stage, results[stage])
+    return file_path, original_key, resized_key
+
+def test_pipeline_writes_image_and_mockup_rows(app):
+    product = Product(title='Sunset', status='active')
+    db.session.add(product)
+    db.session.commit()
+
+    file_path, original_key, resized_key = finished_upload('sunset.png', product.id)
+    result = run_pipeline(file_path)
+
+    assert result['status'] == 'completed'
+    image = db.session.get(ProductImage, result['product_image_id'])
+    assert image.product_id == product.id
+    assert image.print_file_key == resized_key
+    assert image.print_file_crc32 == zlib.crc32(b'resized print')
+    assert image.main_image == f'/images/main/{original_key}/960.jpg'
+    assert image.original_key == original_key
+    assert image.description_key == Checkpoint.load('sunset.png').get('descriptions')['result']
+    assert (image.phash, image.dhash) == (1, 2)
+    assert (image.orientation, image.color_family, image.dominant_color) == ('horizontal', 'blue', '#0a78c8')
+    assert image.aspect_ratio == 1.3333
+    assert image.palette[0]['family'] == 'blue'
+    mockups = db.session.execute(db.select(ProductMockup).order_by(ProductMockup.id)).scalars().all()
+    assert [(mockup.product_image_id, mockup.url) for mockup in mockups] == [
+        (image.id, 'https://cdn.test/m1.jpg'), (image.id, 'https://cdn.test/m2.jpg')]
+
+def test_product_detail_links_mockup_derivatives(app, client):
+    product = Product(title='Meadow', status='active', price=10)
+    db.session.add(product)
+    db.session.commit()
+    run_pipeline(finished_upload('meadow.png', product.id)[0])
+
+    mockups = client.get(f'/products/{product.id}').get_json()['images'][0]['mockups']
+    assert [mockup['key'] for mockup in mockups] == [MOCKUPS[0]['key'], MOCKUPS[1]['key']]
+    assert mockups[0]['images']['webp'][0] == f"/images/mockup/{MOCKUPS[0]['key']}/320.webp"
+    # Internal paths and Printful's temporary links stay out of the public response
+    assert not {'path', 'url'} & set(mockups[0])
+
+def test_resumed_pipeline_does_not_duplicate_rows(app):
+    file_path, _, _ = finished_upload('harbour.png')
+    first = run_pipeline(file_path)
+    second = run_pipeline(file_path)
+
+    assert first['product_image_id'] == second['product_image_id']
+    assert db.session.get(Product, first['product_id']).status == 'draft'
+    assert db.session.query(ProductImage).count() == 1
+
+def test_metadata_strip_replaces_the_upload_atomically(app):
+    file_path = os.path.join(UPLOAD_FOLDER, 'exif.jpg')
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera maker'
+    Image.new('RGB', (20, 20), (200, 30, 30)).save(file_path, exif=exif)
+
+    assert metadata_strip(file_path) == file_path
+    with Image.open(file_path) as image:
+        assert image.format == 'JPEG'
+        assert not image.getexif()
+    assert not os.path.exists(f"{file_path}.tmp")
+
+def test_failed_metadata_strip_keeps_the_upload(app):
+    file_path = os.path.join(UPLOAD_FOLDER, 'broken.png')
+    with open(file_path, 'wb') as f:
+        f.write(b'not an image')
+
+    assert metadata_strip(file_path) is None
+    with open(file_path, 'rb') as f:
+        assert f.read() == b'not an image'
+    assert not os.path.exists(f"{file_path}.tmp")
@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+
+import pytest
+
+import metrics
+import profiling
+from artifact_storage import artifact_store
+from metrics import timed_stage
+from profiling import StageProfiler, profile_job, profile_link
+
+def job():
+    with timed_stage('test_outer'):
+        time.sleep(0.02)
+        with timed_stage('test_inner'):
+            data = bytearray(4 * 1024 * 1024)
+            time.sleep(0.03)
+            del data
+
+def test_stages_are_timed_sampled_and_traced():
+    profiler = StageProfiler('art.png', interval_ms=1, trace_memory=True)
+    profiler.start()
+    try:
+        job()
+        # Stages of other threads (another request) are not part of this job
+        other = threading.Thread(target=lambda: timed_stage('test_elsewhere').__enter__())
+        other.start()
+        other.join()
+    finally:
+        profiler.stop()
+    assert profiler.stage_started not in metrics.stage_start_observers
+    assert profiler.stage_finished not in metrics.stage_observers
+
+    report = profiler.report()
+    outer, inner = report['stages']['test_outer'], report['stages']['test_inner']
+    assert (outer['calls'], inner['calls']) == (1, 1)
+    assert outer['wall_seconds'] >= inner['wall_seconds'] >= 0.03
+    assert 'test_elsewhere' not in report['stages']
+    # The buffer allocated in the inner stage shows up in its peak and in the enclosing stage's
+    assert inner['peak_increase_bytes'] >= 4 * 1024 * 1024
+    assert outer['peak_traced_bytes'] >= inner['peak_traced_bytes']
+    # Samples land in the innermost running stage
+    assert inner['samples'] > 0 and outer['samples'] > 0
+    assert inner['top_functions'][0]['function'].endswith(':job')
+    assert all(line.split(';', 1)[0] in report['stages'] for line in report['collapsed_stacks'].splitlines())
+
+def test_profile_job_stores_the_report_also_when_the_job_fails():
+    with profile_job('off.png', False) as profiler:
+        assert profiler is None
+
+    with pytest.raises(RuntimeError):
+        with profile_job('broken.png', True) as profiler:
+            with timed_stage('test_failing'):
+                raise RuntimeError('stage failed')
+    with open(artifact_store.local_path(profiler.report_key)) as f:
+        report = json.load(f)
+    assert report['label'] == 'broken.png'
+    assert report['stages']['test_failing']['calls'] == 1
+    assert profile_link(profiler.report_key) == {'key': profiler.report_key, 'url': f"/profiles/{profiler.report_key}"}
+
+def test_concurrent_jobs_run_unprofiled_while_one_is_profiled():
+    with profile_job('first.png', True) as first:
+        with profile_job('second.png', True) as second:
+            assert second is None
+    assert first.report_key
+    # The lock is free again afterwards
+    with profile_job('third.png', True) as third:
+        assert third is not None
+
+def test_profile_token_enables_profiling(app, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    with app.test_request_context(headers={'X-Profile': 'secret'}):
+        assert profiling.profile_requested()
+    with app.test_request_context(headers={'X-Profile': 'guess'}):
+        assert not profiling.profile_requested()
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', None)
+    with app.test_request_context(headers={'X-Profile': ''}):
+        assert not profiling.profile_requested()
+
+def test_download_profile_is_for_admins(client, make_user):
+    with profile_job('art.png', True) as profiler:
+        job()
+    _, headers = make_user('ann@example.com', 'user')
+    _, admin_headers = make_user('admin@example.com', 'admin')
+    url = profile_link(profiler.report_key)['url']
+
+    assert client.get(url, headers=headers).status_code == 403
+    response = client.get(url, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['label'] == 'art.png'
+    collapsed = client.get(f"{url}?format=collapsed", headers=admin_headers)
+    assert collapsed.mimetype == 'text/plain'
+    assert collapsed.get_data(as_text=True).startswith('test_')
+    assert client.get(f"/profiles/{'0' * 64}.json", headers=admin_headers).status_code == 404
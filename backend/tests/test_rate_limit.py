@@ -0,0 +1,62 @@
+import rate_limit
+from rate_limit import SlidingWindowCounter
+
+# Stands in for the time module inside rate_limit
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def test_counts_up_to_the_limit(monkeypatch):
+    clock = Clock(1000.0)
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    counter = SlidingWindowCounter()
+
+    assert [counter.hit('ip:1', 3, 60)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = counter.hit('ip:1', 3, 60)
+    assert not allowed and retry_after >= 1
+    # Keys are counted separately
+    assert counter.hit('ip:2', 3, 60) == (True, 0)
+
+def test_previous_window_is_weighted_by_its_overlap(monkeypatch):
+    clock = Clock(60 * 100 + 59.0)
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    counter = SlidingWindowCounter()
+    for _ in range(4):
+        assert counter.hit('key', 4, 60)[0]
+
+    # 15 seconds into the next window three quarters of the previous count still apply: 4 * 0.75 = 3
+    clock.now = 60 * 101 + 15.0
+    assert counter.hit('key', 4, 60) == (True, 0)
+    allowed, retry_after = counter.hit('key', 4, 60)
+    assert not allowed
+    # Waiting as long as told lets the next request through
+    clock.now += retry_after
+    assert counter.hit('key', 4, 60)[0]
+
+    # Two windows later nothing is left of the old counts
+    clock.now = 60 * 103 + 1.0
+    assert [counter.hit('key', 4, 60)[0] for _ in range(4)] == [True] * 4
+
+def test_expired_keys_are_swept(monkeypatch):
+    clock = Clock(1000.0)
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    counter = SlidingWindowCounter()
+    for index in range(10):
+        counter.hit(f"ip:{index}", 5, 10)
+    assert len(counter) == 10
+
+    clock.now += rate_limit.SWEEP_INTERVAL + 30
+    counter.hit('ip:new', 5, 10)
+    assert len(counter) == 1
+
+def test_limited_endpoint_answers_429(client, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(rate_limit, 'rate_limit_counter', SlidingWindowCounter())
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_PER_EMAIL', 2)
+    statuses = [client.post('/login', json={'email': 'nobody@example.com', 'password': 'x'}).status_code
+                for _ in range(3)]
+    assert 429 not in statuses[:2]
+    assert statuses[2] == 429
@@ -0,0 +1,28 @@
+import time
+
+from models import db, Product, ProductImage
+from response_cache import LRUCache, response_cache
+
+def test_local_entries_expire():
+    cache = LRUCache(max_bytes=1024, max_entries=10, ttl=0.05)
+    cache.set('key', 'etag', b'body')
+    assert cache.get('key') == ('etag', b'body')
+    time.sleep(0.06)
+    assert cache.get('key') is None
+    assert cache.size == 0
+
+def test_etag_follows_the_body(app, client):
+    response_cache.clear()
+    product = Product(title='Dunes', status='active')
+    db.session.add(product)
+    db.session.commit()
+
+    first = client.get(f'/products/{product.id}')
+    assert client.get(f'/products/{product.id}', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    # A new image does not touch Product.updated_at, but it changes what the detail page shows
+    db.session.add(ProductImage(product_id=product.id, main_image='/images/main/dunes.png/960.jpg'))
+    db.session.commit()
+    second = client.get(f'/products/{product.id}', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
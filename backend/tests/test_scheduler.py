@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import scheduler
+from models import db, User
+from scheduler import job_lock, job_overlaps, job_runs, job_seconds, run_job
+
+@pytest.fixture
+def jobs(app, monkeypatch):
+    # run_job enters the app of app.py, which points at Postgres; the test app runs on SQLite
+    monkeypatch.setattr(scheduler, 'app', app)
+    monkeypatch.setattr(scheduler, '_local_locks', {})
+    return app
+
+def runs(name):
+    return job_runs.value(name, 'ok'), job_runs.value(name, 'error')
+
+def test_job_lock_is_exclusive_per_job(jobs):
+    with job_lock('gc') as first:
+        with job_lock('gc') as second, job_lock('warm') as other:
+            assert (first, second, other) == (True, False, True)
+    with job_lock('gc') as again:
+        assert again
+
+def test_run_job_counts_successes_and_failures(jobs):
+    calls = []
+    observed = sum(sum(counts[:-1]) for counts in job_seconds._values.values())
+
+    run_job('test_ok', lambda: calls.append('ok') or {'done': 1})
+    assert calls == ['ok']
+    assert runs('test_ok') == (1, 0)
+
+    def broken():
+        db.session.add(User(first_name='Half', last_name='Written', email='half@example.com'))
+        db.session.flush()
+        raise RuntimeError('boom')
+    run_job('test_error', broken)
+    assert runs('test_error') == (0, 1)
+    # The failed job's writes were rolled back
+    assert db.session.execute(db.select(User).where(User.email == 'half@example.com')).first() is None
+
+    assert sum(sum(counts[:-1]) for counts in job_seconds._values.values()) == observed + 2
+
+def test_locked_job_is_skipped_and_counted(jobs):
+    calls = []
+    skipped = job_overlaps.value('test_locked', 'locked')
+    # Another instance holds the job's lock
+    with job_lock('test_locked'):
+        run_job('test_locked', lambda: calls.append('ran'))
+
+    assert calls == []
+    assert job_overlaps.value('test_locked', 'locked') == skipped + 1
+    assert runs('test_locked') == (0, 0)
+
+    run_job('test_locked', lambda: calls.append('ran'))
+    assert calls == ['ran']
+
+def test_overlapping_runs_in_one_process_are_counted(jobs):
+    running = job_overlaps.value('warm_caches', 'running')
+    scheduler._count_running_overlap(SimpleNamespace(job_id='warm_caches'))
+    assert job_overlaps.value('warm_caches', 'running') == running + 1
+
+    created = scheduler.create_scheduler()
+    assert {job.id: (job.max_instances, job.coalesce) for job in created.get_jobs()} == {
+        name: (1, True) for name, _, _ in scheduler.JOBS}
+
+def test_expired_verification_codes_are_cleared(jobs, make_user):
+    expired, _ = make_user('old@example.com')
+    fresh, _ = make_user('new@example.com')
+    expired.verification_code, expired.verification_code_created_at = '111111', datetime.utcnow() - timedelta(hours=1)
+    fresh.verification_code, fresh.verification_code_created_at = '222222', datetime.utcnow()
+    db.session.commit()
+
+    assert scheduler.remove_expired_verification_codes() == {'expired': 1}
+    db.session.expire_all()
+    assert (expired.verification_code, expired.verification_code_created_at) == (None, None)
+    assert fresh.verification_code == '222222'
@@ -0,0 +1,63 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import zip_stream
+from zip_stream import StreamingZip
+
+@pytest.fixture
+def entries(tmp_path):
+    files = []
+    for index, size in enumerate((0, 1, 70000, 3 * 1024 * 1024 + 5)):
+        path = tmp_path / f"print-{index}.png"
+        path.write_bytes(os.urandom(size))
+        files.append((f"order/{index}-print.png", str(path)))
+    return files
+
+def read_back(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+def expected(entries):
+    return {arcname: open(path, 'rb').read() for arcname, path in entries}
+
+@pytest.mark.parametrize('zip64', [False, True])
+def test_archive_round_trips_through_zipfile(entries, zip64):
+    zip_stream._crc_cache.clear()
+    archive = StreamingZip(entries, zip64=zip64)
+    data = b''.join(archive.iter_bytes())
+    assert len(data) == archive.size
+    assert read_back(data) == expected(entries)
+
+def test_ranges_join_into_the_same_archive(entries):
+    whole = b''.join(StreamingZip(entries).iter_bytes())
+    # A fresh process has no CRCs yet: the descriptors of skipped files are computed by reading them
+    zip_stream._crc_cache.clear()
+    archive = StreamingZip(entries)
+    cuts = [0, 17, 70050, 2 * 1024 * 1024, archive.size - 30, archive.size]
+    parts = [b''.join(archive.iter_bytes(start, end)) for start, end in zip(cuts, cuts[1:])]
+    assert b''.join(parts) == whole
+    assert read_back(whole) == expected(entries)
+
+def test_crc_cache_is_bounded(entries, monkeypatch):
+    monkeypatch.setattr(zip_stream, 'CRC_CACHE_MAX_ENTRIES', 2)
+    zip_stream._crc_cache.clear()
+    b''.join(StreamingZip(entries).iter_bytes())
+    assert len(zip_stream._crc_cache) == 2
+    # The most recently used entries are the ones kept
+    assert [key[0] for key in zip_stream._crc_cache] == [path for _, path in entries[-2:]]
+
+def test_stored_crcs_answer_resumed_ranges_without_reading(entries, monkeypatch):
+    whole = b''.join(StreamingZip(entries).iter_bytes())
+    stored = [(arcname, path, zip_stream.file_crc32(path)) for arcname, path in entries]
+    zip_stream._crc_cache.clear()
+
+    def no_reads(path):
+        raise AssertionError(f"{path} was read for its CRC")
+    monkeypatch.setattr(zip_stream, 'file_crc32', no_reads)
+    archive = StreamingZip(stored)
+    # The tail of the archive: every descriptor and the central directory, none of the earlier data
+    assert b''.join(archive.iter_bytes(archive.size - 500)) == whole[-500:]
@@ -1,52 +1,42 @@
 # app.py
 
-from flask import Flask, request, jsonify, url_for
+from flask import request, jsonify, url_for
 from models import db, User
 import os
-from urllib.parse import quote_plus
 from dotenv import load_dotenv
 from datetime import datetime
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
-from pybloom_live import BloomFilter
+from password_policy import is_weak_password
 import secrets
-from urllib.parse import quote_plus
 
 # Bearer token import
 from flask_jwt_extended import JWTManager
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, get_jwt
+from auth_tokens import jwt_cached_required, revoke_token
 
 # Importing the SMTP lib
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-
-# Create a Flask web application instance
-app = Flask(__name__)
+from metrics import track_external
+from rate_limit import rate_limited
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Database configuration - Retrieve values from environment variables
-db_name = os.getenv('DB_NAME')
-username = os.getenv('DB_USERNAME')
-password = quote_plus(os.getenv('DB_PASSWORD'))  # Encode the password with special characters
-host = os.getenv('DB_HOST')
-port = os.getenv('DB_PORT')
-
-# Construct the database URL using the retrieved configuration values
-db_url = f"postgresql://{username}:{password}@{host}:{port}/{db_name}"
-
-# Configure the Flask app with the database URL and disable modification tracking
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-db.init_app(app)
-
 # Password hasher instance
 ph = PasswordHasher()
 
 # Importing backend URL
 backend_url = os.getenv('BACKEND_URL')
 
+# SMTP connection - SSL by default, plain SMTP when MAIL_USE_SSL is off (e.g. a local test server)
+def smtp_connection(server, port):
+    if os.getenv('MAIL_USE_SSL', 'true').lower() in ('0', 'false', 'no'):
+        return smtplib.SMTP(server, port)
+    return smtplib.SMTP_SSL(server, port)
+
 # Verification code generator
 def generate_verification_code():
     return secrets.randbelow(900000) + 100000
@@ -79,7 +69,7 @@ def check_mail_connection():
         message.attach(MIMEText("This is a test", 'plain'))
 
         # Connect to the server using SSL
-        with smtplib.SMTP_SSL(mail_server, mail_port) as server:
+        with smtp_connection(mail_server, mail_port) as server:
             # Log in to the server
             server.login(mail_username, mail_password)
 
@@ -93,19 +83,9 @@ def check_mail_connection():
         print(f"Exception during email sending: {str(e)}")
         return jsonify({"error": f"Failed to establish mail connection. Error: {str(e)}"}), 500
 
-# Checking if the password is in 100K Most Common Passwords list
-
-password_file = "required_files/100k-most-used-passwords.txt"
-with open(password_file, "r", encoding="latin-1") as file:
-    rockyou_passwords = set(file.read().split("\n"))
-    bloom_filter = BloomFilter(capacity=len(rockyou_passwords), error_rate=0.1)
-    for password in rockyou_passwords:
-        bloom_filter.add(password)
-
-def is_weak_password(password):
-    return password in bloom_filter
 
 # Creating a user
+@rate_limited('register')
 def register():
     data = request.get_json()
 
@@ -135,10 +115,11 @@ def register():
         last_name=data['last_name'],
         email=data['email'],
         password=ph.hash(data['password']),  # Hashing the password using Argon2
-        role=data.get('role', 'user'),
+        # Role and verification are never taken from the request: admin_required trusts User.role
+        role='user',
         email_list=data.get('email_list', False),  # Default to False if not provided
-        logged_in=data.get('logged_in', True),
-        verified_email=data.get('verified_email', False),  # Default to False if not provided
+        logged_in=True,
+        verified_email=False,
         verification_code=verification_code,
         verification_code_created_at = datetime.utcnow(),
         created_at=datetime.utcnow(),
@@ -181,7 +162,7 @@ def send_verification_code(user):
 
     try:
         # Connect to the server using SSL
-        with smtplib.SMTP_SSL(os.getenv('MAIL_SERVER'), int(os.getenv('MAIL_PORT', 465))) as server:
+        with track_external('smtp'), smtp_connection(os.getenv('MAIL_SERVER'), int(os.getenv('MAIL_PORT', 465))) as server:
             # Log in to the server
             server.login(os.getenv('MAIL_USERNAME'), os.getenv('MAIL_PASSWORD'))
 
@@ -195,7 +176,8 @@ def send_verification_code(user):
         return jsonify({"error": f"Failed to send verification code. Error: {str(e)}"}), 500
 
 # Verifying the 6-digit code
-@jwt_required()
+@rate_limited('verify_code')
+@jwt_cached_required()
 def verify_code():
     data = request.get_json()
     
@@ -227,8 +209,9 @@ def verify_code():
     else:
         return jsonify({"error": "Invalid verification code"}), 400
     
-# Generating another verification code
-@jwt_required()
+# Generating another verification code (each one is an SMTP send, so fewer per email)
+@rate_limited('send_new_verification_code', per_email=2)
+@jwt_cached_required()
 def send_new_verification_code():
     data = request.get_json()
 
@@ -265,31 +248,12 @@ def send_new_verification_code():
 
     return jsonify({"message": "New verification code has been sent"}), 200
 
-@jwt_required()
+@jwt_cached_required()
 def logout():
-    # Get the current user's identity from the JWT token
-    current_user_email = get_jwt_identity()
+    # Revoke the current token by its jti; it stays in the revocation set until it expires
+    revoke_token(get_jwt())
 
-    # Check if the user is already logged out
-    user = User.query.filter_by(email=current_user_email).first()
-    if not user or not user.logged_in:
-        return jsonify({"message": "User is already logged out."}), 200
-
-    # Optionally, you can perform additional actions here before logging out.
-
-    # Set the user's 'logged_in' status to False in the database
-    user.logged_in = False
-    db.session.commit()  # Save the changes to the database
-
-    # Create a new access token with a short expiration time (revoking the current token)
-    # This effectively logs the user out by invalidating their current access token
-    new_access_token = create_access_token(identity=current_user_email, expires_delta=False)
-
-    # Set the new access token in a response cookie (you can customize this part)
-    response = jsonify({"message": "Logged out successfully"})
-    response.set_cookie('access_token', new_access_token, httponly=True, secure=True)  # Customize the cookie settings
-
-    return response, 200
+    return jsonify({"message": "Logged out successfully"}), 200
 
 # Verify the password against the hashed password
 def verify_password(plain_password, hashed_password):
@@ -300,6 +264,7 @@ def verify_password(plain_password, hashed_password):
         return False  # Passwords do not match
 
 # Login an existing user and generate a bearer token
+@rate_limited('login')
 def login():
     data = request.get_json()
 
@@ -317,15 +282,7 @@ def login():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    # Check if the user is already logged in
-    if user.logged_in:
-        return jsonify({"message": "User is already logged in."}), 200
-
     if verify_password(password, user.password):
-        # Set user as logged in in the database
-        user.logged_in = True
-        db.session.commit()  # Save the changes to the database
-
         # Generate a bearer token for the authenticated user
         access_token = create_access_token(identity=user.email)
         return jsonify({
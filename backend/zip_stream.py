@@ -0,0 +1,197 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+BLOCK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+
+# Bit 3: sizes and CRC follow the data in a descriptor, bit 11: UTF-8 names
+FLAGS = 0x0808
+
+# CRCs of files already read once, so a resumed download does not have to re-read everything.
+# Least recently used first; every (path, size, mtime) ever served would otherwise stay in memory.
+CRC_CACHE_MAX_ENTRIES = 10000
+_crc_cache = OrderedDict()
+_crc_lock = threading.Lock()
+
+def _dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # ZIP dates start in 1980
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+# CRC-32 of a file, read in 1 MB blocks
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+class ZipEntry:
+    # crc is the CRC-32 stored with the file when it is known (ProductImage.print_file_crc32)
+    def __init__(self, arcname, path, crc=None):
+        stat = os.stat(path)
+        self.known_crc = crc
+        self.arcname = arcname.encode('utf-8')
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.dos_time, self.dos_date = _dos_datetime(stat.st_mtime)
+
+    @property
+    def cache_key(self):
+        return (self.path, self.size, self.mtime_ns)
+
+    def cached_crc(self):
+        if self.known_crc is not None:
+            return self.known_crc
+        with _crc_lock:
+            crc = _crc_cache.get(self.cache_key)
+            if crc is not None:
+                _crc_cache.move_to_end(self.cache_key)
+            return crc
+
+    def remember_crc(self, crc):
+        with _crc_lock:
+            _crc_cache[self.cache_key] = crc
+            _crc_cache.move_to_end(self.cache_key)
+            while len(_crc_cache) > CRC_CACHE_MAX_ENTRIES:
+                _crc_cache.popitem(last=False)
+
+    # Read the file once to get its CRC (only needed when a range skips over part of its data and the CRC was not stored)
+    def crc(self):
+        crc = self.cached_crc()
+        if crc is None:
+            crc = file_crc32(self.path)
+            self.remember_crc(crc)
+        return crc
+
+# A STORE-mode ZIP whose byte layout is fully determined by the entries' names and sizes,
+# so its length is known up front and any byte range can be produced without building the archive.
+# Entries are (arcname, path) or (arcname, path, crc) when the CRC-32 was stored with the file.
+class StreamingZip:
+    def __init__(self, entries, zip64=None):
+        self.entries = [ZipEntry(*entry) for entry in entries]
+        data_total = sum(entry.size for entry in self.entries)
+        # ZIP64 is decided for the whole archive, so offsets never depend on where a range starts
+        self.zip64 = zip64 if zip64 is not None else len(self.entries) >= 0xFFFF or data_total >= ZIP64_LIMIT
+        self.segments = []
+        offset = 0
+        self.local_offsets = []
+        for index, entry in enumerate(self.entries):
+            self.local_offsets.append(offset)
+            header = self._local_header(entry)
+            offset = self._add_segment(offset, len(header), 'bytes', header)
+            offset = self._add_segment(offset, entry.size, 'file', index)
+            offset = self._add_segment(offset, 24 if self.zip64 else 16, 'descriptor', index)
+        self.central_offset = offset
+        self.central_size = sum(46 + len(entry.arcname) + (28 if self.zip64 else 0) for entry in self.entries)
+        offset = self._add_segment(offset, self.central_size, 'central', None)
+        self.end_offset = offset
+        self.end_size = (56 + 20 if self.zip64 else 0) + 22
+        self.size = self._add_segment(offset, self.end_size, 'end', None)
+
+    def _add_segment(self, offset, length, kind, payload):
+        self.segments.append((offset, length, kind, payload))
+        return offset + length
+
+    # Strong validator: changes whenever a file or the layout changes
+    @property
+    def etag(self):
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(entry.arcname + f":{entry.size}:{entry.mtime_ns};".encode())
+        return digest.hexdigest()
+
+    @property
+    def last_modified(self):
+        return max((entry.mtime_ns for entry in self.entries), default=0) / 1e9
+
+    def _local_header(self, entry):
+        version = 45 if self.zip64 else 20
+        extra = b''
+        size_field = 0
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            size_field = ZIP64_LIMIT
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, version, FLAGS, 0, entry.dos_time, entry.dos_date,
+                           0, size_field, size_field, len(entry.arcname), len(extra)) + entry.arcname + extra
+
+    def _descriptor(self, index):
+        entry = self.entries[index]
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, entry.crc(), entry.size, entry.size)
+        return struct.pack('<IIII', 0x08074b50, entry.crc(), entry.size, entry.size)
+
+    def _central_directory(self):
+        records = []
+        version = 45 if self.zip64 else 20
+        for entry, local_offset in zip(self.entries, self.local_offsets):
+            if self.zip64:
+                extra = struct.pack('<HHQQQ', 0x0001, 24, entry.size, entry.size, local_offset)
+                size_field, offset_field = ZIP64_LIMIT, ZIP64_LIMIT
+            else:
+                extra = b''
+                size_field, offset_field = entry.size, local_offset
+            records.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, FLAGS, 0,
+                                       entry.dos_time, entry.dos_date, entry.crc(), size_field, size_field,
+                                       len(entry.arcname), len(extra), 0, 0, 0, 0o100644 << 16, offset_field))
+            records.append(entry.arcname + extra)
+        return b''.join(records)
+
+    def _end_records(self):
+        count = len(self.entries)
+        records = b''
+        if self.zip64:
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                                   self.central_size, self.central_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, self.end_offset, 1)
+            return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+                                         ZIP64_LIMIT, ZIP64_LIMIT, 0)
+        return struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, self.central_size, self.central_offset, 0)
+
+    def _file_blocks(self, index, start, end):
+        entry = self.entries[index]
+        # Compute the CRC on the fly while a whole file goes by, so a full download reads every file once
+        full = start == 0 and end == entry.size and entry.cached_crc() is None
+        crc = 0
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = f.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError(f"{entry.path} changed while it was being sent")
+                if full:
+                    crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+                yield block
+        if full:
+            entry.remember_crc(crc)
+
+    # Bytes [start, end) of the archive, generated block by block
+    def iter_bytes(self, start=0, end=None):
+        end = self.size if end is None else end
+        for offset, length, kind, payload in self.segments:
+            segment_end = offset + length
+            if segment_end <= start or length == 0:
+                continue
+            if offset >= end:
+                break
+            lo = max(start, offset) - offset
+            hi = min(end, segment_end) - offset
+            if kind == 'file':
+                yield from self._file_blocks(payload, lo, hi)
+            elif kind == 'bytes':
+                yield payload[lo:hi]
+            elif kind == 'descriptor':
+                yield self._descriptor(payload)[lo:hi]
+            elif kind == 'central':
+                yield self._central_directory()[lo:hi]
+            else:
+                yield self._end_records()[lo:hi]